@@ -26,7 +26,12 @@ CACHES = {
 LANGUAGE_CODE = 'en_US'
 LANGUAGE_PATHS = []
 # 数据库配置
+# OPTIONS中的SLOW_QUERY_MS（毫秒）开启慢查询日志，SLOW_QUERY_INTERVAL为同一语句两次记录的最小间隔（秒）
+# OPTIONS中的QUERY_CACHE为保存表版本号的缓存（CACHES中的别名），设置后才能使用查询结果缓存（query.cache()）
 DATABASES = {}
+# 接收每个请求SQL统计的回调，可以是点分路径，参数为(handler, QueryStats)，None代表不收集
+# DEBUG模式下还会通过Server-Timing响应头返回统计
+QUERY_STATS_SINK = None
 # model迁移
 INSTALLED_APPS = []
 # 解析
@@ -45,11 +45,32 @@ class ConnectionHandler(object):
         options.setdefault("CHARSET", "utf8")
         options.setdefault("CONNECT_TIMEOUT", 10)
         options.setdefault("MINSIZE", 1)  # 连接池最小连接数
-        options.setdefault("MAXSIZE", 1)  # 连接池最大连接数
+        options.setdefault("MAXSIZE", 10)  # 连接池最大连接数
 
         for setting in ['NAME', 'USER', 'PASSWORD', 'HOST', 'PORT']:
             conn.setdefault(setting, '')
 
+        conn.setdefault("REPLICAS", [])  # 只读副本，未设置的参数与主库相同
+        conn.setdefault("REPLICA_POLICY", "round_robin")  # 副本选择策略：round_robin 或 least_inflight
+        conn.setdefault("READ_AFTER_WRITE", 1.0)  # 写操作后多少秒内，同一请求中的读查询仍使用主库
+
+    @staticmethod
+    def replica_settings(db, replica):
+        """
+        生成副本的连接参数，副本未设置的参数使用主库的值
+        :param db: 主库的连接参数
+        :param replica: 副本的连接参数
+        :return: (连接参数, 权重)
+        """
+        replica = dict(replica)
+        weight = replica.pop("WEIGHT", 1)
+        options = dict(db["OPTIONS"], **replica.pop("OPTIONS", {}))
+
+        settings_dict = {k: v for k, v in db.items() if k not in ("REPLICAS", "REPLICA_POLICY", "READ_AFTER_WRITE")}
+        settings_dict.update(replica)
+        settings_dict["OPTIONS"] = options
+        return settings_dict, weight
+
     @staticmethod
     def load_backend(backend_name):
         """
@@ -76,6 +97,15 @@ class ConnectionHandler(object):
         db = self.databases[alias]
         backend = self.load_backend(db['ENGINE'])
         conn = backend.DatabaseWrapper(db, alias).connection
+
+        if db['REPLICAS']:
+            replicas, weights = [], []
+            for replica in db['REPLICAS']:
+                replica_db, weight = self.replica_settings(db, replica)
+                replicas.append(backend.DatabaseWrapper(replica_db, alias).connection)
+                weights.append(weight)
+            conn.set_replicas(replicas, weights, db['REPLICA_POLICY'], db['READ_AFTER_WRITE'])
+
         setattr(self._connections, alias, conn)
         return conn
 
@@ -2,15 +2,34 @@
 """
 分页处理
 """
+import json
+import asyncio
+import hashlib
+import logging
 from math import ceil
 from urllib import parse
 from collections import OrderedDict
+from tornado.web import decode_signed_value
+from rest_framework.core.cache import caches, DEFAULT_CACHE_ALIAS
 from rest_framework.core.response import Response
 from rest_framework.core.translation import gettext as _
 from rest_framework.core.exceptions import PaginationError
 from rest_framework.lib.orm.query import AsyncEmptyQuery
+from rest_framework.lib.orm.utils import gather
+from rest_framework.utils.transcoder import force_text, force_bytes
 from rest_framework.utils.cached_property import cached_property, async_cached_property
 
+logger = logging.getLogger(__name__)
+
+# 总记录数的统计方式：
+# exact 每次精确统计；cached 精确统计并按过滤后的查询缓存一段时间；
+# estimated 取数据库的行数估计；none 不统计，通过多取一条数据判断是否有下一页
+COUNT_EXACT = "exact"
+COUNT_CACHED = "cached"
+COUNT_ESTIMATED = "estimated"
+COUNT_NONE = "none"
+COUNT_STRATEGIES = (COUNT_EXACT, COUNT_CACHED, COUNT_ESTIMATED, COUNT_NONE)
+
 
 def replace_query_param(url, key, val):
     (scheme, netloc, path, query, fragment) = parse.urlsplit(url)
@@ -61,16 +80,41 @@ class BasePagination(object):
 
 class Paginator(object):
 
-    def __init__(self, queryset, page_size, orphans=0):
+    def __init__(self, queryset, page_size, orphans=0, count_strategy=COUNT_EXACT,
+                 count_cache_timeout=60, count_cache_alias=DEFAULT_CACHE_ALIAS, estimate_threshold=1000):
         """
         :param queryset:
         :param page_size:
         :param orphans:
+        :param count_strategy: 总记录数的统计方式，见COUNT_STRATEGIES
+        :param count_cache_timeout: cached方式下总记录数的缓存时间（秒）
+        :param count_cache_alias: cached方式使用的缓存
+        :param estimate_threshold: estimated方式下估计值小于该值时改为精确统计
         """
+        if count_strategy not in COUNT_STRATEGIES:
+            raise ValueError("Unknown count strategy: %r, must be one of %s" % (count_strategy, COUNT_STRATEGIES))
+
         self.queryset = queryset
         self.page_size = page_size
         self._page_number = 0
         self.orphans = orphans
+        self.count_strategy = count_strategy
+        self.count_cache_timeout = count_cache_timeout
+        self.count_cache_alias = count_cache_alias
+        self.estimate_threshold = estimate_threshold
+        # count是否为精确值，不精确时通过多取一条数据判断是否有下一页
+        self.exact = count_strategy != COUNT_NONE
+        self._has_next = False
+
+    def get_offset(self, page_number):
+        """
+        :param page_number: 页码
+        :return: 页码对应的偏移量，需要先统计总数
+        """
+        bottom = (page_number - 1) * self.page_size
+        if bottom + self.orphans >= self.count:
+            bottom = self.count
+        return bottom
 
     async def page_data(self, page_number):
         """
@@ -78,29 +122,98 @@ class Paginator(object):
         :return:
         """
         self._page_number = page_number
+        if not self.exact:
+            bottom = (self._page_number - 1) * self.page_size
+            rows = await self.queryset.limit(self.page_size + 1).offset(bottom)
+            self._has_next = len(rows) > self.page_size
+            return rows[:self.page_size]
+
+        return self.queryset.limit(self.page_size).offset(self.get_offset(page_number))
+
+    async def page_data_concurrently(self, page_number):
+        """
+        不等待总数，在两个连接上同时统计总数和查询页码对应的数据
+        :param page_number: 页码
+        :return: (偏移量, 数据)
+        """
+        self._page_number = page_number
         bottom = (self._page_number - 1) * self.page_size
-        count = self.count
-        if bottom + self.orphans >= count:
-            bottom = self.count
+        query = self.queryset.limit(self.page_size).offset(bottom)
+
+        async def fetch():
+            return await query
 
-        return self.queryset.limit(self.page_size).offset(bottom)
+        _, rows = await gather(self.count, fetch())
+        return bottom, rows
 
     @async_cached_property
     async def count(self):
         """
-        总记录大小
+        总记录大小，none方式下为None
         """
+        if self.count_strategy == COUNT_NONE:
+            return None
+
+        if hasattr(self.queryset, "sql"):
+            if self.count_strategy == COUNT_CACHED:
+                return await self.cached_count()
+            if self.count_strategy == COUNT_ESTIMATED:
+                return await self.estimated_count()
+        return await self.exact_count()
+
+    async def exact_count(self):
         try:
             count = await self.queryset.count()
             return count
         except (AttributeError, TypeError):
             return len(await self.queryset)
 
+    def get_count_cache_key(self):
+        """
+        以过滤后查询的SQL及参数作为缓存key，排序不影响总数
+        """
+        sql, params = self.queryset.order_by().sql()
+        fingerprint = hashlib.md5(force_bytes(repr((sql, params)))).hexdigest()
+        return "paginator:count:%s" % fingerprint
+
+    async def cached_count(self):
+        cache = caches[self.count_cache_alias]
+        key = self.get_count_cache_key()
+        try:
+            count = cache.get(key)
+            if asyncio.iscoroutine(count):
+                count = await count
+        except Exception:
+            logger.exception("Get cache error, Exception possibly due to cache backend")
+            return await self.exact_count()
+
+        if count is not None:
+            return count
+
+        count = await self.exact_count()
+        try:
+            result = cache.set(key, count, timeout=self.count_cache_timeout)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception("Set cache error, Exception possibly due to cache backend")
+        return count
+
+    async def estimated_count(self):
+        estimate = await self.queryset.estimate_count()
+        if estimate < self.estimate_threshold:
+            return await self.exact_count()
+
+        self.exact = False
+        return estimate
+
     @cached_property
     def num_pages(self):
         """
         总页数
         """
+        if self.count is None:
+            return None
         if self.count == 0:
             return 0
         hits = max(1, self.count - self.orphans)
@@ -111,6 +224,8 @@ class Paginator(object):
         判断是否有下一页
         :return:
         """
+        if not self.exact:
+            return self._has_next
         return self._page_number < self.num_pages
 
     def has_previous(self):
@@ -159,20 +274,28 @@ class PageNumberPagination(BasePagination):
     allow_first_page = True
     # 当页码超过总页码时，是否允许返回最后一页的数据列表 True代表可以，False代表不处理
     allow_last_page = True
+    # 总记录数的统计方式：exact、cached、estimated、none，见COUNT_STRATEGIES
+    count_strategy = COUNT_EXACT
+    # cached方式下总记录数的缓存时间（秒）及使用的缓存
+    count_cache_timeout = 60
+    count_cache_alias = DEFAULT_CACHE_ALIAS
+    # estimated方式下估计值小于该值时改为精确统计
+    count_estimate_threshold = 1000
+    # 是否同时统计总数和查询数据（占用两个连接），页码超出范围时会多一次查询；只对exact、cached方式生效
+    concurrent_count = False
 
-    def get_page_number(self):
+    def get_requested_page_number(self):
         """
-        获得页码
-        :return:
+        获得请求的页码，不依赖总数
+        :return: 请求最后一页时返回None
         """
         page_number = self.request_handler.get_query_argument(self.page_query_param, 1)
-        num_pages = self.paginator.num_pages
 
         if page_number in self.first_page_strings:
             page_number = 1
 
         if page_number in self.last_page_strings:
-            page_number = num_pages
+            return None
 
         try:
             page_number = int(page_number)
@@ -185,7 +308,23 @@ class PageNumberPagination(BasePagination):
             else:
                 raise PaginationError(detail=_("The page number must be greater than 1"))
 
-        if page_number > num_pages:
+        return page_number
+
+    def get_page_number(self):
+        """
+        获得页码
+        :return:
+        """
+        page_number = self.get_requested_page_number()
+        num_pages = self.paginator.num_pages
+
+        if page_number is None:
+            if num_pages is None:
+                raise PaginationError(detail=_("The last page is not available without a total count"))
+            page_number = num_pages
+
+        # 总数不精确时不按总页码修正页码，超出范围的页码返回空列表
+        if self.paginator.exact and page_number > num_pages:
             if self.allow_last_page:
                 page_number = num_pages
 
@@ -217,8 +356,19 @@ class PageNumberPagination(BasePagination):
         if not page_size:
             return AsyncEmptyQuery()
 
-        paginator = self.paginator_class(queryset, page_size, self.orphans)
+        paginator = self.paginator_class(
+            queryset, page_size, self.orphans,
+            count_strategy=self.count_strategy,
+            count_cache_timeout=self.count_cache_timeout,
+            count_cache_alias=self.count_cache_alias,
+            estimate_threshold=self.count_estimate_threshold
+        )
         setattr(self, "paginator", paginator)
+        if self.concurrent_count and self.can_count_concurrently(queryset):
+            page_number = self.get_requested_page_number()
+            if page_number is not None:
+                return await self.paginate_concurrently(page_number)
+
         if await self.paginator.count == 0:
             return AsyncEmptyQuery()
 
@@ -226,6 +376,31 @@ class PageNumberPagination(BasePagination):
 
         return await self.paginator.page_data(page_number)
 
+    def can_count_concurrently(self, queryset):
+        """
+        需要精确总数且当前Task没有绑定连接（如处于事务中）时才能在另一个连接上同时统计总数；
+        estimated方式在得到估计值之前无法知道总数是否精确，不精确时需要多取一条数据判断是否有下一页
+        """
+        if self.paginator.count_strategy not in (COUNT_EXACT, COUNT_CACHED) or not hasattr(queryset, "database"):
+            return False
+        return queryset.database.pinned_conn() is None
+
+    async def paginate_concurrently(self, page_number):
+        """
+        乐观地假设页码没有超出范围，同时统计总数和查询数据；
+        得到总数后页码需要修正（超出最后一页）时再重新查询
+        :param page_number: 请求的页码
+        :return:
+        """
+        offset, rows = await self.paginator.page_data_concurrently(page_number)
+        if self.paginator.count == 0:
+            return AsyncEmptyQuery()
+
+        final_page_number = self.get_page_number()
+        if final_page_number != page_number or self.paginator.get_offset(final_page_number) != offset:
+            return await self.paginator.page_data(final_page_number)
+        return rows
+
     async def get_paginated_response(self, data):
         count = self.paginator.count
         return Response(OrderedDict([
@@ -295,11 +470,16 @@ class LimitOffsetPagination(BasePagination):
     offset_query_param = 'offset'
     # 默认最大的列表条目数, 默认不限制
     max_limit = None
+    # 偏移量不小于该值时使用延迟关联（子查询只按索引取主键，再关联取整行），None代表不使用
+    deferred_join_offset = 1000
 
     @staticmethod
-    def get_count(queryset):
+    async def get_count(queryset):
+        if isinstance(queryset, AsyncEmptyQuery):
+            # 过滤条件确定没有结果（SkipFilterError）
+            return 0
         try:
-            return queryset.count()
+            return await queryset.count()
         except (AttributeError, TypeError):
             return len(queryset)
 
@@ -314,7 +494,7 @@ class LimitOffsetPagination(BasePagination):
                 for k, v in paginate_settings.items():
                     setattr(self, k, v)
 
-    def paginate_queryset(self, request_handler, queryset):
+    async def paginate_queryset(self, request_handler, queryset):
         """
         :param request_handler: 请求处理类对象本身，即view
         :param queryset:
@@ -326,15 +506,21 @@ class LimitOffsetPagination(BasePagination):
         if self.limit is None:
             return None
 
-        count = self.get_count(queryset)
+        count = await self.get_count(queryset)
         setattr(self, "count", count)
 
         if self.count == 0 or self.offset > self.count:
             return []
 
-        return list(queryset[self.offset:self.offset + self.limit])
+        if isinstance(queryset, (list, tuple)):
+            return list(queryset[self.offset:self.offset + self.limit])
+
+        if self.deferred_join_offset is not None and self.offset >= self.deferred_join_offset:
+            return queryset.deferred_join(self.limit, self.offset)
+
+        return queryset.limit(self.limit).offset(self.offset)
 
-    def get_paginated_response(self, data):
+    async def get_paginated_response(self, data):
         return Response(OrderedDict([
             ('count', self.count),
             ('next', self.get_next_link()),
@@ -388,3 +574,205 @@ class LimitOffsetPagination(BasePagination):
         offset = self.offset - self.limit
 
         return replace_query_param(url, self.offset_query_param, offset)
+
+
+class CursorPagination(BasePagination):
+    """
+    游标分页，基于键集定位（AsyncSelectQuery.seek），不需要统计总数，深分页的代价与第一页相同；
+    排序取自queryset的order_by（如OrderingFilter的结果），游标经过签名，需要配置tornado的cookie_secret
+    """
+    # 每页条数
+    page_size = 10
+    # 自定义每页条数的查询参数名
+    page_size_query_param = "page_size"
+    # 每页条数最大值
+    max_page_size = None
+    # 游标查询参数变量名
+    cursor_query_param = "cursor"
+    # queryset没有排序时使用的排序，比如"-created"，None代表按主键升序
+    ordering = None
+    # 游标的有效天数
+    cursor_max_age_days = 31
+
+    def load_paginate_settings(self):
+        """
+        加载分页相关的配置
+        :return:
+        """
+        if hasattr(self.request_handler, "overload_paginate_settings"):
+            paginate_settings = getattr(self.request_handler, "overload_paginate_settings")()
+            if paginate_settings:
+                for k, v in paginate_settings.items():
+                    setattr(self, k, v)
+
+    def get_page_size(self):
+        """
+        每页条数
+        :return:
+        """
+        if self.page_size_query_param:
+            try:
+                page_size = self.request_handler.get_query_argument(
+                    self.page_size_query_param, self.page_size
+                )
+                return _positive_int(page_size, strict=True, cutoff=self.max_page_size)
+            except (TypeError, KeyError, ValueError):
+                pass
+
+        return self.page_size
+
+    def get_ordered_queryset(self, queryset):
+        """
+        queryset没有排序时使用ordering
+        :param queryset:
+        :return:
+        """
+        if queryset._order_by or not self.ordering:
+            return queryset
+
+        ordering = (self.ordering,) if isinstance(self.ordering, str) else self.ordering
+        fields = queryset.model_class._meta.fields
+        return queryset.order_by(*[
+            fields[item.lstrip("-")].desc() if item.startswith("-") else fields[item].asc()
+            for item in ordering
+        ])
+
+    @staticmethod
+    def get_ordering_key(ordering):
+        """
+        排序的标识，游标只能用于生成它的排序
+        """
+        return ["{prefix}{model}.{field}".format(
+            prefix="-" if desc else "", model=field.model_class._meta.name, field=field.name
+        ) for field, desc in ordering]
+
+    def encode_cursor(self, position, reverse):
+        """
+        :param position: 排序字段的值
+        :param reverse: 是否向前翻页
+        :return: 签名后的游标
+        """
+        payload = json.dumps({
+            "o": self.get_ordering_key(self.seek_ordering),
+            "p": position,
+            "r": reverse,
+        }, separators=(",", ":"), default=str)
+        return force_text(self.request_handler.create_signed_value(self.cursor_query_param, payload))
+
+    def decode_cursor(self):
+        """
+        :return: (排序字段的值, 是否向前翻页)，没有游标时为(None, False)
+        """
+        cursor = self.request_handler.get_query_argument(self.cursor_query_param, None)
+        if not cursor:
+            return None, False
+
+        self.request_handler.require_setting("cookie_secret", "cursor pagination")
+        payload = decode_signed_value(
+            self.request_handler.application.settings["cookie_secret"],
+            self.cursor_query_param, cursor, max_age_days=self.cursor_max_age_days
+        )
+        try:
+            payload = json.loads(force_text(payload))
+            position, reverse = payload["p"], bool(payload["r"])
+            valid = payload["o"] == self.get_ordering_key(self.seek_ordering) and len(position) == len(self.seek_ordering)
+            if valid:
+                position = [self.coerce_position_value(field, value)
+                            for (field, desc), value in zip(self.seek_ordering, position)]
+        except (TypeError, ValueError, KeyError):
+            valid = False
+
+        if not valid:
+            raise PaginationError(detail=_("Invalid cursor"))
+        return position, reverse
+
+    @staticmethod
+    def coerce_position_value(field, value):
+        """
+        检查游标中的值与排序字段的类型是否相符，不相符时抛出ValueError
+        :param field: 排序字段
+        :param value: 游标中的值
+        :return: 转换后的值
+        """
+        if value is None:
+            if not field.null:
+                raise ValueError("Field %s can not be null" % field.name)
+            return None
+        if isinstance(value, (list, dict)):
+            raise ValueError("Invalid value for field %s: %r" % (field.name, value))
+        return field.db_value(value)
+
+    async def paginate_queryset(self, request_handler, queryset):
+        """
+        :param request_handler: 请求处理类对象本身，即view
+        :param queryset:
+        :return:
+        """
+        setattr(self, "request_handler", request_handler)
+        self.load_paginate_settings()
+        page_size = self.get_page_size()
+        if not page_size:
+            return AsyncEmptyQuery()
+
+        if isinstance(queryset, AsyncEmptyQuery):
+            # 过滤条件确定没有结果（SkipFilterError）
+            self.has_next = self.has_previous = False
+            self.next_position = self.previous_position = None
+            return []
+
+        queryset = self.get_ordered_queryset(queryset)
+        try:
+            self.seek_ordering = queryset.get_seek_ordering()
+        except ValueError:
+            # 按表达式等非字段排序时无法定位
+            raise PaginationError(detail=_("Invalid ordering"))
+        position, reverse = self.decode_cursor()
+
+        if reverse:
+            # 向前翻页时按相反的顺序取数据，再翻转回来
+            queryset = queryset.order_by(*[field.asc() if desc else field.desc() for field, desc in self.seek_ordering])
+
+        # 多取一条用于判断是否还有更多数据，不需要统计总数
+        query = queryset.seek(after=position).limit(page_size + 1)
+        rows = await query
+        has_more = len(rows) > page_size
+        rows = list(rows[:page_size])
+
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.next_position = query.seek_values(rows[-1]) if rows and self.has_next else position
+        self.previous_position = query.seek_values(rows[0]) if rows and self.has_previous else position
+        return rows
+
+    async def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        """
+        下一页url
+        :return:
+        """
+        if not self.has_next or self.next_position is None:
+            return None
+
+        url = self.request_handler.request.full_url()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position, False))
+
+    def get_previous_link(self):
+        """
+        上一页url
+        :return:
+        """
+        if not self.has_previous or self.previous_position is None:
+            return None
+
+        url = self.request_handler.request.full_url()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.previous_position, True))
@@ -201,7 +201,7 @@ class BaseModelForm(BaseForm):
                 continue
             if exclude and field_name in exclude:
                 continue
-            data[field_name] = getattr(self.instance, field_name)
+            data[field_name] = self.instance.serializable_value(field_name)
         return data
 
     @property
@@ -130,7 +130,7 @@ class UniqueTogetherValidator(object):
         if self.instance is not None:
             for field_name in self.fields:
                 if field_name not in req_params:
-                    req_params[field_name] = getattr(self.instance, field_name)
+                    req_params[field_name] = self.instance.serializable_value(field_name)
 
         filter_kwargs = {
             field_name: req_params[field_name]
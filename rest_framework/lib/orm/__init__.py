@@ -4,7 +4,8 @@ from .peewee import *
 
 from .mysql import AsyncMySQLDatabase
 from .model import AsyncModel as Model
-from .database import create_model_tables, drop_model_tables
+from .query import prefetch
+from .database import create_model_tables, drop_model_tables, QueryTimeoutError
 
 schemes = {
     'mysql': AsyncMySQLDatabase,
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import uuid
+from collections import deque
+
+from .peewee import logger
+from .peewee import Node, Expression, Clause, Func, SelectQuery, CompoundSelect, ModelAlias
+
+# 表的版本号的缓存时间（秒），过期后会生成新的版本号，之前缓存的查询结果随之失效
+GENERATION_TIMEOUT = 30 * 24 * 3600
+
+
+async def _resolve(value):
+    # 缓存后端的方法有同步（simple）也有异步（redis）的
+    if asyncio.iscoroutine(value):
+        return await value
+    return value
+
+
+def get_cache(alias):
+    from rest_framework.core.cache import caches
+    return caches[alias]
+
+
+def query_tables(query, tables=None):
+    """
+    :param query: SelectQuery
+    :param tables: 已收集的表名集合
+    :return: 查询（包括连接和子查询）涉及的表名集合
+    """
+    if tables is None:
+        tables = set()
+
+    if isinstance(query, CompoundSelect):
+        query_tables(query.lhs, tables)
+        query_tables(query.rhs, tables)
+        return tables
+
+    tables.add(query.model_class._meta.db_table)
+    for src, join_list in query._joins.items():
+        for join in join_list:
+            _collect_tables(join.dest, tables)
+            _collect_tables(join.on, tables)
+    for part in (query._select, query._from, query._where, query._having):
+        _collect_tables(part, tables)
+    return tables
+
+
+def _collect_tables(node, tables):
+    if isinstance(node, SelectQuery):
+        query_tables(node, tables)
+    elif isinstance(node, ModelAlias):
+        tables.add(node.model_class._meta.db_table)
+    elif isinstance(node, (list, tuple)):
+        for item in node:
+            _collect_tables(item, tables)
+    elif isinstance(node, Expression):
+        _collect_tables(node.lhs, tables)
+        _collect_tables(node.rhs, tables)
+    elif isinstance(node, Clause):
+        _collect_tables(node.nodes, tables)
+    elif isinstance(node, Func):
+        _collect_tables(node.arguments, tables)
+    elif isinstance(node, type) and hasattr(node, '_meta'):
+        tables.add(node._meta.db_table)
+    elif isinstance(node, Node):
+        for attr in ('node', 'nodes'):
+            if hasattr(node, attr):
+                _collect_tables(getattr(node, attr), tables)
+
+
+class CachedCursor:
+    """
+    由缓存的结果构造的游标，供结果集包装类读取
+    """
+
+    def __init__(self, columns, rows):
+        self.description = [(column, None, None, None, None, None, None) for column in columns]
+        self._rows = deque(tuple(row) for row in rows)
+        self.rowcount = len(self._rows)
+        self.lastrowid = None
+
+    async def fetchone(self):
+        return self._rows.popleft() if self._rows else None
+
+    async def fetchmany(self, size=1):
+        return [self._rows.popleft() for _ in range(min(size, len(self._rows)))]
+
+    async def fetchall(self):
+        rows, self._rows = list(self._rows), deque()
+        return rows
+
+    async def close(self):
+        pass
+
+
+class QueryCache:
+    """
+    查询结果缓存：
+    结果以列名和原始行数据保存在core.cache的缓存中，key由SQL、参数和所涉及各表的版本号组成；
+    写操作会为表生成新的版本号，依赖该表的缓存结果因key变化而不再被读取，随后按过期时间淘汰
+    """
+
+    def __init__(self, alias):
+        """
+        :param alias: 保存表版本号的缓存
+        """
+        self.alias = alias
+
+    @staticmethod
+    def generation_key(table):
+        return 'orm:generation:%s' % table
+
+    @staticmethod
+    def new_generation():
+        return uuid.uuid4().hex
+
+    async def get_generations(self, tables):
+        """
+        :param tables: 表名列表
+        :return: 各表当前的版本号，没有版本号的表会生成一个
+        """
+        cache = get_cache(self.alias)
+        generations = []
+        for table in tables:
+            key = self.generation_key(table)
+            generation = await _resolve(cache.get(key))
+            if generation is None:
+                # 版本号丢失（过期或被淘汰）后不能回到之前用过的值
+                generation = self.new_generation()
+                await _resolve(cache.set(key, generation, timeout=GENERATION_TIMEOUT))
+            generations.append(generation)
+        return generations
+
+    async def bump(self, tables):
+        """
+        为表生成新的版本号，使依赖这些表的缓存结果失效
+        :param tables: 表名列表
+        :return:
+        """
+        cache = get_cache(self.alias)
+        for table in tables:
+            try:
+                await _resolve(cache.set(self.generation_key(table), self.new_generation(),
+                                         timeout=GENERATION_TIMEOUT))
+            except Exception as e:
+                logger.warning('Failed to invalidate cached queries of %s: %s', table, e)
+
+    async def make_key(self, sql, params, tables):
+        tables = sorted(tables)
+        generations = await self.get_generations(tables)
+        fingerprint = repr((sql, list(params), list(zip(tables, generations))))
+        return 'orm:query:%s' % hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    async def get(key, alias):
+        """
+        :return: CachedCursor，没有缓存时返回None
+        """
+        cached = await _resolve(get_cache(alias).get(key))
+        if cached is None:
+            return None
+        columns, rows = cached
+        return CachedCursor(columns, rows)
+
+    @staticmethod
+    async def set(key, cursor, alias, timeout=None):
+        """
+        读取游标中的全部结果并缓存
+        :return: 可以重新读取结果的CachedCursor
+        """
+        rows = [tuple(row) for row in await cursor.fetchall()]
+        columns = [column[0] for column in cursor.description or ()]
+        await cursor.close()
+
+        cache = get_cache(alias)
+        try:
+            if timeout is None:
+                await _resolve(cache.set(key, (columns, rows)))
+            else:
+                await _resolve(cache.set(key, (columns, rows), timeout=timeout))
+        except Exception as e:
+            logger.warning('Failed to cache query result: %s', e)
+        return CachedCursor(columns, rows)
@@ -0,0 +1,200 @@
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .peewee import Field, Func, FieldProxy, ForeignKeyField
+from .peewee import IntegerField, FloatField, BooleanField, DateTimeField, TimestampField
+from .result import AsyncExtQueryResultWrapper
+
+# 结果类型：按列返回
+RESULTS_COLUMNS = 8
+
+# 没有设置fetch_size时每批读取的行数
+COLUMNS_CHUNK_SIZE = 10000
+
+# 列的类型
+INT = 'int'
+FLOAT = 'float'
+BOOL = 'bool'
+DATETIME = 'datetime'
+OBJECT = 'object'
+
+# 类型 -> (NumPy dtype, array typecode)，没有typecode的列使用list
+COLUMN_TYPES = {
+    INT: ('int64', 'q'),
+    FLOAT: ('float64', 'd'),
+    BOOL: ('bool', 'b'),
+    DATETIME: ('datetime64[us]', None),
+    OBJECT: (object, None),
+}
+
+
+def column_kind(field):
+    """
+    :param field: 列对应的Field，没有则为None
+    :return: 列的类型
+    """
+    if isinstance(field, FieldProxy):
+        field = field.field_instance
+    if isinstance(field, ForeignKeyField):
+        field = field.to_field
+    if isinstance(field, (DateTimeField, TimestampField)):
+        return DATETIME
+    elif isinstance(field, BooleanField):
+        return BOOL
+    elif isinstance(field, IntegerField):
+        return INT
+    elif isinstance(field, FloatField):
+        return FLOAT
+    return OBJECT
+
+
+def column_type(node, converter):
+    """
+    :param node: 查询的列
+    :param converter: 列的python_value
+    :return: (列的类型, 写入前的转换函数)
+    """
+    if isinstance(node, Func) and not node._coerce:
+        # COUNT、SUM的结果不按字段转换，MySQL中SUM、AVG为Decimal
+        name = (node.name or '').lower()
+        arg = node.arguments[0] if node.arguments else None
+        if name == 'count':
+            return INT, int
+        elif name in ('sum', 'avg') and isinstance(arg, Field) and column_kind(arg) in (INT, FLOAT, BOOL):
+            return FLOAT, float
+        return OBJECT, converter
+
+    field = getattr(converter, '__self__', None)
+    kind = column_kind(field if isinstance(field, Field) else None)
+    if kind in (INT, FLOAT, BOOL) and not isinstance(node, Func):
+        # 字段的值直接写入类型化的缓冲区，不逐个调用python_value
+        return kind, None
+    return kind, converter
+
+
+class ColumnBuffer(object):
+    """
+    按类型保存一列数据：有NumPy时按批生成数组，最后拼接；否则追加到array.array（日期时间和其他类型为list）；
+    整数和布尔列出现NULL时转为浮点数，NULL为NaN，日期时间列的NULL为NaT（没有NumPy时为None）
+    """
+
+    def __init__(self, kind, converter=None):
+        """
+        :param kind: 列的类型
+        :param converter: 写入前对非NULL值调用的转换函数
+        """
+        self.kind = kind
+        self.converter = converter
+        self.dtype, typecode = COLUMN_TYPES[kind]
+        self.chunks = []
+        self.data = array(typecode) if typecode else []
+
+    def _float_values(self, values):
+        nan = float('nan')
+        return [nan if value is None else value for value in values]
+
+    def extend(self, values):
+        converter = self.converter
+        if converter is not None:
+            values = [None if value is None else converter(value) for value in values]
+
+        if numpy is not None:
+            self.chunks.append(self._numpy_chunk(values))
+        elif isinstance(self.data, list):
+            self.data.extend(values)
+        elif self.data.typecode == 'd':
+            self.data.extend(self._float_values(values))
+        elif None in values:
+            self.data = array('d', self.data)
+            self.data.extend(self._float_values(values))
+        else:
+            self.data.extend(values)
+
+    def _numpy_chunk(self, values):
+        if self.kind == OBJECT:
+            chunk = numpy.empty(len(values), dtype=object)
+            chunk[:] = values
+            return chunk
+        elif self.kind in (INT, BOOL) and None in values:
+            return numpy.array(self._float_values(values), dtype='float64')
+        return numpy.array(values, dtype=self.dtype)
+
+    def build(self):
+        """
+        :return: NumPy数组、array.array或list
+        """
+        if numpy is None:
+            return self.data
+        if not self.chunks:
+            return numpy.array([], dtype=self.dtype)
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        # 有NULL的批次为float64，拼接后整列为float64
+        return numpy.concatenate(self.chunks)
+
+
+class AsyncColumnsQueryResultWrapper(AsyncExtQueryResultWrapper):
+    """
+    按列返回结果：await得到 列名 -> 列数据 的OrderedDict，数据按批读取后逐列写入类型化的缓冲区，
+    不为每一行创建对象；只能await，不能逐行迭代
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncColumnsQueryResultWrapper, self).__init__(*args, **kwargs)
+        self._columns = None
+
+    def initialize(self, description):
+        super(AsyncColumnsQueryResultWrapper, self).initialize(description)
+        self.column_names = []
+        self.buffers = []
+        for i, name, converter in self.conv:
+            node = self.column_meta[i] if self.column_meta and i < len(self.column_meta) else None
+            kind, converter = column_type(node, converter)
+            if name in self.column_names:
+                name = '_%d' % i
+            self.column_names.append(name)
+            self.buffers.append(ColumnBuffer(kind, converter))
+
+    async def _fetch_rows(self):
+        rows = await self.cursor.fetchmany(self.fetch_size or COLUMNS_CHUNK_SIZE)
+        if not rows:
+            return False
+        self._buffer.extend(rows)
+        return True
+
+    def _consume_rows(self):
+        rows = list(self._buffer)
+        self._buffer.clear()
+        self._ct += len(rows)
+        for (i, _, _), buffer in zip(self.conv, self.buffers):
+            buffer.extend([row[i] for row in rows])
+
+    async def _fetch_all(self):
+        if not self._populated:
+            while await self._fetch_rows():
+                if not self._initialized:
+                    self.initialize(self.cursor.description)
+                    self._initialized = True
+                self._consume_rows()
+            if not self._initialized:
+                self.initialize(self.cursor.description)
+                self._initialized = True
+            await self._close_cursor()
+            self._columns = OrderedDict(
+                (name, buffer.build()) for name, buffer in zip(self.column_names, self.buffers))
+            self.buffers = None
+        return self._columns
+
+    async def fill_cache(self, n=None):
+        await self._fetch_all()
+
+    async def iterate(self):
+        raise NotImplementedError('Results of columns() can only be awaited.')
+
+    async def __anext__(self):
+        raise NotImplementedError('Results of columns() can only be awaited.')
@@ -0,0 +1,262 @@
+from collections import OrderedDict
+from inspect import isclass
+
+from .peewee import QueryCompiler, CompoundSelect, Clause, Expression, Func, Entity
+from .peewee import Node, Field, ForeignKeyField, Model, ModelAlias
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+class CompiledSQLCache:
+    """
+    已编译SQL的LRU缓存，键为查询结构的指纹，值为SQL语句
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def get(self, key):
+        try:
+            sql = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return sql
+
+    def set(self, key, sql):
+        self._cache[key] = sql
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._cache),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class CachingQueryCompiler(QueryCompiler):
+    """
+    对SELECT语句按查询结构缓存编译结果；
+    命中时直接遍历查询的各个组成部分收集参数，不再构造子句、拼接SQL字符串。
+    参数收集与QueryCompiler._parse的处理逻辑一一对应，
+    首次编译时会校验两者得到的参数是否一致，不一致的结构不会被缓存
+    """
+
+    def generate_select(self, query, alias_map=None):
+        cache = getattr(query.model_class._meta.database, 'sql_cache', None)
+        if cache is None or alias_map is not None or isinstance(query, CompoundSelect):
+            return super(CachingQueryCompiler, self).generate_select(query, alias_map)
+
+        key, params = [], []
+        try:
+            self._fingerprint(query, key, params)
+        except _Uncacheable:
+            return super(CachingQueryCompiler, self).generate_select(query)
+
+        key = tuple(key)
+        sql = cache.get(key)
+        if sql is not None:
+            return sql, params
+
+        sql, compiled_params = super(CachingQueryCompiler, self).generate_select(query)
+        if compiled_params == params:
+            cache.set(key, sql)
+        return sql, compiled_params
+
+    def _fingerprint(self, query, key, params):
+        """
+        按generate_select_clauses的子句顺序遍历查询，
+        表别名完全由模型与连接结构决定，因此指纹中不需要记录别名
+        """
+        if isinstance(query, CompoundSelect) or query._windows is not None:
+            raise _Uncacheable
+
+        model = query.model_class
+        db = model._meta.database
+        joins = query._joins
+        key.append((model, bool(query._distinct)))
+
+        if query._distinct not in (True, False):
+            self._walk(list(query._distinct), None, key, params)
+        self._walk(query._select, None, key, params)
+        if query._from is None:
+            key.append(None)
+        else:
+            self._walk(list(query._from), None, key, params)
+
+        # 别名按_joins的字典顺序分配
+        for src, join_list in joins.items():
+            key.append(src)
+            for join in join_list:
+                on = join.on
+                if isinstance(on, Field):
+                    on = (on.model_class, on.name)
+                elif on is not None and not isinstance(on, (Expression, Func, Clause, Entity)):
+                    raise _Uncacheable
+                elif on is not None:
+                    on = True
+                key.append((join.dest, join.get_join_type(), on))
+
+        # 连接子句中的参数按generate_joins的深度优先顺序出现
+        seen = set()
+        q = [model]
+        while q:
+            curr = q.pop()
+            if curr not in joins or curr in seen:
+                continue
+            seen.add(curr)
+            for join in joins[curr]:
+                if isinstance(join.dest, Node):
+                    self._walk(join.dest, None, key, params)
+                else:
+                    q.append(join.dest)
+                if isinstance(join.on, (Expression, Func, Clause, Entity)):
+                    self._walk(join.on, None, key, params)
+
+        for part in (query._where, query._group_by, query._having, query._order_by):
+            if part:
+                self._walk(part, None, key, params)
+            else:
+                key.append(None)
+
+        has_limit = query._limit is not None or bool(query._offset and db.limit_max)
+        key.append((has_limit, query._offset is not None, query._for_update))
+        if has_limit:
+            params.append(int(query._limit if query._limit is not None else db.limit_max))
+        if query._offset is not None:
+            params.append(int(query._offset))
+
+    def _walk(self, node, conv, key, params):
+        node_type = getattr(node, '_node_type', None)
+        if node_type == 'field':
+            key.append((node.model_class, node.db_column, node._alias, node._negated, node._ordering))
+            return
+
+        walker = self._walkers.get(node_type)
+        if walker is not None:
+            key.append((node_type, node._negated, node._alias, node._ordering))
+            walker(self, node, conv, key, params)
+        elif isinstance(node, Node):
+            raise _Uncacheable
+        elif isinstance(node, (list, tuple, set)):
+            key.append(('list', len(node)))
+            for item in node:
+                self._walk(item, conv, key, params)
+        elif isinstance(node, Model):
+            key.append('?')
+            if conv and isinstance(conv, ForeignKeyField):
+                to_field = conv.to_field
+                if isinstance(to_field, ForeignKeyField):
+                    value = conv.db_value(node)
+                else:
+                    value = to_field.db_value(getattr(node, to_field.name))
+            else:
+                value = node._get_pk_value()
+            self._add_param(value, params)
+        elif (isclass(node) and issubclass(node, Model)) or isinstance(node, ModelAlias):
+            key.append(('model', node))
+        elif conv is not None:
+            value = conv.db_value(node)
+            if isinstance(value, (Node, list, tuple, set)):
+                raise _Uncacheable
+            self._walk(value, None, key, params)
+        else:
+            key.append('?')
+            self._add_param(node, params)
+
+    @staticmethod
+    def _add_param(value, params):
+        if isinstance(value, Node):
+            raise _Uncacheable
+        params.append(value)
+
+    def _walk_expression(self, node, conv, key, params):
+        if isinstance(node.lhs, Field):
+            conv = node.lhs
+        key.append((node.op, node.flat))
+        self._walk(node.lhs, conv, key, params)
+        self._walk(node.rhs, conv, key, params)
+
+    def _walk_param(self, node, conv, key, params):
+        if node.adapt:
+            if conv and conv.db_value is node.adapt:
+                conv = None
+            self._walk(node.adapt(node.value), conv, key, params)
+        elif conv is not None:
+            self._walk(conv.db_value(node.value), None, key, params)
+        else:
+            self._add_param(node.value, params)
+
+    def _walk_passthrough(self, node, conv, key, params):
+        if node.adapt:
+            self._walk(node.adapt(node.value), None, key, params)
+        else:
+            self._add_param(node.value, params)
+
+    def _walk_func(self, node, conv, key, params):
+        conv = node._coerce and conv or None
+        key.append((node.name, node._coerce, len(node.arguments)))
+        for argument in node.arguments:
+            self._walk(argument, conv, key, params)
+
+    def _walk_clause(self, node, conv, key, params):
+        key.append((node.glue, node.parens, len(node.nodes)))
+        for item in node.nodes:
+            self._walk(item, conv, key, params)
+
+    def _walk_entity(self, node, conv, key, params):
+        key.append(node.path)
+
+    def _walk_sql(self, node, conv, key, params):
+        key.append((node.value, len(node.params)))
+        for param in node.params:
+            self._add_param(param, params)
+
+    def _walk_composite_key(self, node, conv, key, params):
+        for field_name in node.field_names:
+            self._walk(node.model_class._meta.fields[field_name], conv, key, params)
+
+    def _walk_strip_parens(self, node, conv, key, params):
+        self._walk(node.node, conv, key, params)
+
+    def _walk_select_query(self, node, conv, key, params):
+        clone = node.clone()
+        if not node._explicit_selection:
+            if conv and isinstance(conv, ForeignKeyField):
+                clone._select = (conv.to_field,)
+            else:
+                clone._select = clone.model_class._meta.get_primary_key_fields()
+        key.append('subquery')
+        self._fingerprint(clone, key, params)
+
+    _walkers = {
+        'expression': _walk_expression,
+        'param': _walk_param,
+        'passthrough': _walk_passthrough,
+        'func': _walk_func,
+        'clause': _walk_clause,
+        'entity': _walk_entity,
+        'sql': _walk_sql,
+        'composite_key': _walk_composite_key,
+        'strip_parens': _walk_strip_parens,
+        'select_query': _walk_select_query,
+    }
@@ -5,43 +5,90 @@ from functools import wraps
 class CallableContextManager:
     __slots__ = ()
 
+    def clone(self):
+        raise NotImplementedError
+
     def __call__(self, fn):
         @wraps(fn)
         async def inner(*args, **kwargs):
-            async with self:
-                return fn(*args, **kwargs)
+            # 每次调用使用新的上下文，并发的调用各自获取连接
+            async with self.clone():
+                return await fn(*args, **kwargs)
         return inner
 
 
+class ConnectionContext(CallableContextManager):
+    """
+    获取一个连接并绑定到当前Task上，
+    在退出之前，当前Task中执行的查询都会复用这个连接；
+    未指定conn时在进入时获取连接（当前Task已绑定连接时复用）
+    """
+
+    __slots__ = ('db', 'explicit_conn', 'conn', 'pinned')
+
+    def __init__(self, db, conn=None):
+        self.db = db
+        self.explicit_conn = conn
+        self.conn = None
+        self.pinned = False
+
+    def clone(self):
+        return ConnectionContext(self.db, self.explicit_conn)
+
+    async def __aenter__(self):
+        self.conn = self.explicit_conn or self.db.get_conn()
+        await self.conn.__aenter__()
+        self.pinned = self.db.pin_conn(self.conn)
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if self.pinned:
+                self.db.unpin_conn(self.conn)
+        finally:
+            await self.conn.__aexit__(exc_type, exc_val, exc_tb)
+
+
 class Atomic(CallableContextManager):
 
-    __slots__ = ('conn', 'transaction_type', 'context_manager')
+    __slots__ = ('db', 'transaction_type', 'context_manager', 'connection_context')
 
-    def __init__(self, conn, transaction_type=None):
-        self.conn = conn
+    def __init__(self, db, transaction_type=None):
+        self.db = db
         self.transaction_type = transaction_type
 
+    def clone(self):
+        return Atomic(self.db, self.transaction_type)
+
     async def __aenter__(self):
-        await self.conn.__aenter__()
-        if self.conn.transaction_depth() == 0:
-            self.context_manager = self.conn.transaction(self.transaction_type)
+        self.connection_context = ConnectionContext(self.db)
+        conn = await self.connection_context.__aenter__()
+        if conn.transaction_depth() == 0:
+            self.context_manager = conn.transaction(self.transaction_type)
         else:
-            self.context_manager = self.conn.savepoint()
+            self.context_manager = conn.savepoint()
         return await self.context_manager.__aenter__()
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.context_manager.__aexit__(exc_type, exc_val, exc_tb)
-        await self.conn.__aexit__(exc_type, exc_val, exc_tb)
+        try:
+            await self.context_manager.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            await self.connection_context.__aexit__(exc_type, exc_val, exc_tb)
 
 
 class Transaction(CallableContextManager):
 
-    __slots__ = ('conn', 'autocommit', 'transaction_type')
+    __slots__ = ('db', 'explicit_conn', 'conn', 'autocommit', 'transaction_type', 'connection_context')
 
-    def __init__(self, conn, transaction_type=None):
-        self.conn = conn
+    def __init__(self, db, transaction_type=None, conn=None):
+        self.db = db
+        self.explicit_conn = conn
+        self.conn = None
         self.transaction_type = transaction_type
 
+    def clone(self):
+        return Transaction(self.db, self.transaction_type, self.explicit_conn)
+
     async def _begin(self):
         if self.transaction_type:
             await self.conn.begin(self.transaction_type)
@@ -59,6 +106,8 @@ class Transaction(CallableContextManager):
             await self._begin()
 
     async def __aenter__(self):
+        self.connection_context = ConnectionContext(self.db, self.explicit_conn)
+        self.conn = await self.connection_context.__aenter__()
         self.autocommit = self.conn.autocommit
         self.conn.autocommit = False
 
@@ -80,6 +129,7 @@ class Transaction(CallableContextManager):
         finally:
             self.conn.autocommit = self.autocommit
             self.conn.pop_transaction()
+            await self.connection_context.__aexit__(exc_type, exc_val, exc_tb)
 
 
 class SavePoint(CallableContextManager):
@@ -93,6 +143,9 @@ class SavePoint(CallableContextManager):
         _compiler = conn.compiler()  # TODO: breing the compiler here somehow
         self.quoted_sid = _compiler.quote(self.sid)
 
+    def clone(self):
+        return SavePoint(self.conn, self.sid)
+
     async def _execute(self, query):
         await self.conn.execute_sql(query, require_commit=False)
 
@@ -9,18 +9,40 @@ from .peewee import (
     RESULTS_DICTS,
     RESULTS_AGGREGATE_MODELS,
     RESULTS_MODELS,
+    RESULTS_NAMEDTUPLES,
 )
 from .peewee import SQL, R, Clause, fn, binary_construct
 from .peewee import logger
 
-from .context import Atomic, Transaction, SavePoint
+from .context import Atomic, Transaction, SavePoint, ConnectionContext
+from .compiler import CachingQueryCompiler, CompiledSQLCache
+from .loader import RelatedObjectLoader
+from .replica import ReplicaSet, ROUND_ROBIN
+from .pool import PoolController
+from .cache import QueryCache
 from .result import (
     AsyncNaiveQueryResultWrapper,
     AsyncModelQueryResultWrapper,
     AsyncTuplesQueryResultWrapper,
     AsyncDictQueryResultWrapper,
     AsyncAggregateQueryResultWrapper,
+    AsyncNamedTupleQueryResultWrapper,
+    AsyncRowQueryResultWrapper,
+    RESULTS_ROWS,
 )
+from .columnar import AsyncColumnsQueryResultWrapper, RESULTS_COLUMNS
+from .instrument import QueryEvent, get_query_stats, call_hooks, MAX_ROWCOUNT
+from .slowlog import SlowQueryLog, SLOW_QUERY_INTERVAL
+from .utils import current_task, task_local, is_read_only_sql
+
+# 超时终止语句后等待原连接上的语句返回的时间（秒），超过则关闭该连接
+KILL_QUERY_WAIT = 5
+
+
+class QueryTimeoutError(OperationalError):
+    """
+    语句执行超过超时时间，已被终止
+    """
 
 
 class AsyncConnection:
@@ -34,6 +56,14 @@ class AsyncConnection:
         self.context_stack = []
         self.transactions = []
         self.exception_wrapper = exception_wrapper  # TODO: remove
+        # 嵌套进入的层数，最外层退出时才将连接归还连接池
+        self.depth = 0
+        # 事务中写过的表，提交后再次使其缓存的查询结果失效
+        self.dirty_tables = set()
+        # 从连接池获取连接的等待时间，计入连接上执行的第一条语句
+        self.acquire_wait = 0.0
+        # 绑定的连接由子Task共用时，语句依次执行
+        self._lock = None
 
     def transaction_depth(self):
         return len(self.transactions)
@@ -44,45 +74,175 @@ class AsyncConnection:
     def pop_transaction(self):
         return self.transactions.pop()
 
-    async def execute_sql(self, sql, params=None, require_commit=True):
+    async def execute_sql(self, sql, params=None, require_commit=True, cursor_class=None, timeout=None):
+        """
+        :param timeout: 语句的超时时间（秒），None或0代表不限制；
+        超时后在另一个连接上终止该语句并抛出QueryTimeoutError，数据库支持时SELECT还会由服务端限制执行时间
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await self._execute_timed(sql, params, require_commit, cursor_class, timeout)
+
+    async def _execute_timed(self, sql, params, require_commit, cursor_class, timeout):
+        if timeout:
+            sql = self.db.add_timeout_hint(sql, timeout)
         logger.debug((sql, params))
+        hooks = self.db.query_hooks
+        stats = get_query_stats()
+        if not hooks and stats is None:
+            return await self._execute_sql(sql, params, require_commit, cursor_class, timeout)
+
+        event = QueryEvent(self.db, sql, params, self.connection_id(), self.acquire_wait)
+        self.acquire_wait = 0.0
+        call_hooks(hooks, 'before_execute', event)
+        loop = self.db.loop
+        event.start = loop.time()
+        try:
+            cursor = await self._execute_sql(sql, params, require_commit, cursor_class, timeout)
+        except Exception as e:
+            event.duration = loop.time() - event.start
+            event.error = e
+            if stats is not None:
+                stats.record(event)
+            call_hooks(hooks, 'on_error', event, e)
+            raise
+
+        event.duration = loop.time() - event.start
+        rowcount = cursor.rowcount
+        if rowcount is not None and 0 <= rowcount < MAX_ROWCOUNT:
+            event.rows = rowcount
+        if stats is not None:
+            stats.record(event)
+        call_hooks(hooks, 'after_execute', event)
+        return cursor
+
+    async def _execute_sql(self, sql, params, require_commit, cursor_class, timeout):
         with self.exception_wrapper:
-            cursor = await self.conn.cursor()
+            if cursor_class is None:
+                cursor = await self.conn.cursor()
+            else:
+                cursor = await self.conn.cursor(cursor_class)
             try:
-                await cursor.execute(sql, params or ())
-            except Exception:
+                if timeout:
+                    await self._execute_with_timeout(cursor, sql, params or (), timeout)
+                else:
+                    await cursor.execute(sql, params or ())
+            except asyncio.CancelledError:
+                # 连接上的读写已中断，不能再归还给连接池继续使用
+                self.abandon()
+                raise
+            except Exception as e:
                 if self.autorollback and self.autocommit:
                     await self.rollback()
+                if self.db.is_timeout_error(e):
+                    raise QueryTimeoutError(*e.args) from e
                 raise
             else:
                 if require_commit and self.autocommit:
                     await self.commit()
             return cursor
 
+    def connection_id(self):
+        """
+        :return: 数据库连接的线程id，驱动不支持时返回None
+        """
+        thread_id = getattr(self.conn, 'thread_id', None)
+        return thread_id() if thread_id is not None else None
+
+    async def _execute_with_timeout(self, cursor, sql, params, timeout):
+        task = asyncio.ensure_future(cursor.execute(sql, params))
+        try:
+            done, _ = await asyncio.wait([task], timeout=timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if done:
+            return task.result()
+
+        # 不取消原语句的读取，终止语句后等待其返回错误，连接保持可用状态
+        try:
+            await self.db.kill_query(self.conn)
+            done, _ = await asyncio.wait([task], timeout=KILL_QUERY_WAIT)
+        except Exception as e:
+            logger.warning('Failed to kill query on timeout: %s', e)
+            done = None
+        if not done:
+            task.cancel()
+            # 连接池会丢弃已关闭的连接
+            self.conn.close()
+            raise QueryTimeoutError('Query timed out after %ss and the connection was closed.' % timeout)
+        if task.exception() is None:
+            # 终止前语句已经执行完成
+            return task.result()
+        raise QueryTimeoutError('Query timed out after %ss.' % timeout) from task.exception()
+
+    def abandon(self):
+        """
+        关闭读写状态不确定的连接（如执行中被取消），在另一个连接上终止其正在执行的语句；
+        连接池会丢弃已关闭的连接
+        """
+        conn = self.conn
+        if conn is None or conn.closed:
+            return
+        self.db.loop.create_task(self._kill_abandoned(conn))
+        conn.close()
+
+    async def _kill_abandoned(self, conn):
+        try:
+            await self.db.kill_query(conn)
+        except Exception as e:
+            logger.warning('Failed to kill query of abandoned connection: %s', e)
+
     async def __aenter__(self):
-        if self.acquirer is None:
+        if self.depth == 0:
             await self.db.connect()
-            self.acquirer = self.db.pool.acquire()
+            start = self.db.loop.time()
+            self.acquirer, self.conn = await self.db.pool_controller.acquire()
+            self.acquire_wait = self.db.loop.time() - start
+            self.db.inflight += 1
 
-        self.conn = await self.acquirer.__aenter__()
+        self.depth += 1
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.acquirer.__aexit__(exc_type, exc_val, exc_tb)
+        self.depth -= 1
+        if self.depth == 0:
+            acquirer, conn, self.acquirer, self.conn = self.acquirer, self.conn, None, None
+            self.db.inflight -= 1
+            await self.db.pool_controller.release(acquirer, conn, exc_type, exc_val, exc_tb)
+
+    @property
+    def savepoints(self):
+        return self.db.savepoints
+
+    def compiler(self):
+        return self.db.compiler()
+
+    def get_autocommit(self):
+        return self.autocommit
+
+    def set_autocommit(self, autocommit):
+        self.autocommit = autocommit
 
     async def begin(self):
         pass
 
-    def commit(self):
+    async def commit(self):
         with self.exception_wrapper:
-            return self.conn.commit()
-
-    def rollback(self):
+            await self.conn.commit()
+        if self.dirty_tables:
+            # 事务提交前其他连接可能按旧数据重新缓存了结果
+            tables, self.dirty_tables = self.dirty_tables, set()
+            await self.db.invalidate_tables(tables)
+
+    async def rollback(self):
+        self.dirty_tables.clear()
         with self.exception_wrapper:
-            return self.conn.rollback()
+            await self.conn.rollback()
 
     def transaction(self, transaction_type=None):
-        return Transaction(self, transaction_type)
+        return Transaction(self.db, transaction_type, conn=self)
     commit_on_success = property(transaction)
 
     def savepoint(self, sid=None):
@@ -92,6 +252,8 @@ class AsyncConnection:
 
 
 class AsyncDatabase(Database):
+    compiler_class = CachingQueryCompiler
+
     def _connect(self, database, **kwargs):
         raise NotImplementedError
 
@@ -107,6 +269,37 @@ class AsyncDatabase(Database):
     def get_cursor(self):
         raise NotImplementedError
 
+    def get_stream_cursor_class(self):
+        """
+        服务端（非缓冲）游标类，用于流式读取大结果集
+        """
+        raise NotImplementedError
+
+    def add_timeout_hint(self, sql, timeout):
+        """
+        :return: 由服务端限制执行时间的SQL，数据库不支持时原样返回
+        """
+        return sql
+
+    def explain_sql(self, sql):
+        """
+        :return: 获取sql执行计划的语句，不支持时返回None
+        """
+        return None
+
+    def is_timeout_error(self, exc):
+        """
+        :return: 异常是否为服务端因执行超时终止了语句
+        """
+        return False
+
+    async def kill_query(self, conn):
+        """
+        在另一个连接上终止conn正在执行的语句
+        :param conn: 驱动的连接对象
+        """
+        raise NotImplementedError
+
     def get_tables(self, schema=None):
         raise NotImplementedError
 
@@ -129,7 +322,10 @@ class AsyncDatabase(Database):
         raise NotImplementedError
 
     def __init__(self, database, autocommit=True, fields=None, ops=None, autorollback=False,
-                 loop=None, **connect_kwargs):
+                 loop=None, fetch_size=None, sql_cache_size=256, ping_interval=60,
+                 max_lifetime=3600, max_idle=600, pool_wait_threshold=0.01, pool_adjust_interval=5,
+                 query_cache=None, statement_timeout=None, slow_query_ms=None,
+                 slow_query_interval=SLOW_QUERY_INTERVAL, **connect_kwargs):
         self.connect_kwargs = {}
         self.closed = True
         self.init(database, **connect_kwargs)
@@ -142,8 +338,39 @@ class AsyncDatabase(Database):
         self.op_overrides = merge_dict(self.op_overrides, ops or {})
         self.exception_wrapper = ExceptionWrapper(self.exceptions)
         self._loop = loop
+        # 结果集每批读取的行数，None代表一次性读取全部
+        self.fetch_size = fetch_size
+        # SELECT查询默认的超时时间（秒），None代表不限制，流式读取不使用，见AsyncSelectQuery.timeout
+        self.statement_timeout = statement_timeout
+        # 已编译SQL的缓存，sql_cache_size为0时不缓存
+        self.sql_cache = CompiledSQLCache(sql_cache_size) if sql_cache_size else None
+        # 查询结果缓存，query_cache为保存表版本号的缓存（如'default'），None代表不使用查询结果缓存；
+        # 原生SQL（raw()、execute_sql）的写操作不会使缓存失效，需调用invalidate_tables
+        self.query_cache = QueryCache(query_cache) if query_cache else None
         # 用于保持连接
         self._auto_task = None
+        self.ping_interval = ping_interval
+        # 连接空闲超过max_idle秒后，下次获取时重新建立
+        self.max_idle = max_idle
+        self.pool_controller = PoolController(self, max_lifetime, pool_wait_threshold, pool_adjust_interval)
+        # 最近一次健康检查是否成功
+        self.healthy = True
+        # 正在使用的连接数
+        self.inflight = 0
+        # 只读副本，见set_replicas
+        self.replicas = None
+        # Task -> 最近一次写操作的时间，spawn创建的子Task继承
+        self._last_writes = task_local()
+        self._related_loader = None
+        # Task -> 绑定在该Task上的连接，spawn创建的子Task继承
+        self._task_conns = task_local()
+        # 语句执行的钩子，见QueryHook
+        self.query_hooks = []
+        # 执行时间超过slow_query_ms毫秒的语句记录到慢查询日志，None代表不记录
+        self.slow_query_log = None
+        if slow_query_ms:
+            self.slow_query_log = SlowQueryLog(slow_query_ms, slow_query_interval)
+            self.add_query_hook(self.slow_query_log)
 
     @property
     def loop(self):
@@ -151,10 +378,28 @@ class AsyncDatabase(Database):
             self._loop = asyncio.get_event_loop()
         return self._loop
 
+    @property
+    def related_loader(self):
+        """
+        外键关联对象的批量加载器
+        """
+        if self._related_loader is None:
+            self._related_loader = RelatedObjectLoader(self.loop)
+        return self._related_loader
+
     def is_closed(self):
         return self.closed
 
-    def get_conn(self):
+    def get_conn(self, reuse=True):
+        """
+        :param reuse: 当前Task已绑定连接时是否复用该连接
+        :return:
+        """
+        if reuse:
+            conn = self.pinned_conn()
+            if conn is not None:
+                return conn
+
         return AsyncConnection(
             db=self,
             autocommit=self.autocommit,
@@ -162,6 +407,118 @@ class AsyncDatabase(Database):
             exception_wrapper=self.exception_wrapper
         )
 
+    def pinned_conn(self):
+        """
+        :return: 当前Task绑定的连接，没有则返回None
+        """
+        task = current_task(self.loop)
+        if task is None:
+            return None
+        return self._task_conns.get(task)
+
+    def pin_conn(self, conn):
+        """
+        将连接绑定到当前Task上，当前Task已绑定其他连接时不做处理
+        :param conn:
+        :return: 是否绑定成功
+        """
+        task = current_task(self.loop)
+        if task is None or task in self._task_conns:
+            return False
+        self._task_conns[task] = conn
+        return True
+
+    def unpin_conn(self, conn):
+        task = current_task(self.loop)
+        if task is not None and self._task_conns.get(task) is conn:
+            del self._task_conns[task]
+
+    def add_query_hook(self, hook):
+        """
+        注册语句执行的钩子
+        :param hook: QueryHook
+        """
+        if hook not in self.query_hooks:
+            self.query_hooks.append(hook)
+
+    def remove_query_hook(self, hook):
+        if hook in self.query_hooks:
+            self.query_hooks.remove(hook)
+
+    def set_replicas(self, databases, weights=None, policy=ROUND_ROBIN, read_after_write=1.0):
+        """
+        设置只读副本，设置后SELECT查询会被路由到副本上执行，参数见ReplicaSet
+        """
+        self.replicas = ReplicaSet(databases, weights, policy, read_after_write) if databases else None
+        for replica in databases or ():
+            # 副本上执行的语句也触发主库注册的钩子
+            replica.query_hooks = self.query_hooks
+
+    def mark_write(self):
+        """
+        记录当前Task执行了写操作，之后一段时间内的读查询仍使用主库
+        """
+        if self.replicas is None:
+            return
+        task = current_task(self.loop)
+        if task is not None:
+            self._last_writes[task] = self.loop.time()
+
+    async def get_read_conn(self, reuse=True):
+        """
+        获取执行只读查询的连接；
+        当前Task已绑定连接（如处于事务中）、刚执行过写操作或没有可用副本时使用主库
+        :param reuse: 见get_conn
+        :return:
+        """
+        replicas = self.replicas
+        if replicas is None:
+            return self.get_conn(reuse)
+
+        task = current_task(self.loop)
+        if task is not None:
+            if task in self._task_conns:
+                return self.get_conn(reuse)
+            last_write = self._last_writes.get(task)
+            if last_write is not None and self.loop.time() - last_write < replicas.read_after_write:
+                return self.get_conn(reuse)
+
+        while True:
+            replica = replicas.choose()
+            if replica is None:
+                return self.get_conn(reuse)
+            if replica.closed:
+                try:
+                    await replica.connect()
+                except Exception as e:
+                    logger.warning('Replica %s is unavailable: %s', replica.connect_kwargs.get('host'), e)
+                    replicas.eject(replica)
+                    continue
+            return replica.get_conn(reuse=False)
+
+    async def invalidate_tables(self, tables):
+        """
+        使依赖这些表的缓存查询结果失效；处于事务中时提交后会再失效一次；
+        通过原生SQL修改数据后需手动调用
+        :param tables: 表名列表
+        :return:
+        """
+        if self.query_cache is None:
+            return
+
+        conn = self.pinned_conn()
+        if conn is not None and conn.transaction_depth():
+            conn.dirty_tables.update(tables)
+        await self.query_cache.bump(tables)
+
+    def connection_context(self):
+        """
+        在代码块（或被装饰的协程）执行期间，当前Task中的查询都使用同一个连接；
+        spawn/gather创建的子Task共用该连接，语句依次执行，asyncio.gather等创建的子Task不会共用该连接；
+        连接在进入时获取，用作装饰器时每次调用各自获取连接
+        """
+        return ConnectionContext(self)
+
     async def close(self):
         if self.deferred:
             raise Exception('Error, database not properly initialized before closing connection')
@@ -173,6 +530,10 @@ class AsyncDatabase(Database):
                 self.closed = True
                 await self.pool.wait_closed()
 
+        if self.replicas is not None:
+            for replica in self.replicas:
+                await replica.close()
+
     async def connect(self, safe=True):
         if self.deferred:
             raise OperationalError('Database has not been initialized')
@@ -195,11 +556,13 @@ class AsyncDatabase(Database):
         self._auto_task.cancel()
 
     async def keep_engine(self):
-        while 1:
-            async with self.pool.acquire() as conn:
-                await conn.ping()
+        await self.pool_controller.run()
 
-            await asyncio.sleep(60)
+    def pool_stats(self):
+        """
+        连接池的统计信息，见PoolController.stats
+        """
+        return self.pool_controller.stats()
 
     def get_result_wrapper(self, wrapper_type):
         if wrapper_type == RESULTS_NAIVE:
@@ -212,14 +575,20 @@ class AsyncDatabase(Database):
             return AsyncDictQueryResultWrapper
         elif wrapper_type == RESULTS_AGGREGATE_MODELS:
             return AsyncAggregateQueryResultWrapper
+        elif wrapper_type == RESULTS_NAMEDTUPLES:
+            return AsyncNamedTupleQueryResultWrapper
+        elif wrapper_type == RESULTS_ROWS:
+            return AsyncRowQueryResultWrapper
+        elif wrapper_type == RESULTS_COLUMNS:
+            return AsyncColumnsQueryResultWrapper
         else:
             return AsyncNaiveQueryResultWrapper
 
     def atomic(self, transaction_type=None):
-        return Atomic(self.get_conn(), transaction_type)
+        return Atomic(self, transaction_type)
 
     def transaction(self, transaction_type=None):
-        return Transaction(self.get_conn(), transaction_type)
+        return Transaction(self, transaction_type)
 
     commit_on_success = property(transaction)
 
@@ -294,7 +663,10 @@ class AsyncDatabase(Database):
 
     async def execute_sql(self, sql, params=None, require_commit=True):
         async with self.get_conn() as conn:
-            return await conn.execute_sql(sql, params, require_commit=require_commit)
+            cursor = await conn.execute_sql(sql, params, require_commit=require_commit)
+        if not is_read_only_sql(sql):
+            self.mark_write()
+        return cursor
 
     def extract_date(self, date_part, date_field):
         return fn.EXTRACT(Clause(date_part, R('FROM'), date_field))
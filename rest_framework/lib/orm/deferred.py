@@ -0,0 +1,83 @@
+import asyncio
+import weakref
+
+from .peewee import FieldDescriptor
+from .utils import spawn
+
+
+class DeferredFieldDescriptor(FieldDescriptor):
+    """
+    字段描述符：only()/defer()没有查询的字段第一次访问时返回一个协程，
+    由实例所在结果集的DeferredFields为所有实例批量查询该字段
+    """
+
+    def __get__(self, instance, instance_type=None):
+        if instance is not None:
+            data = instance._data
+            if self.att_name in data:
+                return data[self.att_name]
+            deferred = instance._deferred
+            if deferred is not None and self.att_name in deferred.field_names:
+                return deferred.load(instance, self.att_name)
+            return None
+        return self.field
+
+
+class DeferredFields(object):
+    """
+    一个结果集中延迟加载的字段：
+    任一实例访问某个延迟字段时，用一条 WHERE pk IN (...) 查询结果集中所有尚未加载该字段的实例，
+    并发的访问共用同一次查询
+    """
+
+    def __init__(self, model_class, field_names):
+        """
+        :param model_class: 模型类
+        :param field_names: 延迟加载的字段名
+        """
+        self.model_class = model_class
+        self.field_names = frozenset(field_names)
+        self._instances = []
+        # 字段名 -> 正在进行的查询
+        self._loading = {}
+
+    def add(self, instance):
+        """
+        从实例中移除延迟字段（构造实例时填入的默认值），访问时再加载
+        """
+        for field_name in self.field_names:
+            instance._data.pop(field_name, None)
+        instance._deferred = self
+        self._instances.append(weakref.ref(instance))
+
+    async def load(self, instance, field_name):
+        """
+        :return: 实例的field_name字段的值
+        """
+        while field_name not in instance._data:
+            future = self._loading.get(field_name)
+            if future is None or future.done():
+                # 已完成的查询不包括之后加入的实例
+                future = self._loading[field_name] = spawn(self._fetch(field_name))
+            await asyncio.shield(future)
+        return instance._data[field_name]
+
+    async def _fetch(self, field_name):
+        pk_name = self.model_class._meta.primary_key.name
+        instances = []
+        for ref in self._instances:
+            instance = ref()
+            if instance is not None and field_name not in instance._data:
+                instances.append(instance)
+        self._instances = [ref for ref in self._instances if ref() is not None]
+        if not instances:
+            return
+
+        pk_field = self.model_class._meta.primary_key
+        field = self.model_class._meta.fields[field_name]
+        pks = list(set(instance._data.get(pk_name) for instance in instances))
+        rows = await self.model_class.select(pk_field, field).where(pk_field << pks).order_by().tuples()
+        values = dict(rows)
+        for instance in instances:
+            # 加载期间被赋值的字段保留新值，已删除的行为None
+            instance._data.setdefault(field_name, values.get(instance._data.get(pk_name)))
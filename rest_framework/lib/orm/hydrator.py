@@ -0,0 +1,339 @@
+from collections import OrderedDict
+
+from .peewee import Model, Field, FieldDescriptor, RelationDescriptor, ForeignKeyField
+from .deferred import DeferredFieldDescriptor
+
+# 缓存的行转换函数数量上限
+HYDRATOR_CACHE_SIZE = 512
+
+# 缓存key -> 生成的行转换函数
+_hydrators = OrderedDict()
+
+# 缓存key -> 生成的单个模型实例构造函数
+_constructors = OrderedDict()
+
+
+def _find_descriptor(model_class, attr):
+    for klass in model_class.__mro__:
+        if attr in klass.__dict__:
+            return klass.__dict__[attr]
+    return None
+
+
+def _is_plain_field(model_class, attr):
+    """
+    :return: 对新建实例赋值attr是否等同于直接写入instance._data[attr]
+    """
+    descriptor = _find_descriptor(model_class, attr)
+    return (isinstance(descriptor, FieldDescriptor) and descriptor.att_name == attr and
+            type(descriptor).__set__ in (FieldDescriptor.__set__, RelationDescriptor.__set__))
+
+
+def is_plain_getter(model_class, attr):
+    """
+    :return: 实例的attr属性是否等同于instance._data.get(attr)
+    """
+    descriptor = _find_descriptor(model_class, attr)
+    # 新建的实例还没有延迟加载的字段，DeferredFieldDescriptor的行为与FieldDescriptor相同
+    return (isinstance(descriptor, FieldDescriptor) and descriptor.att_name == attr and
+            type(descriptor).__get__ in (FieldDescriptor.__get__, DeferredFieldDescriptor.__get__))
+
+
+def _is_plain_model(model_class):
+    return (model_class.__init__ is Model.__init__ and
+            model_class._prepare_instance is Model._prepare_instance)
+
+
+def _converter(conv):
+    """
+    :return: (类型, 函数)，类型为None（原值）、'coerce'（非None时调用函数）或'call'（直接调用函数）
+    """
+    if conv is None:
+        return None, None
+    field = getattr(conv, '__self__', None)
+    if isinstance(field, ForeignKeyField) and getattr(conv, '__func__', None) is ForeignKeyField.python_value:
+        # 从数据库读取的外键值不会是关联模型的实例，直接按关联字段转换
+        return _converter(field.to_field.python_value)
+    if isinstance(field, Field) and getattr(conv, '__func__', None) is Field.python_value:
+        coerce = field.coerce
+        if getattr(coerce, '__func__', None) is Field.coerce:
+            return None, None
+        return 'coerce', coerce
+    return 'call', conv
+
+
+def _converter_key(conv):
+    field = getattr(conv, '__self__', None)
+    if conv is None:
+        return None
+    elif isinstance(field, Field) and getattr(field, 'model_class', None) is not None:
+        # 同一模型同名字段（包括alias()得到的副本）的转换方式相同
+        return field.model_class, field.name, conv.__func__
+    return False
+
+
+def hydrator_key(wrapper, description):
+    """
+    :param wrapper: 已初始化的ModelQueryResultWrapper
+    :param description: 游标的description
+    :return: 由模型、查询的列和连接关系组成的缓存key，无法生成转换函数时返回None
+    """
+    keys = set()
+    columns = []
+    for i, (key, constructor, attr, conv) in enumerate(wrapper.column_map):
+        if not (isinstance(key, type) and issubclass(key, Model) and key is constructor):
+            return None
+        conv_key = _converter_key(conv)
+        if conv_key is False:
+            return None
+        if attr is None:
+            attr = description[i][0]
+        keys.add(key)
+        columns.append((key, attr, conv_key))
+
+    joins = []
+    for metadata, check_null, fk_present, pk_present in wrapper.join_list:
+        if metadata.dest in keys:
+            dest = metadata.dest
+        elif metadata.dest_model in keys:
+            dest = metadata.dest_model
+        else:
+            return None
+        if metadata.src not in keys or not isinstance(metadata.attr, str):
+            return None
+        joins.append((
+            metadata.src,
+            dest,
+            metadata.attr,
+            metadata.primary_key.name if metadata.primary_key is not None else None,
+            metadata.foreign_key.name if metadata.foreign_key is not None else None,
+            bool(metadata.is_backref),
+            bool(check_null),
+            bool(fk_present),
+            bool(pk_present)))
+
+    if wrapper.model not in keys:
+        return None
+    # 有可调用默认值的模型每次都需要调用get_default_dict
+    defaults = tuple(sorted(key.__name__ for key in keys if key._meta._default_callable_list))
+    return wrapper.model, tuple(columns), tuple(joins), defaults
+
+
+def generate_hydrator(wrapper, description):
+    """
+    按查询的列和连接关系生成行转换函数：
+    字段值经预先绑定的转换函数直接写入实例的_data，不做转换的列直接赋值，
+    连接的实例直接写入外键值和_obj_cache，只有无法确定赋值行为的属性才使用setattr
+    :return: 行数据 -> 主模型实例
+    """
+    namespace = {'new': object.__new__, 'set': set}
+    lines = []
+    instances = OrderedDict()
+    # 使用了setattr的实例，_dirty可能被修改，需要在最后清空
+    touched = set()
+
+    def bind(value):
+        name = '_v%d' % len(namespace)
+        namespace[name] = value
+        return name
+
+    def instance(key):
+        if key not in instances:
+            index = len(instances)
+            instances[key] = index
+            model = bind(key)
+            if _is_plain_model(key):
+                if key._meta._default_callable_list:
+                    defaults = '%s()' % bind(key._meta.get_default_dict)
+                else:
+                    defaults = '%s.copy()' % bind(key._meta._default_by_name)
+                lines.append('i%d = new(%s)' % (index, model))
+                lines.append('i%d._data = d%d = %s' % (index, index, defaults))
+                lines.append('i%d._dirty = set()' % index)
+                lines.append('i%d._obj_cache = {}' % index)
+            else:
+                lines.append('i%d = %s()' % (index, model))
+                lines.append('d%d = i%d._data' % (index, index))
+                touched.add(index)
+        return instances[key]
+
+    def get(key, attr):
+        index = instances[key]
+        if is_plain_getter(key, attr):
+            return 'd%d.get(%r)' % (index, attr)
+        return 'getattr(i%d, %r)' % (index, attr)
+
+    def assign(key, attr, value):
+        index = instances[key]
+        if _is_plain_field(key, attr):
+            return 'd%d[%r] = %s' % (index, attr, value)
+        if hasattr(_find_descriptor(key, attr), '__set__'):
+            touched.add(index)
+        return 'setattr(i%d, %r, %s)' % (index, attr, value)
+
+    def assign_instance(key, attr, dest_key):
+        # 等同于对新建实例执行RelationDescriptor.__set__(instance, 关联实例)
+        index, dest = instances[key], instances[dest_key]
+        descriptor = _find_descriptor(key, attr)
+        if (isinstance(descriptor, RelationDescriptor) and descriptor.att_name == attr and
+                type(descriptor).__set__ is RelationDescriptor.__set__ and
+                issubclass(dest_key, descriptor.rel_model)):
+            return ['d%d[%r] = %s' % (index, attr, get(dest_key, descriptor.field.to_field.name)),
+                    'i%d._obj_cache[%r] = i%d' % (index, attr, dest)]
+        if hasattr(descriptor, '__set__'):
+            touched.add(index)
+        return ['setattr(i%d, %r, i%d)' % (index, attr, dest)]
+
+    instance(wrapper.model)
+    for i, (key, constructor, attr, conv) in enumerate(wrapper.column_map):
+        instance(key)
+        if attr is None:
+            attr = description[i][0]
+
+        kind, func = _converter(conv)
+        if kind is None:
+            value = 'row[%d]' % i
+        elif kind == 'coerce':
+            lines.append('v = row[%d]' % i)
+            value = 'v if v is None else %s(v)' % bind(func)
+        else:
+            value = '%s(row[%d])' % (bind(func), i)
+        lines.append(assign(key, attr, value))
+
+    prepared = [wrapper.model]
+    for metadata, check_null, fk_present, pk_present in wrapper.join_list:
+        src_key = metadata.src
+        dest_key = metadata.dest if metadata.dest in instances else metadata.dest_model
+        src, dest = instances[src_key], instances[dest_key]
+        pk_name = metadata.primary_key.name if metadata.primary_key is not None else None
+        fk_name = metadata.foreign_key.name if metadata.foreign_key is not None else None
+
+        block = []
+        if pk_name is not None:
+            block.append('if %r in d%d and %s is None:' % (metadata.attr, src, get(dest_key, pk_name)))
+            block.append('    ' + assign(dest_key, pk_name, 'd%d[%r]' % (src, metadata.attr)))
+            if metadata.is_backref and fk_name is not None:
+                block.append('if %s is not None and d%d.get(%r) is None:' % (
+                    get(src_key, pk_name), dest, fk_name))
+                block.extend('    ' + line for line in assign_instance(dest_key, fk_name, src_key))
+        block.extend(assign_instance(src_key, metadata.attr, dest_key))
+        block.append('p%d = True' % len(prepared))
+
+        if check_null and fk_present:
+            lines.append('if d%d.get(%r):' % (src, fk_name))
+            block = ['    ' + line for line in block]
+        elif check_null and pk_present:
+            lines.append('if d%d.get(%r):' % (dest, pk_name))
+            block = ['    ' + line for line in block]
+        lines.extend(block)
+        prepared.append(dest_key)
+
+    # 与ModelQueryResultWrapper.process_row一致，连接关系处理完后再依次调用_prepare_instance
+    for position, key in enumerate(prepared):
+        index = instances[key]
+        if not _is_plain_model(key) or key.prepared is not Model.prepared:
+            statement = 'i%d._prepare_instance()' % index
+        elif index in touched:
+            statement = 'i%d._dirty.clear()' % index
+        else:
+            continue
+        if position:
+            lines.append('if p%d:' % position)
+            statement = '    ' + statement
+        lines.append(statement)
+    if len(prepared) > 1:
+        lines.insert(0, '; '.join(['p%d = False' % position for position in range(1, len(prepared))]))
+    lines.append('return i%d' % instances[wrapper.model])
+
+    source = 'def hydrate(row):\n%s\n' % '\n'.join('    ' + line for line in lines)
+    exec(compile(source, '<hydrator %s>' % wrapper.model.__name__, 'exec'), namespace)
+    return namespace['hydrate']
+
+
+def get_hydrator(wrapper, description):
+    """
+    :param wrapper: 已初始化的ModelQueryResultWrapper
+    :param description: 游标的description
+    :return: 缓存的行转换函数，查询包含模型别名等无法生成时返回None
+    """
+    key = hydrator_key(wrapper, description)
+    if key is None:
+        return None
+
+    hydrator = _hydrators.get(key)
+    if hydrator is None:
+        hydrator = _hydrators[key] = generate_hydrator(wrapper, description)
+        if len(_hydrators) > HYDRATOR_CACHE_SIZE:
+            _hydrators.popitem(last=False)
+    else:
+        _hydrators.move_to_end(key)
+    return hydrator
+
+
+def generate_constructor(model_class, columns):
+    """
+    生成由行数据构造单个模型实例的函数（不调用_prepare_instance），赋值方式与generate_hydrator相同
+    :param model_class: 模型类
+    :param columns: [(列序号, 属性名, 转换函数)]
+    :return: 行数据 -> 模型实例
+    """
+    namespace = {'new': object.__new__, 'set': set}
+
+    def bind(value):
+        name = '_v%d' % len(namespace)
+        namespace[name] = value
+        return name
+
+    if _is_plain_model(model_class):
+        if model_class._meta._default_callable_list:
+            defaults = '%s()' % bind(model_class._meta.get_default_dict)
+        else:
+            defaults = '%s.copy()' % bind(model_class._meta._default_by_name)
+        lines = ['i = new(%s)' % bind(model_class),
+                 'i._data = d = %s' % defaults,
+                 'i._dirty = set()',
+                 'i._obj_cache = {}']
+    else:
+        lines = ['i = %s()' % bind(model_class), 'd = i._data']
+
+    for i, attr, conv in columns:
+        kind, func = _converter(conv)
+        if kind is None:
+            value = 'row[%d]' % i
+        elif kind == 'coerce':
+            lines.append('v = row[%d]' % i)
+            value = 'v if v is None else %s(v)' % bind(func)
+        else:
+            value = '%s(row[%d])' % (bind(func), i)
+
+        if _is_plain_field(model_class, attr):
+            lines.append('d[%r] = %s' % (attr, value))
+        else:
+            lines.append('setattr(i, %r, %s)' % (attr, value))
+    lines.append('return i')
+
+    source = 'def construct(row):\n%s\n' % '\n'.join('    ' + line for line in lines)
+    exec(compile(source, '<constructor %s>' % model_class.__name__, 'exec'), namespace)
+    return namespace['construct']
+
+
+def get_constructor(model_class, columns):
+    """
+    :param model_class: 模型类
+    :param columns: [(列序号, 属性名, 转换函数)]
+    :return: 缓存的实例构造函数，转换函数无法作为缓存key时返回None
+    """
+    conv_keys = tuple(_converter_key(conv) for _, _, conv in columns)
+    if False in conv_keys:
+        return None
+    defaults = bool(model_class._meta._default_callable_list)
+    key = (model_class, tuple((i, attr) for i, attr, _ in columns), conv_keys, defaults)
+
+    constructor = _constructors.get(key)
+    if constructor is None:
+        constructor = _constructors[key] = generate_constructor(model_class, columns)
+        if len(_constructors) > HYDRATOR_CACHE_SIZE:
+            _constructors.popitem(last=False)
+    else:
+        _constructors.move_to_end(key)
+    return constructor
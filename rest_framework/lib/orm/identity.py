@@ -0,0 +1,164 @@
+from .peewee import Field, Expression, Node, OP
+from .context import CallableContextManager
+from .utils import current_task, task_local
+
+# Task -> 绑定在该Task上的IdentityMap
+_task_maps = task_local()
+
+
+class IdentityMap:
+    """
+    同一主键的模型实例只保留一个：
+    查询结果中已存在的行会更新并复用已有实例（未保存的修改不会被覆盖），
+    按主键的get()可以直接返回完整加载过的实例而不再查询
+    """
+
+    def __init__(self):
+        # (模型类, 主键) -> 实例
+        self._instances = {}
+        # 加载了全部字段的实例的键
+        self._complete = set()
+
+    def __len__(self):
+        return len(self._instances)
+
+    @staticmethod
+    def _key(model_class, pk):
+        return model_class, pk
+
+    def get(self, model_class, pk):
+        """
+        :return: 加载了全部字段的实例，没有则返回None
+        """
+        key = self._key(model_class, pk)
+        if key in self._complete:
+            return self._instances.get(key)
+        return None
+
+    def add(self, instance, complete=True):
+        """
+        :param instance: 模型实例
+        :param complete: 实例是否加载了全部字段
+        :return: 与instance主键相同的唯一实例
+        """
+        pk = instance._get_pk_value()
+        if pk is None:
+            return instance
+
+        key = self._key(type(instance), pk)
+        existing = self._instances.get(key)
+        if existing is None:
+            self._instances[key] = instance
+        elif existing is not instance:
+            for name, value in instance._data.items():
+                if name not in existing._dirty:
+                    existing._data[name] = value
+            existing._obj_cache.update(instance._obj_cache)
+            instance = existing
+
+        if complete:
+            self._complete.add(key)
+        return instance
+
+    def discard(self, instance):
+        key = self._key(type(instance), instance._get_pk_value())
+        self._instances.pop(key, None)
+        self._complete.discard(key)
+
+    def discard_model(self, model_class):
+        """
+        模型对应的表有更新或删除时移除该模型的全部实例
+        """
+        for key in [key for key in self._instances if key[0] is model_class]:
+            self._instances.pop(key)
+            self._complete.discard(key)
+
+    def clear(self):
+        self._instances.clear()
+        self._complete.clear()
+
+
+def get_identity_map():
+    """
+    :return: 当前Task绑定的IdentityMap，没有则返回None
+    """
+    if not _task_maps:
+        return None
+    task = current_task()
+    if task is None:
+        return None
+    return _task_maps.get(task)
+
+
+def activate_identity_map(identity_map=None):
+    """
+    将IdentityMap绑定到当前Task上，同一Task（如一次请求）中查询的模型实例按主键去重；
+    通过utils.spawn/gather创建的子Task共用同一个IdentityMap
+    :param identity_map: 默认新建一个
+    :return: 绑定的IdentityMap，不在Task中执行时返回None
+    """
+    task = current_task()
+    if task is None:
+        return None
+    if identity_map is None:
+        identity_map = IdentityMap()
+    _task_maps[task] = identity_map
+    return identity_map
+
+
+def deactivate_identity_map():
+    task = current_task()
+    if task is not None:
+        identity_map = _task_maps.pop(task, None)
+        if identity_map is not None:
+            identity_map.clear()
+
+
+class IdentityMapContext(CallableContextManager):
+    """
+    在代码块（或被装饰的协程）执行期间使用新的IdentityMap，退出时恢复之前绑定的IdentityMap
+    """
+
+    __slots__ = ('identity_map', 'previous')
+
+    def clone(self):
+        return IdentityMapContext()
+
+    async def __aenter__(self):
+        self.previous = get_identity_map()
+        self.identity_map = activate_identity_map()
+        return self.identity_map
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        deactivate_identity_map()
+        if self.previous is not None:
+            activate_identity_map(self.previous)
+
+
+def identity_map():
+    return IdentityMapContext()
+
+
+def pk_lookup(query):
+    """
+    :param query: SelectQuery
+    :return: 查询为按主键相等查询模型全部字段时返回（转换后的）主键值，否则返回None
+    """
+    model_class = query.model_class
+    pk_field = model_class._meta.primary_key
+    if (not isinstance(pk_field, Field) or query._explicit_selection or any(query._joins.values()) or
+            query._tuples or query._dicts or query._namedtuples or query._rows or query._columns or
+            query._from or query._distinct or query._group_by or query._having or query._windows or
+            query._offset or query._for_update):
+        return None
+
+    expression = query._where
+    if not (isinstance(expression, Expression) and expression.op == OP.EQ and
+            isinstance(expression.lhs, Field) and expression.lhs.model_class is model_class and
+            expression.lhs.name == pk_field.name and not isinstance(expression.rhs, Node)):
+        return None
+
+    try:
+        return pk_field.python_value(pk_field.db_value(expression.rhs))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,216 @@
+import re
+from collections import OrderedDict
+
+from .peewee import logger
+from .utils import current_task, task_local
+
+# 缓存的SQL指纹数量上限
+FINGERPRINT_CACHE_SIZE = 1024
+
+# 驱动无法确定行数时rowcount为-1或2**64-1
+MAX_ROWCOUNT = 2 ** 63
+
+# SQL -> 指纹
+_fingerprints = OrderedDict()
+
+# Task -> 绑定在该Task上的QueryStats
+_task_stats = task_local()
+
+# Task -> 该Task中执行的语句的来源（如处理请求的handler）
+_task_labels = task_local()
+
+_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM_RE = re.compile(r'%s|%\(\w+\)s')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES_RE = re.compile(r'\((?:\.\.\.|\?)\)(?:\s*,\s*\((?:\.\.\.|\?)\))+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    SQL的指纹：去掉注释（如优化器提示），常量和参数替换为?，IN列表和多行VALUES合并，
+    只有参数值或列表长度不同的语句指纹相同
+    :param sql:
+    :return:
+    """
+    result = _fingerprints.get(sql)
+    if result is not None:
+        _fingerprints.move_to_end(sql)
+        return result
+
+    result = _COMMENT_RE.sub(' ', sql)
+    result = _STRING_RE.sub('?', result)
+    result = _PARAM_RE.sub('?', result)
+    result = _NUMBER_RE.sub('?', result)
+    result = _IN_LIST_RE.sub('(...)', result)
+    result = _VALUES_RE.sub('(...), ...', result)
+    result = _SPACE_RE.sub(' ', result).strip()
+
+    _fingerprints[sql] = result
+    if len(_fingerprints) > FINGERPRINT_CACHE_SIZE:
+        _fingerprints.popitem(last=False)
+    return result
+
+
+class QueryEvent(object):
+    """
+    一条语句的执行记录，传给QueryHook的各个方法
+    """
+    __slots__ = ('database', 'sql', 'params', 'connection_id', 'acquire_wait',
+                 'label', 'start', 'duration', 'rows', 'error')
+
+    def __init__(self, database, sql, params, connection_id=None, acquire_wait=0.0):
+        """
+        :param database: 执行语句的AsyncDatabase（使用副本时为副本）
+        :param sql: 实际执行的SQL
+        :param params: 参数
+        :param connection_id: 数据库连接的线程id
+        :param acquire_wait: 从连接池获取该连接的等待时间（秒），只计入连接上执行的第一条语句
+        """
+        self.database = database
+        self.sql = sql
+        self.params = params
+        self.connection_id = connection_id
+        self.acquire_wait = acquire_wait
+        # 语句的来源，见set_query_label
+        self.label = get_query_label()
+        self.start = None
+        # 执行时间（秒）
+        self.duration = None
+        # 返回或影响的行数，无法确定时为None
+        self.rows = None
+        self.error = None
+
+    @property
+    def fingerprint(self):
+        return fingerprint(self.sql)
+
+    def __repr__(self):
+        return '<QueryEvent %r %s>' % (self.fingerprint, self.duration)
+
+
+class QueryHook(object):
+    """
+    语句执行的钩子，通过AsyncDatabase.add_query_hook注册，按需重写各方法；
+    钩子中的异常只记录日志，不影响语句执行
+    """
+
+    def before_execute(self, event):
+        """
+        语句执行前调用，此时event.duration和event.rows为None
+        """
+
+    def after_execute(self, event):
+        """
+        语句执行成功后调用
+        """
+
+    def on_error(self, event, exc):
+        """
+        语句执行出错后调用
+        """
+
+
+def call_hooks(hooks, method, *args):
+    for hook in hooks:
+        try:
+            getattr(hook, method)(*args)
+        except Exception:
+            logger.exception('Error in query hook %r.%s', hook, method)
+
+
+class QueryStats(object):
+    """
+    一个Task（如一次请求）中执行的语句的统计：语句数、出错数、总执行时间、总等待连接时间和最慢的语句
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.acquire_wait = 0.0
+        self.slowest = None
+
+    def record(self, event):
+        """
+        :param event: 执行完成的QueryEvent
+        """
+        self.count += 1
+        if event.error is not None:
+            self.errors += 1
+        self.total_time += event.duration
+        self.acquire_wait += event.acquire_wait
+        if self.slowest is None or event.duration > self.slowest.duration:
+            self.slowest = event
+
+    def server_timing(self):
+        """
+        :return: Server-Timing响应头的值，时间单位为毫秒
+        """
+        metrics = [
+            'db;dur=%.3f;desc="%d queries"' % (self.total_time * 1000, self.count),
+            'db-wait;dur=%.3f' % (self.acquire_wait * 1000),
+        ]
+        if self.slowest is not None:
+            desc = self.slowest.fingerprint[:100].replace('\\', '\\\\').replace('"', '\\"')
+            metrics.append('db-slowest;dur=%.3f;desc="%s"' % (self.slowest.duration * 1000, desc))
+        return ', '.join(metrics)
+
+
+def get_query_stats():
+    """
+    :return: 当前Task绑定的QueryStats，没有则返回None
+    """
+    if not _task_stats:
+        return None
+    task = current_task()
+    if task is None:
+        return None
+    return _task_stats.get(task)
+
+
+def activate_query_stats(stats=None):
+    """
+    将QueryStats绑定到当前Task上，统计该Task中执行的语句；
+    通过utils.spawn/gather创建的子Task共用同一个QueryStats
+    :param stats: 默认新建一个
+    :return: 绑定的QueryStats，不在Task中执行时返回None
+    """
+    task = current_task()
+    if task is None:
+        return None
+    if stats is None:
+        stats = QueryStats()
+    _task_stats[task] = stats
+    return stats
+
+
+def deactivate_query_stats():
+    task = current_task()
+    if task is not None:
+        _task_stats.pop(task, None)
+
+
+def get_query_label():
+    """
+    :return: 当前Task中执行的语句的来源，没有则返回None
+    """
+    if not _task_labels:
+        return None
+    task = current_task()
+    if task is None:
+        return None
+    return _task_labels.get(task)
+
+
+def set_query_label(label):
+    """
+    标记当前Task中执行的语句的来源（如处理请求的handler），记录在QueryEvent.label中；
+    通过utils.spawn/gather创建的子Task继承该标记
+    :param label:
+    """
+    task = current_task()
+    if task is not None:
+        _task_labels[task] = label
@@ -0,0 +1,65 @@
+from .utils import capture_task_locals, run_with_task_locals
+
+
+class RelatedObjectLoader:
+    """
+    外键关联对象的批量加载器；
+    同一轮事件循环中请求的关联对象会被收集起来，在下一轮事件循环中
+    按目标字段合并为一条 WHERE to_field IN (...) 查询；
+    只有状态（所属请求、绑定的连接、identity map等）相同的Task的请求才会合并，
+    查询在继承了这些状态的Task中执行，与请求者直接执行查询的结果一致
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        # (model_class, field_name, 请求者Task的状态) -> (to_field, {value: [future, ...]}, 请求者Task的状态)
+        self._pending = {}
+        self._scheduled = False
+
+    def load(self, to_field, value):
+        """
+        :param to_field: 外键指向的字段
+        :param value: 外键值
+        :return: Future，结果为关联的模型实例
+        """
+        future = self.loop.create_future()
+        task_locals = capture_task_locals(self.loop)
+        key = (to_field.model_class, to_field.name, tuple((id(mapping), id(value)) for mapping, value in task_locals))
+        if key not in self._pending:
+            self._pending[key] = (to_field, {}, task_locals)
+        self._pending[key][1].setdefault(value, []).append(future)
+
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon(self._dispatch)
+        return future
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        self._scheduled = False
+        for to_field, waiters, task_locals in pending.values():
+            self.loop.create_task(run_with_task_locals(task_locals, self._resolve(to_field, waiters)))
+
+    @staticmethod
+    async def _resolve(to_field, waiters):
+        rel_model = to_field.model_class
+        try:
+            rows = await rel_model.select().where(to_field << list(waiters))
+        except Exception as e:
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        objects = {row._data.get(to_field.name): row for row in rows}
+        for value, futures in waiters.items():
+            obj = objects.get(value)
+            for future in futures:
+                if future.done():
+                    continue
+                if obj is None:
+                    future.set_exception(rel_model.DoesNotExist(
+                        'Instance matching query does not exist: %s = %r' % (to_field.name, value)))
+                else:
+                    future.set_result(obj)
@@ -1,4 +1,10 @@
+import asyncio
+
 from .peewee import Model, ModelAlias, IntegrityError
+from .peewee import RelationDescriptor, ForeignKeyField, Field
+from .peewee import SQL, Clause
+from .identity import get_identity_map
+from .deferred import DeferredFieldDescriptor
 from .query import (
     AsyncSelectQuery,
     AsyncUpdateQuery,
@@ -6,9 +12,82 @@ from .query import (
     AsyncDeleteQuery,
     AsyncRawQuery,
     AsyncNoopSelectQuery,
+    BULK_BATCH_SIZE,
+    BULK_MAX_BYTES,
+    iter_row_chunks,
 )
 
 
+class AsyncRelationDescriptor(RelationDescriptor):
+    """
+    外键关联对象描述符；
+    关联对象已缓存（如join查询）时直接返回，否则返回一个协程，
+    由数据库的关联对象加载器批量查询
+    """
+
+    def get_object_or_id(self, instance):
+        rel_id = instance._data.get(self.att_name)
+        if self.att_name in instance._obj_cache:
+            return instance._obj_cache[self.att_name]
+        elif rel_id is not None:
+            return self.load_object(instance, rel_id)
+        elif not self.field.null:
+            raise self.rel_model.DoesNotExist
+        return rel_id
+
+    async def load_object(self, instance, rel_id):
+        identity_map = get_identity_map()
+        obj = None
+        if identity_map is not None and self.field.to_field is self.rel_model._meta.primary_key:
+            obj = identity_map.get(self.rel_model, rel_id)
+
+        if obj is None:
+            loader = self.rel_model._meta.database.related_loader
+            obj = await loader.load(self.field.to_field, rel_id)
+            if identity_map is not None:
+                obj = identity_map.add(obj)
+        instance._obj_cache[self.att_name] = obj
+        return obj
+
+    async def load_objects(self, instances):
+        """
+        批量加载多个实例的关联对象并缓存在实例上；
+        所有外键值在同一轮事件循环中交给加载器，合并为一次查询，不为每个实例创建Task；
+        加载失败（如关联对象不存在）的实例不缓存，之后访问时照常抛出异常
+        :return: 已缓存的关联对象
+        """
+        identity_map = get_identity_map()
+        use_identity_map = identity_map is not None and self.field.to_field is self.rel_model._meta.primary_key
+        loader = self.rel_model._meta.database.related_loader
+        objects, pending = [], []
+        for instance in instances:
+            rel_id = instance._data.get(self.att_name)
+            if self.att_name in instance._obj_cache:
+                objects.append(instance._obj_cache[self.att_name])
+                continue
+            elif rel_id is None:
+                continue
+
+            obj = identity_map.get(self.rel_model, rel_id) if use_identity_map else None
+            if obj is None:
+                pending.append((instance, loader.load(self.field.to_field, rel_id)))
+            else:
+                instance._obj_cache[self.att_name] = obj
+                objects.append(obj)
+
+        if pending:
+            await asyncio.wait([future for _, future in pending])
+        for instance, future in pending:
+            if future.exception() is not None:
+                continue
+            obj = future.result()
+            if identity_map is not None:
+                obj = identity_map.add(obj)
+            instance._obj_cache[self.att_name] = obj
+            objects.append(obj)
+        return objects
+
+
 class AsyncModelAlias(ModelAlias):
 
     def select(self, *selection):
@@ -24,10 +103,21 @@ class AsyncModelAlias(ModelAlias):
 
 
 class AsyncModel(Model):
+    relation_descriptor_class = AsyncRelationDescriptor
+    field_descriptor_class = DeferredFieldDescriptor
+    # only()/defer()查询的实例所属的DeferredFields
+    _deferred = None
 
     def __iter__(self):
         raise NotImplementedError()
 
+    def serializable_value(self, field_name):
+        field = self._meta.fields.get(field_name)
+        if isinstance(field, ForeignKeyField) and field.name not in self._obj_cache:
+            # 关联对象未加载时只返回外键值，避免为了取主键而查询
+            return self._data.get(field.name)
+        return super(AsyncModel, self).serializable_value(field_name)
+
     @classmethod
     def alias(cls):
         return AsyncModelAlias(cls)
@@ -55,6 +145,141 @@ class AsyncModel(Model):
     def insert_many(cls, rows, validate_fields=True):
         return AsyncInsertQuery(cls, rows=rows, validate_fields=validate_fields)
 
+    @classmethod
+    async def bulk_insert(cls, rows, batch_size=BULK_BATCH_SIZE, max_bytes=BULK_MAX_BYTES,
+                          atomic=True, concurrency=1, validate_fields=True):
+        """
+        分批插入大量数据，参数见AsyncInsertQuery.execute_chunked
+        :return: 按批次顺序排列的InsertedChunk列表
+        """
+        query = cls.insert_many(rows, validate_fields=validate_fields)
+        return await query.execute_chunked(batch_size, max_bytes, atomic, concurrency)
+
+    @classmethod
+    def _to_fields(cls, fields):
+        return [field if isinstance(field, Field) else cls._meta.fields[field] for field in fields]
+
+    @classmethod
+    async def bulk_upsert(cls, rows, conflict_fields=None, update_fields=None,
+                          batch_size=BULK_BATCH_SIZE, max_bytes=BULK_MAX_BYTES, atomic=True):
+        """
+        分批插入数据，主键或唯一索引冲突时更新已有的行（INSERT ... ON DUPLICATE KEY UPDATE）；
+        只插入明确给出的字段：字典为其中的键，实例为修改过的字段（以及有值的冲突字段），
+        字段不同的行按字段分组插入
+        :param rows: 字典或模型实例的列表，实例只更新修改过的字段
+        :param conflict_fields: 判断冲突的字段（主键或唯一索引），不会被更新，默认为主键
+        :param update_fields: 冲突时更新的字段，默认为插入的字段（实例为修改过的字段）中除冲突字段以外的字段；
+        必须是每一行都给出的字段，否则冲突时会被更新为默认值
+        :param batch_size: 每批的最大行数
+        :param max_bytes: 每批估算的最大字节数
+        :param atomic: 是否在一个事务中执行所有批次
+        :return: 受影响的行数（MySQL中插入的行计1，更新的行计2）
+        """
+        meta = cls._meta
+        if conflict_fields:
+            conflict_fields = cls._to_fields(conflict_fields)
+        else:
+            conflict_fields = meta.get_primary_key_fields()
+        if update_fields is not None:
+            update_fields = cls._to_fields(update_fields)
+
+        # 插入的字段名 -> 行数据
+        groups, instances = {}, []
+        for row in rows:
+            if isinstance(row, Model):
+                instances.append(row)
+                names = set(name for name in row._dirty if name in meta.fields)
+                names.update(field.name for field in conflict_fields if row._data.get(field.name) is not None)
+                row = dict((name, row._data.get(name)) for name in names)
+            else:
+                row = dict((key if isinstance(key, str) else key.name, value) for key, value in row.items())
+            groups.setdefault(frozenset(row), []).append(row)
+        if not groups:
+            return 0
+
+        queries = []
+        skip = set(field.name for field in conflict_fields)
+        for names, data in groups.items():
+            if update_fields is None:
+                fields = [field for field in meta.sorted_fields if field.name in names and field.name not in skip]
+            else:
+                missing = [field.name for field in update_fields if field.name not in names]
+                if missing:
+                    raise ValueError('update_fields %s are not provided by every row.' % ', '.join(missing))
+                fields = update_fields
+            # 没有需要更新的字段时，冲突的行保持不变
+            queries.append(cls.insert_many(data).on_duplicate_key_update(*(fields or conflict_fields[:1])))
+
+        count = 0
+        database = meta.database
+        async with database.atomic() if atomic else database.connection_context():
+            for query in queries:
+                for chunk in query.iter_chunks(batch_size, max_bytes):
+                    count += database.rows_affected(await chunk._execute())
+
+        for instance in instances:
+            instance._dirty.clear()
+        return count
+
+    @classmethod
+    async def bulk_update(cls, instances, fields=None,
+                          batch_size=BULK_BATCH_SIZE, max_bytes=BULK_MAX_BYTES, atomic=True):
+        """
+        分批更新实例，每批为一条 UPDATE ... SET col = CASE pk WHEN ... END WHERE pk IN (...)
+        :param instances: 已保存的模型实例列表
+        :param fields: 要更新的字段，默认只更新各实例修改过的字段
+        :param batch_size: 每批的最大行数
+        :param max_bytes: 每批估算的最大字节数
+        :param atomic: 是否在一个事务中执行所有批次
+        :return: 受影响的行数
+        """
+        meta = cls._meta
+        if meta.composite_key:
+            raise ValueError('bulk_update() does not support composite primary keys.')
+
+        pk = meta.primary_key
+        if fields:
+            fields = cls._to_fields(fields)
+
+        updates = []
+        for instance in instances:
+            pk_value = instance._get_pk_value()
+            if pk_value is None:
+                raise ValueError('bulk_update() requires instances with a primary key.')
+            names = [field.name for field in fields] if fields else instance._dirty
+            values = dict((meta.fields[name], instance._data.get(name))
+                          for name in names if name in meta.fields and name != pk.name)
+            if values:
+                updates.append((instance, pk_value, values))
+        if not updates:
+            return 0
+
+        count = 0
+        database = meta.database
+        async with database.atomic() if atomic else database.connection_context():
+            for chunk in iter_row_chunks(updates, batch_size, max_bytes, get_row=lambda update: update[2]):
+                count += await cls._bulk_update_query(chunk).execute()
+
+        for instance, pk_value, values in updates:
+            instance._dirty.difference_update(field.name for field in values)
+        return count
+
+    @classmethod
+    def _bulk_update_query(cls, updates):
+        pk = cls._meta.primary_key
+        interpolation = cls._meta.database.interpolation
+        when = 'WHEN %s THEN %s' % (interpolation, interpolation)
+
+        cases = {}
+        for instance, pk_value, values in updates:
+            for field, value in values.items():
+                cases.setdefault(field, []).append(SQL(when, pk.db_value(pk_value), field.db_value(value)))
+
+        # 没有修改该字段的行保持原值
+        update = dict((field, Clause(SQL('CASE'), pk, *whens, SQL('ELSE'), field, SQL('END')))
+                      for field, whens in cases.items())
+        return cls.update(update).where(pk << [pk_value for instance, pk_value, values in updates])
+
     @classmethod
     def insert_from(cls, fields, query):
         return AsyncInsertQuery(cls, fields=fields, query=query)
@@ -13,6 +13,12 @@ from .peewee import (
 
 from .database import AsyncDatabase
 
+# 只用于连接池、不能传给单个连接的参数
+POOL_KWARGS = ('minsize', 'maxsize', 'pool_recycle')
+
+# 服务端因MAX_EXECUTION_TIME终止SELECT时的错误码
+ER_QUERY_TIMEOUT = 3024
+
 
 class AsyncMySQLDatabase(AsyncDatabase, MySQLDatabase):
 
@@ -22,10 +28,44 @@ class AsyncMySQLDatabase(AsyncDatabase, MySQLDatabase):
         conn_kwargs = {
             'charset': 'utf8',
             'use_unicode': True,
+            'pool_recycle': self.max_idle if self.max_idle is not None else -1,
         }
         conn_kwargs.update(kwargs)
         return await aiomysql.create_pool(db=database, **conn_kwargs)
 
+    def add_timeout_hint(self, sql, timeout):
+        # MAX_EXECUTION_TIME只对只读的SELECT生效，单位为毫秒
+        if sql[:7].upper() != 'SELECT ':
+            return sql
+        hint = 'MAX_EXECUTION_TIME(%d)' % max(1, int(timeout * 1000))
+        if sql[7:11] == '/*+ ':
+            return '%s%s %s' % (sql[:11], hint, sql[11:])
+        return 'SELECT /*+ %s */ %s' % (hint, sql[7:])
+
+    def explain_sql(self, sql):
+        if sql[:7].upper() != 'SELECT ':
+            return None
+        return 'EXPLAIN FORMAT=JSON ' + sql
+
+    def is_timeout_error(self, exc):
+        return bool(exc.args) and exc.args[0] == ER_QUERY_TIMEOUT
+
+    async def kill_query(self, conn):
+        # 单独建立连接，连接池耗尽时也能执行
+        conn_kwargs = {'charset': 'utf8', 'use_unicode': True}
+        conn_kwargs.update((key, value) for key, value in self.connect_kwargs.items() if key not in POOL_KWARGS)
+        killer = await aiomysql.connect(db=self.database, **conn_kwargs)
+        try:
+            async with killer.cursor() as cursor:
+                await cursor.execute('KILL QUERY %d' % conn.thread_id())
+        finally:
+            killer.close()
+
+    def get_stream_cursor_class(self):
+        if not aiomysql:
+            raise ImproperlyConfigured('aiomysql must be installed.')
+        return aiomysql.SSCursor
+
     async def get_tables(self, schema=None):
         async with self.get_conn() as conn:
             cursor = await conn.execute_sql('SHOW TABLES')
@@ -866,9 +866,13 @@ class Field(Node):
             self.verbose_name = re.sub('_+', ' ', name).title()
 
         model_class._meta.add_field(self)
-        setattr(model_class, name, FieldDescriptor(self))
+        setattr(model_class, name, self._get_descriptor())
         self._is_bound = True
 
+    def _get_descriptor(self):
+        descriptor_class = getattr(self.model_class, 'field_descriptor_class', FieldDescriptor)
+        return descriptor_class(self)
+
     def get_database(self):
         return self.model_class._meta.database
 
@@ -1360,7 +1364,8 @@ class ForeignKeyField(IntegerField):
             **kwargs)
 
     def _get_descriptor(self):
-        return RelationDescriptor(self, self.rel_model)
+        descriptor_class = getattr(self.model_class, 'relation_descriptor_class', RelationDescriptor)
+        return descriptor_class(self, self.rel_model)
 
     def _get_id_descriptor(self):
         return ObjectIdDescriptor(self)
@@ -1888,6 +1893,10 @@ class QueryCompiler(object):
         return clauses
 
     def generate_select(self, query, alias_map=None):
+        clauses, alias_map = self.generate_select_clauses(query, alias_map)
+        return self.build_query(clauses, alias_map)
+
+    def generate_select_clauses(self, query, alias_map=None):
         model = query.model_class
         db = model._meta.database
 
@@ -1939,14 +1948,14 @@ class QueryCompiler(object):
 
         if query._limit is not None or (query._offset and db.limit_max):
             limit = query._limit if query._limit is not None else db.limit_max
-            clauses.append(SQL('LIMIT %d' % limit))
+            clauses.append(SQL('LIMIT %s' % self.interpolation, int(limit)))
         if query._offset is not None:
-            clauses.append(SQL('OFFSET %d' % query._offset))
+            clauses.append(SQL('OFFSET %s' % self.interpolation, int(query._offset)))
 
         if query._for_update:
             clauses.append(SQL(query._for_update))
 
-        return self.build_query(clauses, alias_map)
+        return clauses, alias_map
 
     def generate_update(self, query):
         model = query.model_class
@@ -0,0 +1,176 @@
+import asyncio
+import weakref
+from collections import deque
+
+from .peewee import logger
+
+
+class PoolController:
+    """
+    连接池控制器：
+    统计获取连接的等待时间，回收超过最大存活时间的连接，
+    并根据等待时间和并发使用的连接数在minsize与maxsize之间调整保持的连接数
+    """
+
+    def __init__(self, db, max_lifetime=3600, wait_threshold=0.01, interval=5, sample_size=1024):
+        """
+        :param db: AsyncDatabase
+        :param max_lifetime: 连接的最大存活时间（秒），超过后归还时关闭，None代表不限制
+        :param wait_threshold: 等待时间的p99超过该值（秒）时预先建立更多连接
+        :param interval: 调整连接数的周期（秒）
+        :param sample_size: 用于计算等待时间分位数的样本数
+        """
+        self.db = db
+        self.max_lifetime = max_lifetime
+        self.wait_threshold = wait_threshold
+        self.interval = interval
+
+        self.waits = deque(maxlen=sample_size)
+        self.acquires = 0
+        self.waiters = 0
+        self.recycled = 0
+        self.target = None
+        # 连接 -> 第一次获取到的时间，近似为建立时间
+        self._created = weakref.WeakKeyDictionary()
+        # 本周期内的等待时间和最大并发数
+        self._window_waits = []
+        self._peak = 0
+
+    @property
+    def pool(self):
+        return self.db.pool
+
+    @property
+    def loop(self):
+        return self.db.loop
+
+    async def acquire(self):
+        """
+        :return: (acquirer, 连接)
+        """
+        pool = self.pool
+        self._peak = max(self._peak, pool.size - pool.freesize + self.waiters + 1)
+        start = self.loop.time()
+        self.waiters += 1
+        try:
+            acquirer = pool.acquire()
+            conn = await acquirer.__aenter__()
+        finally:
+            self.waiters -= 1
+
+        now = self.loop.time()
+        self.waits.append(now - start)
+        self._window_waits.append(now - start)
+        self.acquires += 1
+        if conn not in self._created:
+            self._created[conn] = now
+        return acquirer, conn
+
+    async def release(self, acquirer, conn, exc_type=None, exc_val=None, exc_tb=None):
+        created = self._created.get(conn)
+        if (self.max_lifetime is not None and created is not None and
+                self.loop.time() - created > self.max_lifetime):
+            # 连接池会丢弃已关闭的连接
+            conn.close()
+            self.recycled += 1
+        await acquirer.__aexit__(exc_type, exc_val, exc_tb)
+
+    @staticmethod
+    def _percentile(values, p):
+        if not values:
+            return 0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    def stats(self):
+        """
+        :return: 连接池的统计信息
+        """
+        pool = self.pool
+        now = self.loop.time()
+        ages = [now - created for created in self._created.values()]
+        waits = list(self.waits)
+        return {
+            'size': pool.size if pool else 0,
+            'minsize': pool.minsize if pool else 0,
+            'maxsize': pool.maxsize if pool else 0,
+            'target': self.target,
+            'acquired': pool.size - pool.freesize if pool else 0,
+            'idle': pool.freesize if pool else 0,
+            'waiters': self.waiters,
+            'acquires': self.acquires,
+            'recycled': self.recycled,
+            'wait_p50': self._percentile(waits, 0.5),
+            'wait_p99': self._percentile(waits, 0.99),
+            'connection_age_max': max(ages) if ages else 0,
+            'connection_age_avg': sum(ages) / len(ages) if ages else 0,
+        }
+
+    async def adjust(self):
+        """
+        根据上个周期的最大并发数和等待时间计算需要保持的连接数，
+        没有空闲连接且不足时预先建立连接，多余的空闲连接每个周期关闭一个
+        """
+        pool = self.pool
+        waits, self._window_waits = self._window_waits, []
+        peak, self._peak = self._peak, 0
+
+        target = peak
+        if self._percentile(waits, 0.99) > self.wait_threshold:
+            target += 1
+        self.target = target = max(pool.minsize, min(pool.maxsize, target))
+
+        if pool.size < target and not pool.freesize:
+            await self._grow(target - pool.size)
+        elif pool.size > target and pool.freesize:
+            await self._shrink()
+
+    async def _grow(self, n):
+        acquirers = [self.pool.acquire() for _ in range(n)]
+        conns = await asyncio.gather(*[acquirer.__aenter__() for acquirer in acquirers],
+                                     return_exceptions=True)
+        for acquirer, conn in zip(acquirers, conns):
+            if not isinstance(conn, Exception):
+                await acquirer.__aexit__(None, None, None)
+
+    async def _shrink(self):
+        # 有空闲连接时获取不会等待，关闭后归还即可从连接池中移除
+        async with self.pool.acquire() as conn:
+            conn.close()
+
+    async def check_health(self):
+        """
+        只在连接池有空闲容量时ping，避免占用请求需要的连接
+        """
+        pool = self.pool
+        if not pool.freesize and pool.size >= pool.maxsize:
+            return
+
+        try:
+            async with pool.acquire() as conn:
+                await conn.ping()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.db.healthy:
+                logger.warning('Health check of %s failed: %s', self.db.connect_kwargs.get('host'), e)
+            self.db.healthy = False
+        else:
+            self.db.healthy = True
+
+    async def run(self):
+        last_ping = None
+        while 1:
+            now = self.loop.time()
+            if last_ping is None or now - last_ping >= self.db.ping_interval:
+                last_ping = now
+                await self.check_health()
+
+            try:
+                await self.adjust()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Failed to adjust connection pool: %s', e)
+
+            await asyncio.sleep(min(self.interval, self.db.ping_interval))
@@ -1,13 +1,199 @@
+import asyncio
+import base64
+import json
 import operator
+from collections import namedtuple
+from functools import reduce
+
 from .peewee import SQL, Query, RawQuery, SelectQuery, NoopSelectQuery
 from .peewee import CompoundSelect, DeleteQuery, UpdateQuery, InsertQuery
-from .peewee import _WriteQuery
+from .peewee import _WriteQuery, returns_clone
 from .peewee import RESULTS_TUPLES, RESULTS_DICTS, RESULTS_NAIVE
+from .peewee import Model, PrefetchResult, logger
+from .peewee import Field, Expression, Param, Tuple, OP, Entity, Clause
+from .peewee import ForeignKeyField, FieldProxy
+
+from .cache import query_tables
+from .identity import get_identity_map, pk_lookup
+from .result import RESULTS_ROWS
+from .columnar import RESULTS_COLUMNS
+from .utils import alist, gather, is_read_only_sql
+
+# 流式读取时默认每批读取的行数
+STREAM_CHUNK_SIZE = 1000
+# 分批插入时每批的默认最大行数和估算的最大字节数（需小于max_allowed_packet）
+BULK_BATCH_SIZE = 1000
+BULK_MAX_BYTES = 1024 * 1024
+
+# 延迟关联分页时主键子查询的别名
+DEFERRED_JOIN_ALIAS = 'deferred_keys'
+
+# 分批插入每一批的结果，first_id与last_id为该批自增主键的范围，无法确定时为None
+InsertedChunk = namedtuple('InsertedChunk', ('count', 'first_id', 'last_id'))
+
+
+def encode_cursor(values):
+    """
+    将排序字段的值编码为不透明的游标字符串
+    :param values: 排序字段的值（已经过db_value转换）
+    :return:
+    """
+    data = json.dumps(list(values), separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    :param cursor: encode_cursor生成的游标字符串
+    :return: 排序字段的值列表，游标无效时抛出ValueError
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: %r' % cursor)
+
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor: %r' % cursor)
+    return values
+
+
+def seek_expression(ordering, values, before=False):
+    """
+    生成排序位置在values之后（before为True时为之前）的条件；
+    排序方向一致时为行值比较 (a, b) > (x, y)，方向不一致时展开为
+    a > x OR (a = x AND b < y) ...，并总是附加第一个字段的范围条件以便使用索引；
+    排序字段可以为NULL时按MySQL的规则（NULL最小，升序时排在最前）展开为带IS NULL的条件
+    :param ordering: [(字段, 是否降序)]
+    :param values: 与ordering对应的值
+    :param before:
+    :return:
+    """
+    if any(field.null for field, desc in ordering):
+        return _nullable_seek_expression(ordering, values, before)
+
+    def op(desc, strict):
+        if desc == before:
+            return OP.GT if strict else OP.GTE
+        return OP.LT if strict else OP.LTE
+
+    (first, first_desc), first_value = ordering[0], values[0]
+    if len(ordering) == 1:
+        return Expression(first, op(first_desc, True), first_value)
+
+    if len(set(desc for field, desc in ordering)) == 1:
+        params = [Param(value, adapt=field.db_value) for (field, desc), value in zip(ordering, values)]
+        expression = Expression(Tuple(*[field for field, desc in ordering]), op(first_desc, True), Tuple(*params))
+    else:
+        clauses = []
+        for i, ((field, desc), value) in enumerate(zip(ordering, values)):
+            parts = [Expression(f, OP.EQ, v) for (f, d), v in zip(ordering[:i], values[:i])]
+            parts.append(Expression(field, op(desc, True), value))
+            clauses.append(reduce(operator.and_, parts))
+        expression = reduce(operator.or_, clauses)
+
+    return Expression(first, op(first_desc, False), first_value) & expression
+
 
-from .utils import alist
+def _seek_compare(field, value, greater, strict=True):
+    """
+    :return: 按NULL小于任何值的规则，field大于（greater为False时小于）value的条件，
+    strict为False时包含等于；条件对所有行都成立时返回None，对所有行都不成立时返回False
+    """
+    if value is None:
+        if greater:
+            return Expression(field, OP.IS_NOT, None) if strict else None
+        return Expression(field, OP.IS, None) if not strict else False
+
+    if greater:
+        return Expression(field, OP.GT if strict else OP.GTE, value)
+    expression = Expression(field, OP.LT if strict else OP.LTE, value)
+    if field.null:
+        expression = expression | Expression(field, OP.IS, None)
+    return expression
+
+
+def _nullable_seek_expression(ordering, values, before):
+    clauses = []
+    for i, ((field, desc), value) in enumerate(zip(ordering, values)):
+        compare = _seek_compare(field, value, desc == before)
+        if compare is False:
+            continue
+        parts = [Expression(f, OP.IS, None) if v is None else Expression(f, OP.EQ, v)
+                 for (f, d), v in zip(ordering[:i], values[:i])]
+        parts.append(compare)
+        clauses.append(reduce(operator.and_, parts))
+    # 主键不能为NULL，clauses至少包含主键的条件
+    expression = reduce(operator.or_, clauses)
+
+    (first, first_desc), first_value = ordering[0], values[0]
+    first_range = _seek_compare(first, first_value, first_desc == before, strict=False)
+    if first_range is None:
+        return expression
+    return first_range & expression
+
+
+def estimate_row_size(row):
+    """
+    估算一行数据在SQL语句中占用的字节数
+    :param row: 字段（或字段名） -> 值
+    :return:
+    """
+    # 每个值额外按引号、转义和分隔符估算几个字节
+    size = 4
+    for value in row.values():
+        if isinstance(value, str):
+            size += len(value.encode('utf-8')) + 4
+        elif isinstance(value, (bytes, bytearray)):
+            size += 2 * len(value) + 4
+        else:
+            size += 24
+    return size
+
+
+def iter_row_chunks(rows, batch_size=BULK_BATCH_SIZE, max_bytes=BULK_MAX_BYTES, get_row=None):
+    """
+    将数据按行数和估算的字节数分批
+    :param rows: 数据列表
+    :param batch_size: 每批的最大行数
+    :param max_bytes: 每批估算的最大字节数
+    :param get_row: 从数据中取出用于估算大小的字典，默认为数据本身
+    :return: 每批数据的列表
+    """
+    chunk, chunk_size = [], 0
+    for row in rows:
+        row_size = estimate_row_size(get_row(row) if get_row else row)
+        if chunk and (len(chunk) >= batch_size or chunk_size + row_size > max_bytes):
+            yield chunk
+            chunk, chunk_size = [], 0
+        chunk.append(row)
+        chunk_size += row_size
+
+    if chunk:
+        yield chunk
 
 
 class AsyncQuery(Query):
+    _timeout = None
+
+    def _clone_attributes(self, query):
+        query = super(AsyncQuery, self)._clone_attributes(query)
+        query._timeout = self._timeout
+        return query
+
+    @returns_clone
+    def timeout(self, seconds):
+        """
+        语句的超时时间：超时后在另一个连接上终止该语句（MySQL的KILL QUERY）并抛出QueryTimeoutError，
+        原连接在语句返回后照常归还连接池；SELECT同时加上MAX_EXECUTION_TIME提示由服务端限制
+        :param seconds: 秒，0代表不限制，None则使用数据库的默认设置
+        （只对SELECT查询生效，流式读取iterator(stream=True)只使用这里明确设置的值）
+        :return:
+        """
+        self._timeout = seconds
+
+    def get_timeout(self):
+        return self._timeout
 
     async def execute(self):
         raise NotImplementedError
@@ -15,7 +201,7 @@ class AsyncQuery(Query):
     async def _execute(self):
         sql, params = self.sql()
         async with self.database.get_conn() as conn:
-            return await conn.execute_sql(sql, params, self.require_commit)
+            return await conn.execute_sql(sql, params, self.require_commit, timeout=self.get_timeout())
 
     async def scalar(self, as_tuple=False, convert=False):
         if convert:
@@ -29,7 +215,11 @@ class AsyncQuery(Query):
             return row
 
     def __await__(self):
-        return alist(self).__await__()
+        return self._fetch_all().__await__()
+
+    async def _fetch_all(self):
+        qr = await self.execute()
+        return await qr
 
     def __iter__(self):
         raise NotImplementedError()
@@ -45,8 +235,20 @@ class AsyncRawQuery(AsyncQuery, RawQuery):
         query = AsyncRawQuery(self.model_class, self._sql, *self._params)
         query._tuples = self._tuples
         query._dicts = self._dicts
+        query._timeout = self._timeout
         return query
 
+    async def _execute(self):
+        sql, params = self.sql()
+        if is_read_only_sql(sql):
+            async with await self.database.get_read_conn() as conn:
+                return await conn.execute_sql(sql, params, self.require_commit, timeout=self.get_timeout())
+
+        cursor = await super(AsyncRawQuery, self)._execute()
+        # 无法判断是否只读的语句按写操作处理，之后的读查询暂时使用主库
+        self.database.mark_write()
+        return cursor
+
     async def execute(self):
         if self._qr is None:
             if self._tuples:
@@ -55,12 +257,297 @@ class AsyncRawQuery(AsyncQuery, RawQuery):
                 qrw_cls = self.database.get_result_wrapper(RESULTS_DICTS)
             else:
                 qrw_cls = self.database.get_result_wrapper(RESULTS_NAIVE)
-            self._qr = qrw_cls(self.model_class, await self._execute(), None)
+            self._qr = qrw_cls(self.model_class, await self._execute(), None,
+                               fetch_size=self.database.fetch_size)
         return self._qr
 
 
 class AsyncSelectQuery(AsyncQuery, SelectQuery):
 
+    def __init__(self, *args, **kwargs):
+        super(AsyncSelectQuery, self).__init__(*args, **kwargs)
+        self._fetch_size = None
+        self._cache_options = None
+        self._rows = False
+        self._columns = False
+        self._deferred = None
+
+    def _clone_attributes(self, query):
+        query = super(AsyncSelectQuery, self)._clone_attributes(query)
+        query._fetch_size = self._fetch_size
+        query._cache_options = self._cache_options
+        query._rows = self._rows
+        query._columns = self._columns
+        query._deferred = self._deferred
+        return query
+
+    @returns_clone
+    def rows(self, rows=True):
+        """
+        结果为只读的__slots__行对象（按列名访问属性），内存占用远小于模型实例，适用于只读列表
+        :param rows:
+        :return:
+        """
+        self._rows = rows
+        if rows:
+            self._tuples = self._dicts = self._namedtuples = self._columns = False
+
+    @returns_clone
+    def columns(self, columns=True):
+        """
+        按列返回结果，用于大量数据的统计分析：await得到 列名 -> 列数据 的OrderedDict，
+        整数、浮点数、布尔、日期时间字段为对应类型的NumPy数组（没有安装NumPy时为array.array，日期时间为list）；
+        数据按fetch_size（默认10000）分批读取
+        :param columns:
+        :return:
+        """
+        self._columns = columns
+        if columns:
+            self._tuples = self._dicts = self._namedtuples = self._rows = False
+
+    def _model_field_names(self, fields):
+        model_class = self.model_class
+        names = set()
+        for field in fields:
+            if isinstance(field, Field):
+                if field.model_class is not model_class:
+                    raise ValueError('%s.%s is not a field of %s.' % (
+                        field.model_class.__name__, field.name, model_class.__name__))
+                field = field.name
+            if field not in model_class._meta.fields:
+                raise ValueError('%s has no field named %s.' % (model_class.__name__, field))
+            names.add(field)
+        return names
+
+    def _narrow_selection(self, keep):
+        model_class = self.model_class
+        if model_class._meta.composite_key:
+            raise ValueError('only() and defer() require a single primary key.')
+        selection = []
+        deferred = set(self._deferred or ())
+        for node in self._select:
+            if (isinstance(node, Field) and not isinstance(node, FieldProxy) and
+                    node.model_class is model_class and not node._alias and
+                    not node.primary_key and not isinstance(node, ForeignKeyField) and
+                    not keep(node.name)):
+                deferred.add(node.name)
+            else:
+                selection.append(node)
+        self._select = selection
+        self._explicit_selection = True
+        self._deferred = frozenset(deferred)
+
+    @returns_clone
+    def only(self, *fields):
+        """
+        只查询主模型的指定字段（主键和外键总是查询），只能缩小查询的列；
+        其他字段延迟加载：访问时返回协程，为结果集中所有实例批量查询一次
+        :param fields: 字段或字段名
+        :return:
+        """
+        names = self._model_field_names(fields)
+        self._narrow_selection(lambda name: name in names)
+
+    @returns_clone
+    def defer(self, *fields):
+        """
+        不查询主模型的指定字段（如大文本），访问时为结果集中所有实例批量查询一次；
+        主键和外键不能延迟
+        :param fields: 字段或字段名
+        :return:
+        """
+        names = self._model_field_names(fields)
+        self._narrow_selection(lambda name: name not in names)
+
+    def _get_result_wrapper(self):
+        if not (self._tuples or self._dicts or self._namedtuples):
+            if self._rows:
+                return self.database.get_result_wrapper(RESULTS_ROWS)
+            elif self._columns:
+                return self.database.get_result_wrapper(RESULTS_COLUMNS)
+        return super(AsyncSelectQuery, self)._get_result_wrapper()
+
+    @returns_clone
+    def fetch_size(self, size):
+        """
+        每批从游标读取的行数，None则使用数据库的默认设置
+        :param size:
+        :return:
+        """
+        self._fetch_size = size
+
+    def get_fetch_size(self):
+        if self._fetch_size is not None:
+            return self._fetch_size
+        return self.database.fetch_size
+
+    def get_timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return self.database.statement_timeout
+
+    @returns_clone
+    def cache(self, timeout=None, alias='default'):
+        """
+        缓存查询结果（原始行数据），命中时不再查询数据库；
+        查询涉及的表有写操作（insert/update/delete、save、delete_instance）后缓存自动失效，
+        原生SQL（raw()、execute_sql）的写操作不会，需调用database.invalidate_tables；
+        数据库需设置query_cache（配置OPTIONS中的QUERY_CACHE）
+        :param timeout: 缓存时间（秒），None则使用缓存的默认设置
+        :param alias: 保存结果的缓存
+        :return:
+        """
+        if self.database.query_cache is None:
+            raise ValueError('Query cache is disabled for database %s, set query_cache to enable it.'
+                             % self.database.database)
+        self._cache_options = (timeout, alias)
+
+    def get_seek_ordering(self):
+        """
+        键集分页使用的排序
+        :return: [(字段, 是否降序)]，排序中不包含主键时在最后追加主键，以保证顺序唯一
+        """
+        ordering = []
+        for node in self._order_by or ():
+            if not isinstance(node, Field):
+                raise ValueError('seek() only supports ordering by fields, got %r.' % node)
+            # 比较条件中使用的字段不能带排序方向
+            field = node.clone()
+            field._ordering = None
+            ordering.append((field, (node._ordering or '').upper() == 'DESC'))
+
+        ordered = set((field.model_class, field.name) for field, desc in ordering)
+        for pk_field in self.model_class._meta.get_primary_key_fields():
+            if (pk_field.model_class, pk_field.name) not in ordered:
+                ordering.append((pk_field, ordering[-1][1] if ordering else False))
+        return ordering
+
+    @staticmethod
+    def _seek_value(row, field):
+        if isinstance(row, dict):
+            return row[field._alias or field.name]
+        if isinstance(row, field.model_class):
+            return row._data.get(field.name)
+        # join查询的模型实例，关联的对象保存在_obj_cache中
+        for obj in getattr(row, '_obj_cache', {}).values():
+            if isinstance(obj, field.model_class):
+                return obj._data.get(field.name)
+        return getattr(row, field._alias or field.name)
+
+    def seek_values(self, row):
+        """
+        :param row: 查询结果中的一行（模型实例或字典）
+        :return: 该行排序字段的值
+        """
+        return [field.db_value(self._seek_value(row, field)) for field, desc in self.get_seek_ordering()]
+
+    def cursor_for(self, row):
+        """
+        :param row: 查询结果中的一行
+        :return: 指向该行位置的游标字符串，可作为seek()的参数
+        """
+        return encode_cursor(self.seek_values(row))
+
+    @returns_clone
+    def seek(self, after=None, before=None):
+        """
+        键集分页：只返回排序位置在after之后、before之前的行，
+        深分页时也只需按索引范围扫描；须在order_by之后调用，
+        排序中不包含主键时会追加主键
+        :param after: 游标字符串、查询结果中的一行或排序字段值的序列
+        :param before: 同after
+        :return:
+        """
+        ordering = self.get_seek_ordering()
+        order_by = list(self._order_by or ())
+        for field, desc in ordering[len(order_by):]:
+            order_by.append(field.desc() if desc else field.asc())
+        self._order_by = order_by
+
+        for position, is_before in ((after, False), (before, True)):
+            if position is None:
+                continue
+            if isinstance(position, str):
+                values = decode_cursor(position)
+            elif isinstance(position, (list, tuple)):
+                values = list(position)
+            else:
+                values = self.seek_values(position)
+            if len(values) != len(ordering):
+                raise ValueError('Cursor does not match the ordering of the query.')
+            self._where = self._add_query_clauses(self._where, [seek_expression(ordering, values, is_before)])
+
+    def can_defer_join(self):
+        """
+        是否可以使用延迟关联：单一主键，没有去重、分组，且只通过外键关联了"一"的一方（不会使行数变多）
+        """
+        if (self._distinct or self._group_by or self._having or self._windows or
+                isinstance(self, CompoundSelect)):
+            return False
+        if len(self.model_class._meta.get_primary_key_fields()) != 1:
+            return False
+        for join_list in self._joins.values():
+            for join in join_list:
+                if isinstance(join.dest, SelectQuery):
+                    return False
+                metadata = join.metadata
+                if metadata.foreign_key is None or metadata.is_backref or metadata.is_expression:
+                    return False
+        return True
+
+    def deferred_join(self, limit, offset):
+        """
+        延迟关联（late row lookup）：子查询按条件和排序只取主键做LIMIT/OFFSET（可以只扫描覆盖索引），
+        再按主键取回整行，偏移量很大时不必读取随后被丢弃的整行数据；
+        不满足can_defer_join时与limit(limit).offset(offset)相同
+        :param limit:
+        :param offset:
+        :return: 新的查询
+        """
+        if not self.can_defer_join():
+            return self.limit(limit).offset(offset)
+
+        pk = self.model_class._meta.primary_key
+        keys = self.select(pk).limit(limit).offset(offset)
+        # MySQL不支持在IN子查询中使用LIMIT，外面再包一层派生表
+        derived = self.model_class.select(Entity(DEFERRED_JOIN_ALIAS, pk.db_column)).from_(
+            Clause(keys, SQL('AS'), Entity(DEFERRED_JOIN_ALIAS)))
+        query = self.clone()
+        # 过滤条件已在子查询中处理
+        query._where = pk << derived
+        query._limit = query._offset = None
+        return query
+
+    async def _execute(self):
+        if self._cache_options is not None:
+            conn = self.database.pinned_conn()
+            # 事务中可以读到未提交的数据，不读写缓存
+            if conn is None or not conn.transaction_depth():
+                return await self._execute_cached()
+
+        sql, params = self.sql()
+        async with await self.database.get_read_conn() as conn:
+            return await conn.execute_sql(sql, params, self.require_commit, timeout=self.get_timeout())
+
+    async def _execute_cached(self):
+        timeout, alias = self._cache_options
+        query_cache = self.database.query_cache
+        sql, params = self.sql()
+        try:
+            key = await query_cache.make_key(sql, params, query_tables(self))
+            cursor = await query_cache.get(key, alias)
+        except Exception as e:
+            logger.warning('Failed to read cached query result: %s', e)
+            key = cursor = None
+        if cursor is not None:
+            return cursor
+
+        async with await self.database.get_read_conn() as conn:
+            cursor = await conn.execute_sql(sql, params, self.require_commit, timeout=self.get_timeout())
+            if key is None:
+                return cursor
+            return await query_cache.set(key, cursor, alias, timeout)
+
     def compound_op(operator):
         def inner(self, other):
             supported_ops = self.model_class._meta.database.compound_operations
@@ -86,15 +573,59 @@ class AsyncSelectQuery(AsyncQuery, SelectQuery):
 
         sql, params = clone.sql()
         wrapped = 'SELECT COUNT(1) FROM (%s) AS wrapped_select' % sql
-        rq = self.model_class.raw(wrapped, *params)
+        rq = self.model_class.raw(wrapped, *params).timeout(self.get_timeout())
         return await rq.scalar() or 0
 
+    async def estimate_count(self):
+        """
+        估算记录数，不扫描数据：
+        没有过滤、连接和分组时取information_schema.TABLES中的TABLE_ROWS，否则取EXPLAIN的行数估计；
+        InnoDB的估计值与实际值可能相差较大
+        :return:
+        """
+        unfiltered = not (self._where or any(self._joins.values()) or self._from or
+                          self._distinct or self._group_by or self._having)
+        if unfiltered:
+            sql = ('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                   'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s')
+            params = (self.model_class._meta.db_table,)
+        else:
+            clone = self.order_by()
+            clone._limit = clone._offset = None
+            sql, params = clone.sql()
+            sql = 'EXPLAIN ' + sql
+
+        async with await self.database.get_read_conn() as conn:
+            cursor = await conn.execute_sql(sql, params, require_commit=False, timeout=self.get_timeout())
+            rows = await cursor.fetchall()
+            columns = [column[0].lower() for column in cursor.description]
+
+        if unfiltered:
+            return int(rows[0][0] or 0) if rows else 0
+
+        # 外层查询各表估计行数（按filtered比例过滤后）的乘积
+        estimate = None
+        for row in rows:
+            row = dict(zip(columns, row))
+            if row.get('select_type') not in ('SIMPLE', 'PRIMARY') or row.get('rows') is None:
+                continue
+            estimate = (estimate or 1) * int(row['rows']) * float(row.get('filtered') or 100) / 100
+        return int(round(estimate or 0))
+
     async def exists(self):
         clone = self.paginate(1, 1)
         clone._select = [SQL('1')]
         return bool(await clone.scalar())
 
     async def get(self):
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            pk = pk_lookup(self)
+            if pk is not None:
+                instance = identity_map.get(self.model_class, pk)
+                if instance is not None:
+                    return instance
+
         clone = self.paginate(1, 1)
         try:
             qr = await clone.execute()
@@ -126,16 +657,50 @@ class AsyncSelectQuery(AsyncQuery, SelectQuery):
             query_meta = self.get_query_meta()
             result_wrapper_cls = self._get_result_wrapper()
             cursor = await self._execute()
-            self._qr = result_wrapper_cls(model_class, cursor, query_meta)
+            self._qr = result_wrapper_cls(model_class, cursor, query_meta,
+                                          fetch_size=self.get_fetch_size(),
+                                          deferred_fields=self._deferred)
             self._dirty = False
             return self._qr
         else:
             return self._qr
 
-    async def iterator(self):
-        qr = await self.execute()
-        async for row in qr.iterator():
-            yield row
+    async def iterator(self, stream=False, chunk_size=None):
+        """
+        迭代结果集，迭代过的数据不会缓存
+        :param stream: 是否使用服务端游标流式读取，结果集不会全部加载到客户端内存
+        :param chunk_size: 流式读取时每批读取的行数
+        :return:
+        """
+        if not stream:
+            qr = await self.execute()
+            async for row in qr.iterator():
+                yield row
+            return
+
+        sql, params = self.sql()
+        result_wrapper_cls = self._get_result_wrapper()
+        cursor_class = self.database.get_stream_cursor_class()
+        chunk_size = chunk_size or self.get_fetch_size() or STREAM_CHUNK_SIZE
+        # 迭代期间连接被非缓冲游标独占，不能复用当前Task绑定的连接
+        async with await self.database.get_read_conn(reuse=False) as conn:
+            # 非缓冲游标在结果未读完之前不能在该连接上执行其他语句（包括commit）
+            # 流式导出的耗时取决于读取的速度，不使用数据库默认的超时时间
+            cursor = await conn.execute_sql(sql, params, require_commit=False,
+                                            cursor_class=cursor_class, timeout=self._timeout)
+            qr = result_wrapper_cls(self.model_class, cursor, self.get_query_meta(),
+                                    fetch_size=chunk_size, deferred_fields=self._deferred)
+            try:
+                async for row in qr.iterator():
+                    yield row
+            finally:
+                if not qr._populated:
+                    # 提前终止迭代时，直接关闭连接比读完剩余结果集代价更小，
+                    # 连接池会丢弃已关闭的连接
+                    conn.conn.close()
+
+    async def prefetch(self, *subqueries):
+        return await prefetch(self, *subqueries)
 
     def __getitem__(self, value):
         raise NotImplementedError()
@@ -157,9 +722,29 @@ class AsyncCompoundSelect(AsyncSelectQuery, CompoundSelect):
     async def count(self, clear_limit=False):
         return await self.wrapped_count(clear_limit=clear_limit)
 
+    async def estimate_count(self):
+        # 复合查询的行数无法从EXPLAIN可靠地估算，返回精确值
+        return await self.wrapped_count(clear_limit=True)
+
 
 class _AsyncWriteQuery(AsyncQuery, _WriteQuery):
 
+    async def _execute(self):
+        cursor = await super(_AsyncWriteQuery, self)._execute()
+        # 之后的读查询暂时使用主库
+        self.database.mark_write()
+        await self.database.invalidate_tables([self.model_class._meta.db_table])
+        identity_map = get_identity_map()
+        if identity_map is not None and self.overwrites_rows():
+            identity_map.discard_model(self.model_class)
+        return cursor
+
+    def overwrites_rows(self):
+        """
+        :return: 是否可能修改已有的行，是则移除identity map中该模型的实例
+        """
+        return True
+
     async def _execute_with_result_wrapper(self):
         result_wrapper_cls = self.get_result_wrapper()
         meta = (self._returning, {self.model_class: []})
@@ -190,6 +775,37 @@ class AsyncUpdateQuery(_AsyncWriteQuery, UpdateQuery):
 
 class AsyncInsertQuery(_AsyncWriteQuery, InsertQuery):
 
+    def __init__(self, *args, **kwargs):
+        super(AsyncInsertQuery, self).__init__(*args, **kwargs)
+        self._on_duplicate_update = None
+
+    def _clone_attributes(self, query):
+        query = super(AsyncInsertQuery, self)._clone_attributes(query)
+        query._on_duplicate_update = self._on_duplicate_update
+        return query
+
+    @returns_clone
+    def on_duplicate_key_update(self, *fields):
+        """
+        主键或唯一索引冲突时，用插入的值更新这些字段（INSERT ... ON DUPLICATE KEY UPDATE）
+        :param fields:
+        :return:
+        """
+        self._on_duplicate_update = fields or None
+
+    def overwrites_rows(self):
+        # 普通插入只产生新行，冲突时更新或替换的插入会覆盖已有的行
+        return bool(self._on_duplicate_update or self._upsert or self._on_conflict)
+
+    def sql(self):
+        sql, params = super(AsyncInsertQuery, self).sql()
+        if self._on_duplicate_update:
+            compiler = self.compiler()
+            columns = [compiler.quote(field.db_column) for field in self._on_duplicate_update]
+            sql = '%s ON DUPLICATE KEY UPDATE %s' % (
+                sql, ', '.join('%s = VALUES(%s)' % (column, column) for column in columns))
+        return sql, params
+
     async def _insert_with_loop(self):
         id_list = []
         last_id = None
@@ -204,6 +820,65 @@ class AsyncInsertQuery(_AsyncWriteQuery, InsertQuery):
         else:
             return last_id
 
+    def iter_chunks(self, batch_size=BULK_BATCH_SIZE, max_bytes=BULK_MAX_BYTES):
+        """
+        将insert_many的数据拆分为多个插入查询，
+        每个查询的行数不超过batch_size，估算的语句大小不超过max_bytes
+        """
+        for rows in iter_row_chunks(self._rows, batch_size, max_bytes):
+            yield self._chunk_query(rows)
+
+    def _chunk_query(self, rows):
+        query = self.clone()
+        query._rows = rows
+        return query
+
+    async def _execute_chunk(self, query):
+        count = len(query._rows)
+        if not self.database.insert_many:
+            return InsertedChunk(count, None, await query._insert_with_loop())
+
+        cursor = await query._execute()
+        meta = self.model_class._meta
+        pk = meta.primary_key
+        if not meta.auto_increment or any(pk.name in row or pk in row for row in query._rows):
+            return InsertedChunk(count, None, None)
+
+        # MySQL多行插入返回的是第一行的自增id，同一条语句中的自增id是连续的
+        # （假设auto_increment_increment为1）
+        first_id = self.database.last_insert_id(cursor, self.model_class)
+        return InsertedChunk(count, first_id, first_id + count - 1 if first_id else None)
+
+    async def execute_chunked(self, batch_size=BULK_BATCH_SIZE, max_bytes=BULK_MAX_BYTES,
+                              atomic=True, concurrency=1):
+        """
+        分批执行insert_many
+        :param batch_size: 每批的最大行数
+        :param max_bytes: 每批估算的最大字节数
+        :param atomic: 是否在一个事务中执行所有批次
+        :param concurrency: 不使用事务时，同时使用多少个连接执行；
+                            当前Task已绑定连接（如处于事务中）时总是在该连接上依次执行
+        :return: 按批次顺序排列的InsertedChunk列表
+        """
+        if self._query is not None or self._returning is not None:
+            raise ValueError('execute_chunked() only supports insert_many() without returning().')
+
+        chunks = list(self.iter_chunks(batch_size, max_bytes))
+        if not atomic and concurrency > 1 and self.database.pinned_conn() is None:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def execute_chunk(query):
+                async with semaphore:
+                    return await self._execute_chunk(query)
+
+            return list(await gather(*[execute_chunk(query) for query in chunks]))
+
+        if not atomic:
+            return [await self._execute_chunk(query) for query in chunks]
+
+        async with self.database.atomic():
+            return [await self._execute_chunk(query) for query in chunks]
+
     async def execute(self):
         insert_with_loop = (
             self._is_multi_row_insert and
@@ -251,6 +926,9 @@ class AsyncEmptyQuery(AsyncSelectQuery):
     def __init__(self, *iterable):
         self._it = iter(iterable)
 
+    def __await__(self):
+        return alist(self).__await__()
+
     async def __aiter__(self):
         return self
 
@@ -259,3 +937,115 @@ class AsyncEmptyQuery(AsyncSelectQuery):
             return next(self._it)
         except StopIteration as e:
             raise StopAsyncIteration() from e
+
+
+def prefetch_add_subquery(sq, subqueries):
+    """
+    生成预取计划，与peewee的同名函数不同的是，子查询此时并不添加过滤条件，
+    而是记录其依赖的上级查询的位置，等上级查询执行完后再以IN (...)的方式过滤
+    :return: [(PrefetchResult, 上级查询的位置), ...]
+    """
+    fixed_queries = [(PrefetchResult(sq), None)]
+    for i, subquery in enumerate(subqueries):
+        if isinstance(subquery, tuple):
+            subquery, target_model = subquery
+        else:
+            target_model = None
+        if not isinstance(subquery, Query) and issubclass(subquery, Model):
+            subquery = subquery.select()
+        subquery_model = subquery.model_class
+        fks = backrefs = None
+        for j in reversed(range(i + 1)):
+            last_model = fixed_queries[j][0].model
+            rels = subquery_model._meta.rel_for_model(last_model, multi=True)
+            if rels:
+                fks = [getattr(subquery_model, fk.name) for fk in rels]
+            else:
+                backrefs = last_model._meta.rel_for_model(subquery_model, multi=True)
+
+            if (fks or backrefs) and ((target_model is last_model) or (target_model is None)):
+                break
+
+        if not (fks or backrefs):
+            tgt_err = ' using %s' % target_model if target_model else ''
+            raise AttributeError('Error: unable to find foreign key for '
+                                 'query: %s%s' % (subquery, tgt_err))
+
+        if fks:
+            fixed_queries.append((PrefetchResult(subquery, fks, False), j))
+        else:
+            fixed_queries.append((PrefetchResult(subquery, backrefs, True), j))
+
+    return fixed_queries
+
+
+def _prefetch_expression(prefetch_result, parents):
+    expressions = []
+    for field in prefetch_result.fields:
+        if prefetch_result.backref:
+            # 外键在上级模型中，按外键值查找子查询模型的记录
+            column, target = field.name, field.to_field
+        else:
+            column, target = field.to_field.name, field
+        values = set(instance._data.get(column) for instance in parents)
+        values.discard(None)
+        if values:
+            expressions.append(target << list(values))
+
+    if expressions:
+        return reduce(operator.or_, expressions)
+
+
+async def prefetch(sq, *subqueries):
+    """
+    异步预取关联数据，避免N+1查询；
+    每个子查询只执行一次，以上级查询结果的关联键做IN (...)过滤，
+    依赖同一个上级查询的子查询会在各自的连接上并发执行
+    :param sq: 主查询
+    :param subqueries: 子查询或模型类，也可以是(子查询, 目标模型)的元组
+    :return: 主查询，其结果已缓存并且关联数据已填充
+    """
+    if not subqueries:
+        return sq
+
+    fixed_queries = prefetch_add_subquery(sq, subqueries)
+    results = [None] * len(fixed_queries)
+    results[0] = await sq
+
+    async def execute_subquery(idx):
+        prefetch_result, parent_idx = fixed_queries[idx]
+        expression = _prefetch_expression(prefetch_result, results[parent_idx])
+        if expression is None:
+            results[idx] = []
+        else:
+            results[idx] = await prefetch_result.query.where(expression)
+
+    pending = list(range(1, len(fixed_queries)))
+    while pending:
+        ready = [idx for idx in pending if results[fixed_queries[idx][1]] is not None]
+        await gather(*[execute_subquery(idx) for idx in ready])
+        pending = [idx for idx in pending if results[idx] is None]
+
+    deps = {}
+    rel_map = {}
+    for idx in reversed(range(len(fixed_queries))):
+        prefetch_result = fixed_queries[idx][0]
+        query_model = prefetch_result.model
+        if prefetch_result.fields:
+            for rel_model in prefetch_result.rel_models:
+                rel_map.setdefault(rel_model, [])
+                rel_map[rel_model].append(prefetch_result)
+
+        deps[query_model] = {}
+        id_map = deps[query_model]
+        has_relations = bool(rel_map.get(query_model))
+
+        for instance in results[idx]:
+            if prefetch_result.fields:
+                prefetch_result.store_instance(instance, id_map)
+
+            if has_relations:
+                for rel in rel_map[query_model]:
+                    rel.populate_instance(instance, deps[rel.model])
+
+    return sq
@@ -0,0 +1,78 @@
+ROUND_ROBIN = 'round_robin'
+LEAST_INFLIGHT = 'least_inflight'
+
+
+class ReplicaSet:
+    """
+    只读副本集合，负责为读查询选择副本；
+    健康检查失败（或无法建立连接）的副本会被暂时剔除，检查恢复后重新加入
+    """
+
+    policies = (ROUND_ROBIN, LEAST_INFLIGHT)
+
+    def __init__(self, databases, weights=None, policy=ROUND_ROBIN, read_after_write=1.0):
+        """
+        :param databases: 副本数据库列表
+        :param weights: 各副本的权重，默认都为1
+        :param policy: round_robin（加权轮询）或 least_inflight（正在使用的连接数最少）
+        :param read_after_write: 写操作之后，同一Task中的读查询在多少秒内仍使用主库
+        """
+        if policy not in self.policies:
+            raise ValueError('Unknown replica policy: %r, must be one of %s' % (policy, self.policies))
+
+        self.databases = list(databases)
+        self.weights = list(weights) if weights else [1] * len(self.databases)
+        if len(self.weights) != len(self.databases):
+            raise ValueError('Replica weights do not match replicas')
+
+        self.policy = policy
+        self.read_after_write = read_after_write
+        # 平滑加权轮询中各副本的当前权重
+        self._current = [0] * len(self.databases)
+        # 无法建立连接的副本 -> 允许再次尝试的时间
+        self._retry_at = {}
+
+    def __len__(self):
+        return len(self.databases)
+
+    def __iter__(self):
+        return iter(self.databases)
+
+    def is_available(self, index):
+        db = self.databases[index]
+        if self.weights[index] <= 0:
+            return False
+        if db.healthy:
+            return True
+        # 连接池都没有建立起来的副本不会有健康检查，到时间后重新尝试连接
+        return db.closed and db.loop.time() >= self._retry_at.get(index, 0)
+
+    def choose(self):
+        """
+        :return: 选中的副本，没有可用副本时返回None
+        """
+        candidates = [i for i in range(len(self.databases)) if self.is_available(i)]
+        if not candidates:
+            return None
+
+        if self.policy == LEAST_INFLIGHT:
+            index = min(candidates, key=lambda i: self.databases[i].inflight / self.weights[i])
+        else:
+            total = 0
+            index = candidates[0]
+            for i in candidates:
+                self._current[i] += self.weights[i]
+                total += self.weights[i]
+                if self._current[i] > self._current[index]:
+                    index = i
+            self._current[index] -= total
+
+        return self.databases[index]
+
+    def eject(self, db):
+        """
+        暂时剔除无法建立连接的副本，一个健康检查周期后再尝试
+        """
+        index = self.databases.index(db)
+        db.healthy = False
+        self._retry_at[index] = db.loop.time() + db.ping_interval
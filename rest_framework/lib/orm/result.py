@@ -1,11 +1,17 @@
-from collections import OrderedDict
+import operator
+from collections import OrderedDict, deque
+from keyword import iskeyword
 
 from .peewee import QueryResultWrapper, ExtQueryResultWrapper
 from .peewee import TuplesQueryResultWrapper, DictQueryResultWrapper
 from .peewee import ModelQueryResultWrapper, AggregateQueryResultWrapper
-from .peewee import NaiveQueryResultWrapper
+from .peewee import NaiveQueryResultWrapper, NamedTupleQueryResultWrapper
+from .peewee import Field, ModelAlias
 
-from .utils import AsyncIterWrapper, alist
+from .hydrator import get_hydrator, get_constructor, is_plain_getter
+from .identity import get_identity_map
+from .deferred import DeferredFields
+from .utils import AsyncIterWrapper
 
 
 class AsyncResultIterator(object):
@@ -28,6 +34,18 @@ class AsyncResultIterator(object):
 
 
 class AsyncQueryResultWrapper(QueryResultWrapper):
+    """
+    异步结果集处理，行数据按批次从游标中读取到本地缓冲区，
+    再在同步循环中转换，避免每一行都进行一次协程调度；
+    fetch_size为None时一次性fetchall，否则每批fetchmany(fetch_size)
+    """
+
+    def __init__(self, model, cursor, meta=None, fetch_size=None, deferred_fields=None):
+        super(AsyncQueryResultWrapper, self).__init__(model, cursor, meta)
+        self.fetch_size = fetch_size
+        # only()/defer()没有查询的主模型字段名
+        self.deferred_fields = deferred_fields
+        self._buffer = deque()
 
     async def __aiter__(self):
         if self._populated:
@@ -36,8 +54,11 @@ class AsyncQueryResultWrapper(QueryResultWrapper):
             return AsyncResultIterator(self)
 
     def __await__(self):
-        # TODO: fill_cache with cursor.fetchall
-        return alist(self).__await__()
+        return self._fetch_all().__await__()
+
+    async def _fetch_all(self):
+        await self.fill_cache()
+        return list(self._result_cache)
 
     async def count(self):
         await self.fill_cache()
@@ -46,12 +67,36 @@ class AsyncQueryResultWrapper(QueryResultWrapper):
     def __len__(self):
         raise NotImplementedError()
 
+    async def _fetch_rows(self):
+        """
+        从游标读取一批数据到缓冲区
+        :return: 是否读取到数据
+        """
+        if self.fetch_size:
+            rows = await self.cursor.fetchmany(self.fetch_size)
+        else:
+            rows = await self.cursor.fetchall()
+
+        if not rows:
+            return False
+
+        self._buffer.extend(rows)
+        return True
+
+    async def _close_cursor(self):
+        self._populated = True
+        if not getattr(self.cursor, 'name', None):
+            await self.cursor.close()
+
+    async def _next_row(self):
+        if not self._buffer and not await self._fetch_rows():
+            return None
+        return self._buffer.popleft()
+
     async def iterate(self):
-        row = await self.cursor.fetchone()
+        row = await self._next_row()
         if not row:
-            self._populated = True
-            if not getattr(self.cursor, 'name', None):
-                await self.cursor.close()
+            await self._close_cursor()
             raise StopAsyncIteration
         elif not self._initialized:
             self.initialize(self.cursor.description)
@@ -79,19 +124,33 @@ class AsyncQueryResultWrapper(QueryResultWrapper):
         self._idx += 1
         return obj
 
+    def _consume_buffer(self, n):
+        """
+        同步地转换缓冲区中最多n行数据并放入结果缓存
+        """
+        buffer = self._buffer
+        process_row = self.process_row
+        append = self._result_cache.append
+        size = min(n, len(buffer))
+        for _ in range(size):
+            append(process_row(buffer.popleft()))
+        self._ct += size
+
     async def fill_cache(self, n=None):
-        # TODO: cursor.fetchall
-        # if n is None cursor.fetchall else cursor.fetchmany(n)
         n = n or float('Inf')
         if n < 0:
             raise ValueError('Negative values are not supported.')
-        self._idx = self._ct
         while not self._populated and (n > self._ct):
-            try:
-                await self.__anext__()
-            except StopAsyncIteration:
+            if not self._buffer and not await self._fetch_rows():
+                await self._close_cursor()
                 break
 
+            if not self._initialized:
+                self.initialize(self.cursor.description)
+                self._initialized = True
+            self._consume_buffer(n - self._ct)
+        self._idx = self._ct
+
 
 class AsyncExtQueryResultWrapper(AsyncQueryResultWrapper, ExtQueryResultWrapper):
     pass
@@ -101,119 +160,401 @@ class AsyncTuplesQueryResultWrapper(AsyncExtQueryResultWrapper, TuplesQueryResul
     pass
 
 
-class AsyncNaiveQueryResultWrapper(AsyncExtQueryResultWrapper, NaiveQueryResultWrapper):
+class AsyncNamedTupleQueryResultWrapper(AsyncExtQueryResultWrapper, NamedTupleQueryResultWrapper):
     pass
 
 
+# 结果类型：__slots__行对象
+RESULTS_ROWS = 7
+
+# 缓存的行对象类数量上限
+ROW_CLASS_CACHE_SIZE = 256
+
+# 列名 -> 行对象类
+_row_classes = OrderedDict()
+
+
+class Row(object):
+    """
+    只读列表使用的轻量行对象，每种列名组合生成一个__slots__子类，
+    没有模型实例的_data、_dirty、_obj_cache；
+    外键列为外键值，不能访问关联对象
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def serializable_value(self, field_name):
+        return getattr(self, field_name)
+
+    def _asdict(self):
+        return OrderedDict((name, getattr(self, name)) for name in self._fields)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self._fields)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join('%s=%r' % (name, getattr(self, name)) for name in self._fields)
+
+
+def _row_fields(columns):
+    # 与namedtuple(rename=True)相同，不合法或重复的列名改为_序号
+    fields = []
+    for i, name in enumerate(columns):
+        if (not name.isidentifier() or iskeyword(name) or name.startswith('_') or name == 'self' or
+                name in fields):
+            name = '_%d' % i
+        fields.append(name)
+    return tuple(fields)
+
+
+def row_class(columns):
+    """
+    :param columns: 列名列表
+    :return: 该列名组合的Row子类，构造参数依次为各列的值
+    """
+    fields = _row_fields(columns)
+    cls = _row_classes.get(fields)
+    if cls is not None:
+        _row_classes.move_to_end(fields)
+        return cls
+
+    source = 'def __init__(self%s):\n    %s\n' % (
+        ''.join(', ' + name for name in fields),
+        '; '.join('self.%s = %s' % (name, name) for name in fields) or 'pass')
+    namespace = {}
+    exec(source, namespace)
+    cls = _row_classes[fields] = type('Row', (Row,), {
+        '__slots__': fields,
+        '_fields': fields,
+        '__init__': namespace['__init__'],
+    })
+    if len(_row_classes) > ROW_CLASS_CACHE_SIZE:
+        _row_classes.popitem(last=False)
+    return cls
+
+
+class AsyncRowQueryResultWrapper(AsyncExtQueryResultWrapper):
+
+    def initialize(self, description):
+        super(AsyncRowQueryResultWrapper, self).initialize(description)
+        self.constructor = row_class([column for _, column, _ in self.conv])
+
+    def process_row(self, row):
+        return self.constructor(*[f(row[i]) if f is not None else row[i]
+                                  for i, _, f in self.conv])
+
+
+def _selects_all_fields(column_meta, model):
+    selected = set((node.model_class, node.name) for node in column_meta or () if isinstance(node, Field))
+    return all((model, field.name) in selected for field in model._meta.sorted_fields)
+
+
+def _deferred_fields(model, field_names):
+    if field_names:
+        return DeferredFields(model, field_names)
+    return None
+
+
+class AsyncNaiveQueryResultWrapper(AsyncExtQueryResultWrapper, NaiveQueryResultWrapper):
+
+    def initialize(self, description):
+        super(AsyncNaiveQueryResultWrapper, self).initialize(description)
+        self.identity_map = get_identity_map()
+        if self.identity_map is not None:
+            self._complete = _selects_all_fields(self.column_meta, self.model)
+        self.deferred = _deferred_fields(self.model, self.deferred_fields)
+
+    def process_row(self, row):
+        instance = super(AsyncNaiveQueryResultWrapper, self).process_row(row)
+        if self.deferred is not None:
+            # 先移除延迟字段的默认值，合并到身份映射时才不会覆盖已加载的值
+            self.deferred.add(instance)
+        if self.identity_map is not None:
+            return self.identity_map.add(instance, self._complete)
+        return instance
+
+
 class AsyncDictQueryResultWrapper(AsyncExtQueryResultWrapper, DictQueryResultWrapper):
     pass
 
 
 class AsyncModelQueryResultWrapper(AsyncQueryResultWrapper,  ModelQueryResultWrapper):
-    pass
+    # 是否使用按查询结构生成的行转换函数
+    use_hydrator = True
+
+    def initialize(self, description):
+        super(AsyncModelQueryResultWrapper, self).initialize(description)
+        self.identity_map = get_identity_map()
+        self.hydrator = None
+        if self.identity_map is not None:
+            self._complete = set(
+                key for key, _, _, _ in self.column_map
+                if not isinstance(key, ModelAlias) and _selects_all_fields(self.column_meta, key))
+        elif self.use_hydrator:
+            self.hydrator = get_hydrator(self, description)
+        self.deferred = _deferred_fields(self.model, self.deferred_fields)
+
+    def process_row(self, row):
+        if self.hydrator is not None:
+            instance = self.hydrator(row)
+            if self.deferred is not None:
+                self.deferred.add(instance)
+            return instance
+        return super(AsyncModelQueryResultWrapper, self).process_row(row)
+
+    def construct_instances(self, row, keys=None):
+        collected = super(AsyncModelQueryResultWrapper, self).construct_instances(row, keys)
+        return self.add_to_identity_map(collected)
+
+    def add_to_identity_map(self, collected):
+        if self.deferred is not None and self.model in collected:
+            self.deferred.add(collected[self.model])
+        if self.identity_map is not None:
+            for key, instance in collected.items():
+                collected[key] = self.identity_map.add(instance, key in self._complete)
+        return collected
+
+
+# 聚合行的关联方式
+JOIN_MANY = 'many'
+JOIN_ONE = 'one'
 
 
 class AsyncAggregateQueryResultWrapper(AsyncModelQueryResultWrapper, AggregateQueryResultWrapper):
+    """
+    aggregate_rows()的结果：连续的行中"一"的一方相同的合并为一个主实例，"多"的一方组装为列表；
+    比较用的列、各模型的列和实例间的关联顺序在initialize中预先计算
+    """
+    use_hydrator = False
+
+    def initialize(self, description):
+        super(AsyncAggregateQueryResultWrapper, self).initialize(description)
+
+        # 模型 -> [(列序号, 属性名, 转换函数)]
+        self.key_columns = OrderedDict()
+        self.constructors = {}
+        for i, (key, constructor, attr, conv) in enumerate(self.column_map):
+            if attr is None:
+                attr = description[i][0]
+            self.key_columns.setdefault(key, []).append((i, attr, conv))
+            self.constructors[key] = constructor
+        self.key_indexes = dict((key, tuple(i for i, _, _ in columns))
+                                for key, columns in self.key_columns.items())
+        # 模型 -> 生成的实例构造函数
+        self.builders = dict((key, get_constructor(self.constructors[key], columns))
+                             for key, columns in self.key_columns.items())
+
+        # 判断行是否属于同一组时比较的列：(模型, 取值函数)
+        self.compare_getters = []
+        for key, columns in self.columns_to_compare.items():
+            indexes = self._compare_indexes(key, [i for i, _ in columns])
+            self.compare_getters.append((key, self._row_getter(indexes)))
+
+        self.pk_getters = dict((key, self._pk_getter(constructor))
+                               for key, constructor in self.constructors.items())
+        self.join_plan = self._generate_join_plan()
+        # 重复的模型 -> 需要构造实例的模型
+        self._different_models = {}
+
+    @staticmethod
+    def _row_getter(indexes):
+        if len(indexes) == 1:
+            index = indexes[0]
+            return lambda row: (row[index],)
+        elif indexes:
+            return operator.itemgetter(*indexes)
+        return lambda row: ()
+
+    @staticmethod
+    def _pk_getter(model_class):
+        if model_class._meta.composite_key:
+            field_names = model_class._meta.primary_key.field_names
+            return lambda instance: tuple([instance._data[field_name] for field_name in field_names])
+        pk_name = model_class._meta.primary_key.name
+        if is_plain_getter(model_class, pk_name):
+            return lambda instance: instance._data.get(pk_name)
+        return lambda instance: instance._get_pk_value()
+
+    def _compare_indexes(self, key, indexes):
+        """
+        比较的列中各模型的主键都已查询时，只比较主键列（以及表达式等非字段列），否则比较全部列
+        :return: 列序号列表
+        """
+        models = OrderedDict()
+        for i in indexes:
+            models.setdefault(self.column_map[i][0], []).append(i)
+
+        compared = []
+        for model_key, model_indexes in models.items():
+            pk_names = set(field.name for field in self.constructors[model_key]._meta.get_primary_key_fields())
+            pk_indexes, other_indexes, found = [], [], set()
+            for i in model_indexes:
+                node = self.column_meta[i]
+                if isinstance(node, Field):
+                    if node.name in pk_names and not node._alias:
+                        pk_indexes.append(i)
+                        found.add(node.name)
+                else:
+                    other_indexes.append(i)
+            if found == pk_names:
+                compared.extend(pk_indexes + other_indexes)
+            else:
+                compared.extend(model_indexes)
+        return compared
+
+    def _generate_join_plan(self):
+        """
+        按AggregateQueryResultWrapper遍历连接的顺序生成关联步骤
+        :return: [(关联方式, 源模型, 目标模型, 属性名, 外键名, 目标模型是否已查询)]
+        """
+        plan = []
+        stack = [self.model]
+        while stack:
+            current = stack.pop()
+            if current not in self.join_meta:
+                continue
 
-    async def iterate(self):
+            for join in self.join_meta[current]:
+                try:
+                    metadata, attr = self.source_to_dest[current][join.dest]
+                except KeyError:
+                    continue
+
+                present = join.dest in self.key_columns
+                fk_name = metadata.foreign_key.name if metadata.foreign_key is not None else None
+                if metadata.is_backref or metadata.is_self_join:
+                    plan.append((JOIN_MANY, current, join.dest, attr, fk_name, present))
+                    if not present:
+                        continue
+                elif attr:
+                    if not present:
+                        continue
+                    plan.append((JOIN_ONE, current, join.dest, attr, fk_name, present))
+                stack.append(join.dest)
+        return plan
+
+    def construct_instances(self, row, keys=None):
+        collected = OrderedDict()
+        for key, columns in self.key_columns.items():
+            if keys is not None and key not in keys:
+                continue
+            builder = self.builders[key]
+            if builder is not None:
+                collected[key] = builder(row)
+                continue
+            instance = self.constructors[key]()
+            for i, attr, conv in columns:
+                value = row[i]
+                setattr(instance, attr, value if conv is None else conv(value))
+            collected[key] = instance
+        return self.add_to_identity_map(collected)
+
+    def _is_empty(self, key, row, instance):
+        """
+        :return: 实例是否全部为NULL值（如左连接没有匹配的行）
+        """
+        for i in self.key_indexes[key]:
+            if row[i] is not None:
+                return False
+        for value in instance._data.values():
+            if value is not None:
+                return False
+        return True
+
+    async def _next_row(self):
         if self._row:
-            row = self._row.pop()
-        else:
-            row = await self.cursor.fetchone()
+            return self._row.pop()
+        return await super(AsyncAggregateQueryResultWrapper, self)._next_row()
+
+    async def fill_cache(self, n=None):
+        # 聚合行需要预读后续行来判断分组，因此逐个实例读取，行数据依然来自批量缓冲区
+        n = n or float('Inf')
+        if n < 0:
+            raise ValueError('Negative values are not supported.')
+        self._idx = self._ct
+        while not self._populated and (n > self._ct):
+            try:
+                await self.__anext__()
+            except StopAsyncIteration:
+                break
 
+    async def iterate(self):
+        row = await self._next_row()
         if not row:
-            self._populated = True
-            if not getattr(self.cursor, 'name', None):
-                await self.cursor.close()
+            await self._close_cursor()
             raise StopAsyncIteration
         elif not self._initialized:
             self.initialize(self.cursor.description)
             self._initialized = True
 
-        def _get_pk(instance):
-            if instance._meta.composite_key:
-                return tuple([instance._data[field_name]
-                              for field_name in instance._meta.primary_key.field_names])
-            return instance._get_pk_value()
-
-        identity_map = {}
+        pk_getters = self.pk_getters
         _constructed = self.construct_instances(row)
         primary_instance = _constructed[self.model]
+        identity_map = {}
         for model_or_alias, instance in _constructed.items():
-            identity_map[model_or_alias] = OrderedDict()
-            identity_map[model_or_alias][_get_pk(instance)] = instance
+            identity_map[model_or_alias] = OrderedDict([(pk_getters[model_or_alias](instance), instance)])
 
-        model_data = self.read_model_data(row)
+        compared = [(key, getter, getter(row)) for key, getter in self.compare_getters]
+        buffer = self._buffer
         while True:
-            cur_row = await self.cursor.fetchone()
-            if cur_row is None:
-                break
-
-            duplicate_models = set()
-            cur_row_data = self.read_model_data(cur_row)
-            for model_class, data in cur_row_data.items():
-                if model_data[model_class] == data:
-                    duplicate_models.add(model_class)
-
+            # 缓冲区中有数据时不必经过协程读取
+            if buffer and not self._row:
+                cur_row = buffer.popleft()
+            else:
+                cur_row = await self._next_row()
+                if cur_row is None:
+                    break
+
+            duplicate_models = tuple(key for key, getter, data in compared if getter(cur_row) == data)
             if not duplicate_models:
                 self._row.append(cur_row)
                 break
 
-            different_models = self.all_models - duplicate_models
-
+            different_models = self._different_models.get(duplicate_models)
+            if different_models is None:
+                different_models = self._different_models[duplicate_models] = \
+                    self.all_models.difference(duplicate_models)
             new_instances = self.construct_instances(cur_row, different_models)
             for model_or_alias, instance in new_instances.items():
                 # Do not include any instances which are comprised solely of
                 # NULL values.
-                all_none = True
-                for value in instance._data.values():
-                    if value is not None:
-                        all_none = False
-                if not all_none:
-                    identity_map[model_or_alias][_get_pk(instance)] = instance
+                if not self._is_empty(model_or_alias, cur_row, instance):
+                    identity_map[model_or_alias][pk_getters[model_or_alias](instance)] = instance
 
-        stack = [self.model]
         instances = [primary_instance]
-        while stack:
-            current = stack.pop()
-            if current not in self.join_meta:
-                continue
-
-            for join in self.join_meta[current]:
-                try:
-                    metadata, attr = self.source_to_dest[current][join.dest]
-                except KeyError:
+        for kind, current, dest, attr, fk_name, present in self.join_plan:
+            if kind == JOIN_MANY:
+                for instance in identity_map[current].values():
+                    setattr(instance, attr, [])
+                if not present:
                     continue
 
-                if metadata.is_backref or metadata.is_self_join:
-                    for instance in identity_map[current].values():
-                        setattr(instance, attr, [])
-
-                    if join.dest not in identity_map:
+                related = identity_map[current]
+                for pk, inst in identity_map[dest].items():
+                    if pk is None:
                         continue
-
-                    for pk, inst in identity_map[join.dest].items():
-                        if pk is None:
-                            continue
-                        try:
-                            # XXX: if no FK exists, unable to join.
-                            joined_inst = identity_map[current][inst._data[metadata.foreign_key.name]]
-                        except KeyError:
-                            continue
-
-                        getattr(joined_inst, attr).append(inst)
-                        instances.append(inst)
-                elif attr:
-                    if join.dest not in identity_map:
-                        continue
-
-                    for pk, instance in identity_map[current].items():
+                    try:
                         # XXX: if no FK exists, unable to join.
-                        joined_inst = identity_map[join.dest][instance._data[metadata.foreign_key.name]]
-                        setattr(instance, metadata.foreign_key.name, joined_inst)
-                        instances.append(joined_inst)
+                        joined_inst = related[inst._data[fk_name]]
+                    except KeyError:
+                        continue
 
-                stack.append(join.dest)
+                    getattr(joined_inst, attr).append(inst)
+                    instances.append(inst)
+            else:
+                related = identity_map[dest]
+                for pk, instance in identity_map[current].items():
+                    # XXX: if no FK exists, unable to join.
+                    joined_inst = related[instance._data[fk_name]]
+                    setattr(instance, fk_name, joined_inst)
+                    instances.append(joined_inst)
 
         for instance in instances:
             instance._prepare_instance()
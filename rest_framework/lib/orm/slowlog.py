@@ -0,0 +1,157 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from .peewee import logger
+from .instrument import QueryHook
+
+# 同一指纹的慢查询默认每隔多少秒记录一次
+SLOW_QUERY_INTERVAL = 60
+
+# 记录了最近记录时间的指纹数量上限
+SLOW_QUERY_FINGERPRINTS = 1024
+
+# 同时执行的EXPLAIN数量上限，超过时记录中不包含执行计划
+MAX_PENDING_EXPLAINS = 2
+
+# EXPLAIN的超时时间（秒）
+EXPLAIN_TIMEOUT = 5
+
+# 记录中SQL的最大长度
+MAX_SQL_LENGTH = 2000
+
+
+def params_shape(params):
+    """
+    参数的类型序列，不包含参数值；连续相同的类型合并，如 ['int*50', 'str']
+    :param params:
+    :return:
+    """
+    shape = []
+    last, count = None, 0
+    for param in params or ():
+        name = type(param).__name__
+        if name == last:
+            count += 1
+            continue
+        if last is not None:
+            shape.append(last if count == 1 else '%s*%d' % (last, count))
+        last, count = name, 1
+    if last is not None:
+        shape.append(last if count == 1 else '%s*%d' % (last, count))
+    return shape
+
+
+def rows_examined(plan):
+    """
+    :param plan: EXPLAIN FORMAT=JSON的结果
+    :return: 执行计划中各表估计扫描行数之和，没有则返回None
+    """
+    total = None
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == 'rows_examined_per_scan' and isinstance(value, int):
+                    total = (total or 0) + value
+                else:
+                    stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(node)
+    return total
+
+
+class SlowQueryLog(QueryHook):
+    """
+    慢查询日志：执行时间超过阈值的语句生成一条结构化记录（指纹、参数类型、执行时间、来源等），
+    SELECT在另一个连接上异步执行EXPLAIN FORMAT=JSON，记录中附带执行计划和估计扫描行数；
+    同一指纹在interval秒内只记录一次，期间跳过的次数记录在下一条记录的suppressed中
+    """
+
+    def __init__(self, threshold, interval=SLOW_QUERY_INTERVAL, explain=True):
+        """
+        :param threshold: 阈值（毫秒）
+        :param interval: 同一指纹两次记录的最小间隔（秒）
+        :param explain: 是否获取执行计划
+        """
+        self.threshold = threshold / 1000.0
+        self.interval = interval
+        self.explain = explain
+        # 指纹 -> (最近记录的时间, 之后跳过的次数)
+        self._recent = OrderedDict()
+        self._pending = 0
+
+    def after_execute(self, event):
+        if event.duration >= self.threshold:
+            self.record(event)
+
+    def on_error(self, event, exc):
+        # 超时终止的语句同样记录
+        if event.duration >= self.threshold:
+            self.record(event)
+
+    def _allow(self, fingerprint):
+        now = time.monotonic()
+        last = self._recent.get(fingerprint)
+        if last is not None and now - last[0] < self.interval:
+            self._recent[fingerprint] = (last[0], last[1] + 1)
+            return None
+        self._recent[fingerprint] = (now, 0)
+        self._recent.move_to_end(fingerprint)
+        if len(self._recent) > SLOW_QUERY_FINGERPRINTS:
+            self._recent.popitem(last=False)
+        return last[1] if last is not None else 0
+
+    def record(self, event):
+        fingerprint = event.fingerprint
+        suppressed = self._allow(fingerprint)
+        if suppressed is None:
+            return
+
+        record = OrderedDict([
+            ('fingerprint', fingerprint),
+            ('sql', event.sql[:MAX_SQL_LENGTH]),
+            ('params', params_shape(event.params)),
+            ('duration_ms', round(event.duration * 1000, 3)),
+            ('rows', event.rows),
+            ('database', event.database.database),
+            ('connection_id', event.connection_id),
+            ('handler', event.label),
+            ('error', repr(event.error) if event.error is not None else None),
+            ('suppressed', suppressed),
+            ('plan', None),
+            ('rows_examined', None),
+        ])
+        explain_sql = event.database.explain_sql(event.sql) if self.explain else None
+        if explain_sql is None or self._pending >= MAX_PENDING_EXPLAINS:
+            self.emit(record)
+            return
+
+        self._pending += 1
+        event.database.loop.create_task(self._explain(event, explain_sql, record))
+
+    async def _explain(self, event, explain_sql, record):
+        try:
+            database = event.database
+            # 不复用当前Task绑定的连接，EXPLAIN不在调用方的事务中执行
+            async with database.get_conn(reuse=False) as conn:
+                cursor = await conn.execute_sql(explain_sql, event.params, require_commit=False,
+                                                timeout=EXPLAIN_TIMEOUT)
+                row = await cursor.fetchone()
+            plan = json.loads(row[0]) if row else None
+            record['plan'] = plan
+            record['rows_examined'] = rows_examined(plan)
+        except Exception as e:
+            logger.warning('Failed to explain slow query: %s', e)
+        finally:
+            self._pending -= 1
+        self.emit(record)
+
+    def emit(self, record):
+        """
+        输出一条慢查询记录，默认以JSON写入日志，可重写以发送到其他地方
+        :param record: OrderedDict
+        """
+        logger.warning('Slow query: %s', json.dumps(record, default=str))
@@ -1,3 +1,9 @@
+import asyncio
+import weakref
+
+# 以Task为键保存状态的字典，通过spawn创建的子Task继承父Task在其中的值
+_task_locals = []
+
 
 class AsyncIterWrapper:
     """Async wrapper for sync iterables
@@ -27,3 +33,81 @@ async def alist(iterable):
 
 async def anext(iterable):
     return await iterable.__anext__()
+
+
+def current_task(loop=None):
+    """
+    当前正在运行的Task，不在Task中运行时返回None
+    """
+    try:
+        if hasattr(asyncio, 'current_task'):
+            return asyncio.current_task(loop)
+        return asyncio.Task.current_task(loop)
+    except RuntimeError:
+        return None
+
+
+def is_read_only_sql(sql):
+    """
+    :return: 原生SQL是否为只读语句（SELECT、SHOW），可以在只读副本上执行且不影响读写分离
+    """
+    return sql.lstrip(' \t\r\n(')[:6].upper().startswith(('SELECT', 'SHOW'))
+
+
+def task_local():
+    """
+    :return: 以Task为键保存状态（如绑定的连接、查询统计）的WeakKeyDictionary，
+    通过spawn/gather创建的子Task继承父Task在其中的值
+    """
+    mapping = weakref.WeakKeyDictionary()
+    _task_locals.append(mapping)
+    return mapping
+
+
+# Task -> 通过spawn一级级创建该Task的最上层Task（如处理请求的Task），用于区分不同请求的子Task
+_task_roots = task_local()
+
+
+def capture_task_locals(loop=None):
+    """
+    :return: 当前Task在各task_local字典中的值，由run_with_task_locals在其他Task中恢复；
+    来自同一请求且状态相同的Task得到的值相等
+    """
+    task = current_task(loop)
+    if task is None:
+        return ()
+    values = [(mapping, mapping[task]) for mapping in _task_locals if task in mapping and mapping is not _task_roots]
+    values.append((_task_roots, _task_roots.get(task, task)))
+    return tuple(values)
+
+
+async def run_with_task_locals(values, coro):
+    """
+    将capture_task_locals得到的值绑定到当前Task后执行协程
+    """
+    task = current_task()
+    for mapping, value in values:
+        mapping[task] = value
+    return await coro
+
+
+def spawn(coro, loop=None):
+    """
+    与asyncio.ensure_future相同，新的Task继承当前Task的状态，
+    如绑定的连接、请求的查询统计、identity map，使子Task中的查询与当前Task一样处理
+    :param coro: 协程或其他awaitable对象（如查询），Future不做处理
+    :param loop:
+    :return: Task
+    """
+    if not asyncio.isfuture(coro):
+        values = capture_task_locals(loop)
+        if values:
+            coro = run_with_task_locals(values, coro)
+    return asyncio.ensure_future(coro, loop=loop)
+
+
+def gather(*coros, return_exceptions=False):
+    """
+    与asyncio.gather相同，各协程在继承当前Task状态的子Task中执行，见spawn
+    """
+    return asyncio.gather(*[spawn(coro) for coro in coros], return_exceptions=return_exceptions)
@@ -5,6 +5,7 @@ import inspect
 from collections import OrderedDict
 from rest_framework.core.db import models
 from rest_framework.core.exceptions import ImproperlyConfigured, FieldError
+from rest_framework.lib.orm.model import AsyncRelationDescriptor
 from rest_framework.lib.orm.query import AsyncSelectQuery
 from rest_framework.serializers.fields import (
     Field,
@@ -17,6 +18,7 @@ from rest_framework.serializers.fields import (
     TimeField,
     UUIDField,
     PKOnlyObject,
+    RelatedField,
     PrimaryKeyRelatedField,
 )
 from rest_framework.utils.constants import ALL_FIELDS
@@ -72,6 +74,8 @@ class BaseSerializer(Field):
         ret = OrderedDict()
         for field_name, field in self.fields.items():
             attribute = field.get_attribute(instance)
+            if asyncio.iscoroutine(attribute):
+                attribute = await attribute
             check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
             attr_data = None if check_for_none is None else field.to_representation(attribute)
             if asyncio.iscoroutine(attr_data):
@@ -86,6 +90,27 @@ class BaseSerializer(Field):
 
         return ret
 
+    async def load_related(self, instances):
+        """
+        序列化多个实例前批量加载字段读取的外键关联对象，同一外键的关联对象合并为一次查询，
+        逐个序列化时直接使用实例上缓存的关联对象；嵌套的序列化器继续加载下一层的关联对象
+        """
+        if not instances or not hasattr(instances[0], '_meta'):
+            return
+        model_class = type(instances[0])
+        for field in self.fields.values():
+            if not field.source_attrs:
+                continue
+            if isinstance(field, RelatedField) and field.use_pk_only_optimization() and len(field.source_attrs) == 1:
+                # 只需要外键值
+                continue
+            descriptor = inspect.getattr_static(model_class, field.source_attrs[0], None)
+            if not isinstance(descriptor, AsyncRelationDescriptor):
+                continue
+            related = await descriptor.load_objects(instances)
+            if isinstance(field, BaseSerializer) and len(field.source_attrs) == 1:
+                await field.load_related(related)
+
     async def clean_data(self, instance, field_name, value):
         """
         处理用户自定义的clean_**函数（**为字段名）
@@ -150,10 +175,16 @@ class ListSerializer(BaseSerializer):
         """
         List of object instances -> List of dicts of primitive datatypes.
         """
-        if asyncio.iscoroutine(data) or isinstance(data, AsyncSelectQuery):
-            return [await self.child.to_representation(item) async for item in data]
+        if asyncio.iscoroutine(data):
+            data = await data
+        elif isinstance(data, AsyncSelectQuery):
+            data = [item async for item in data]
         else:
-            return [await self.child.to_representation(item) for item in data]
+            data = list(data)
+
+        # 先批量加载同一页数据的外键关联对象，再逐个序列化
+        await self.child.load_related(data)
+        return [await self.child.to_representation(item) for item in data]
 
     @property
     async def data(self):
@@ -243,4 +274,23 @@ class ModelSerializerMetaclass(DeclarativeFieldsMetaclass):
 
 
 class ModelSerializer(BaseSerializer, metaclass=ModelSerializerMetaclass):
-    pass
+
+    @classmethod
+    def get_select_fields(cls):
+        """
+        序列化用到的模型字段名，用于查询时only()这些字段；
+        有字段的source为'*'（使用整个实例）时无法确定，返回None
+        :return:
+        """
+        model = cls._meta.model
+        if model is None:
+            return None
+        field_names = set()
+        for field_name, field in cls.base_fields.items():
+            source = field.source or field_name
+            if source == '*':
+                return None
+            name = source.split('.', 1)[0]
+            if name in model._meta.fields:
+                field_names.add(name)
+        return field_names
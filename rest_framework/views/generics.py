@@ -12,6 +12,9 @@ from rest_framework.core import exceptions
 from rest_framework.core.exceptions import APIException, ErrorDetail, SkipFilterError
 from rest_framework.core.translation import locale
 from rest_framework.lib.orm import IntegrityError
+from rest_framework.lib.orm.identity import activate_identity_map
+from rest_framework.lib.orm.instrument import activate_query_stats, set_query_label
+from rest_framework.lib.orm.query import AsyncSelectQuery
 from rest_framework.views import mixins
 from rest_framework.conf import settings
 from rest_framework.core.db import models
@@ -64,6 +67,8 @@ class BaseAPIHandler(RequestHandler, BabelTranslatorMixin):
     """
     # 不需要检查xsrf的请求方法
     NOT_CHECK_XSRF_METHOD = ("GET", "HEAD", "OPTIONS")
+    # 请求中执行的SQL的统计，DEBUG模式或设置了QUERY_STATS_SINK时收集
+    query_stats = None
 
     def __init__(self, application, request, **kwargs):
         self.request_data = None
@@ -154,7 +159,8 @@ class BaseAPIHandler(RequestHandler, BabelTranslatorMixin):
             handler_result = handler(*self.path_args, **self.path_kwargs)
             # 如果 handler_result 是 协同对象，则返回 True，其可以基于生成器或 async def 协同程序
             if asyncio.iscoroutine(handler_result):
-                result = yield from handler_result
+                # 在独立的Task中执行，ORM中按Task绑定的状态（连接、identity map等）以请求为范围
+                result = yield asyncio.ensure_future(self.run_handler(handler_result))
             else:
                 result = handler_result
             result = self.finalize_response(result)
@@ -180,6 +186,29 @@ class BaseAPIHandler(RequestHandler, BabelTranslatorMixin):
             if self._prepared_future is not None and not self._prepared_future.done():
                 self._prepared_future.set_result(None)
 
+    async def run_handler(self, handler_result):
+        """
+        执行请求方法对应的协程
+        :param handler_result: 请求方法返回的协程
+        :return:
+        """
+        # 慢查询日志等按该标记记录语句来自哪个handler
+        set_query_label('%s.%s' % (type(self).__name__, self.request.method.lower()))
+        if settings.DEBUG or settings.QUERY_STATS_SINK:
+            self.query_stats = activate_query_stats()
+        return await handler_result
+
+    def on_finish(self):
+        sink = settings.QUERY_STATS_SINK
+        if self.query_stats is not None and sink:
+            if isinstance(sink, str):
+                sink = import_object(sink)
+            try:
+                sink(self, self.query_stats)
+            except Exception:
+                app_log.error("Exception in query stats sink", exc_info=True)
+        super(BaseAPIHandler, self).on_finish()
+
     def write_response(self, data, status_code=status.HTTP_200_OK, headers=None,
                        content_type="application/json", **kwargs):
         if isinstance(data, Response):
@@ -270,6 +299,8 @@ class BaseAPIHandler(RequestHandler, BabelTranslatorMixin):
             raise TypeError("Request return value types must be the Response")
         self.set_status(response.status_code)
         self.set_header('Content-Type', response.content_type)
+        if settings.DEBUG and self.query_stats is not None:
+            self.set_header('Server-Timing', self.query_stats.server_timing())
 
         return self.write(response.data)
 
@@ -312,6 +343,29 @@ class GenericAPIHandler(BaseAPIHandler):
     initial = {}
     filter_class = None
     filter_fields = ()
+    # 是否在请求范围内使用identity map：同一主键的模型实例只构造一次，按主键的get()不再重复查询
+    use_identity_map = False
+    identity_map = None
+    # 是否在请求范围内使用同一个数据库连接（get_queryset()所属的数据库），见connection_context；
+    # 请求中的读查询都会在主库上依次执行
+    use_connection_context = False
+    # 列表查询是否只查询序列化类Meta.fields用到的字段，其他字段（如clean_**方法中使用的）访问时再批量加载
+    only_serializer_fields = False
+
+    async def run_handler(self, handler_result):
+        if self.use_identity_map:
+            self.identity_map = activate_identity_map()
+        if self.use_connection_context:
+            database = self.get_queryset().model_class._meta.database
+            async with database.connection_context():
+                return await super(GenericAPIHandler, self).run_handler(handler_result)
+        return await super(GenericAPIHandler, self).run_handler(handler_result)
+
+    def on_finish(self):
+        if self.identity_map is not None:
+            self.identity_map.clear()
+            self.identity_map = None
+        super(GenericAPIHandler, self).on_finish()
 
     def get_initial(self):
         """
@@ -342,6 +396,23 @@ class GenericAPIHandler(BaseAPIHandler):
             queryset = queryset.select()
         return queryset
 
+    def select_serializer_fields(self, queryset):
+        """
+        对查询序列化类模型的查询only()序列化用到的字段，已指定查询列的不做处理
+        :param queryset:
+        :return:
+        """
+        if not isinstance(queryset, AsyncSelectQuery) or queryset._explicit_selection:
+            return queryset
+        serializer_class = self.get_serializer_class()
+        if not hasattr(serializer_class, 'get_select_fields') or \
+                serializer_class._meta.model is not queryset.model_class:
+            return queryset
+        field_names = serializer_class.get_select_fields()
+        if field_names is None:
+            return queryset
+        return queryset.only(*field_names)
+
     @cached_property
     def load_filter_class(self):
         """
@@ -69,7 +69,10 @@ class ListModelMixin(object):
     """
     async def list(self, *args, **kwargs):
         try:
-            queryset = await self.filter_queryset(self.get_queryset())
+            queryset = self.get_queryset()
+            if self.only_serializer_fields:
+                queryset = self.select_serializer_fields(queryset)
+            queryset = await self.filter_queryset(queryset)
         except SkipFilterError:
             queryset = AsyncEmptyQuery()
 
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+测试使用的数据库：
+AsyncMySQLDatabase的连接池替换为基于sqlite文件的实现（接口与aiomysql相同的子集），
+每个连接是独立的sqlite连接，未提交的数据对其他连接不可见
+"""
+import asyncio
+import itertools
+import sqlite3
+
+import pytest
+
+from rest_framework.lib import orm
+from rest_framework.lib.orm import AsyncMySQLDatabase
+from rest_framework.lib.orm.peewee import Model
+
+database_proxy = orm.Proxy()
+
+_thread_ids = itertools.count(1)
+
+
+class Cursor:
+    """
+    缓冲游标，与aiomysql.Cursor一样在execute时读取全部结果
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self._rows = []
+
+    async def execute(self, sql, args=()):
+        self.connection.executed.append(sql)
+        sql = sql.replace('%s', '?').replace('%%', '%')
+        cursor = self.connection.raw.execute(sql, tuple(args or ()))
+        self.description = cursor.description
+        self.lastrowid = cursor.lastrowid
+        if cursor.description is not None:
+            self._rows = cursor.fetchall()
+            self.rowcount = len(self._rows)
+        else:
+            self._rows = []
+            self.rowcount = cursor.rowcount
+        # 让出控制权，模拟网络往返
+        await asyncio.sleep(0)
+        return self.rowcount
+
+    async def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    async def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    async def close(self):
+        self._rows = []
+
+
+class StreamCursor(Cursor):
+    """
+    对应aiomysql.SSCursor
+    """
+
+
+class Connection:
+
+    def __init__(self, path):
+        self.raw = sqlite3.connect(path, timeout=0.1)
+        self.closed = False
+        self._thread_id = next(_thread_ids)
+        # 在该连接上执行的SQL
+        self.executed = []
+
+    def thread_id(self):
+        return self._thread_id
+
+    async def cursor(self, cursor_class=None):
+        return (cursor_class or Cursor)(self)
+
+    async def commit(self):
+        self.raw.commit()
+
+    async def rollback(self):
+        self.raw.rollback()
+
+    async def ping(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.raw.close()
+
+
+class _Acquirer:
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool._acquire()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.pool._release(self.conn)
+
+
+class Pool:
+
+    def __init__(self, path, minsize=1, maxsize=10):
+        self.path = path
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self._free = []
+        self._used = set()
+        self._released = asyncio.Condition()
+        self.closed = False
+
+    @property
+    def size(self):
+        return len(self._free) + len(self._used)
+
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    def acquire(self):
+        return _Acquirer(self)
+
+    async def _acquire(self):
+        while not self._free and self.size >= self.maxsize:
+            async with self._released:
+                await self._released.wait()
+        conn = self._free.pop() if self._free else Connection(self.path)
+        self._used.add(conn)
+        return conn
+
+    def _release(self, conn):
+        self._used.discard(conn)
+        if not conn.closed:
+            conn.raw.rollback()
+            self._free.append(conn)
+
+        async def notify():
+            async with self._released:
+                self._released.notify()
+        asyncio.ensure_future(notify())
+
+    def close(self):
+        self.closed = True
+        for conn in self._free:
+            conn.close()
+        self._free = []
+
+    async def wait_closed(self):
+        pass
+
+
+class SQLiteTestDatabase(AsyncMySQLDatabase):
+    """
+    SQL由MySQL的编译器生成，sqlite可以执行其中用到的语法（反引号、行值比较、注释形式的优化器提示）
+    """
+
+    async def _connect(self, database, **kwargs):
+        return Pool(database, maxsize=kwargs.get('maxsize', 10))
+
+    async def kill_query(self, conn):
+        pass
+
+    def get_stream_cursor_class(self):
+        return StreamCursor
+
+    def executed(self):
+        """
+        :return: 在所有连接上执行过的SQL
+        """
+        conns = list(self.pool._free) + list(self.pool._used)
+        return [sql for conn in conns for sql in conn.executed]
+
+
+class Author(orm.Model):
+    name = orm.CharField(max_length=64)
+    nickname = orm.CharField(max_length=64, null=True)
+
+    class Meta:
+        database = database_proxy
+        db_table = 'author'
+
+
+class Book(orm.Model):
+    title = orm.CharField(max_length=64)
+    author = orm.ForeignKeyField(Author, related_name='books')
+    pages = orm.IntegerField(default=0)
+    rating = orm.FloatField(null=True)
+
+    class Meta:
+        database = database_proxy
+        db_table = 'book'
+
+
+SCHEMA = (
+    'CREATE TABLE author (id INTEGER PRIMARY KEY AUTOINCREMENT, name VARCHAR(64) NOT NULL, nickname VARCHAR(64))',
+    'CREATE TABLE book (id INTEGER PRIMARY KEY AUTOINCREMENT, title VARCHAR(64) NOT NULL, '
+    'author_id INTEGER NOT NULL REFERENCES author (id), pages INTEGER NOT NULL DEFAULT 0, rating REAL)',
+)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def run(loop):
+    def run(coro):
+        return loop.run_until_complete(coro)
+    return run
+
+
+@pytest.fixture
+def make_db(tmp_path, loop):
+    """
+    :return: 创建测试数据库的函数，参数同AsyncDatabase
+    """
+    path = str(tmp_path / 'test.db')
+    raw = sqlite3.connect(path)
+    for statement in SCHEMA:
+        raw.execute(statement)
+    raw.commit()
+    raw.close()
+
+    databases = []
+
+    def make_db(**kwargs):
+        db = SQLiteTestDatabase(path, loop=loop, **kwargs)
+        databases.append(db)
+        return db
+
+    yield make_db
+    for db in databases:
+        loop.run_until_complete(db.close())
+
+
+@pytest.fixture
+def db(make_db):
+    db = make_db()
+    database_proxy.initialize(db)
+    yield db
+    database_proxy.initialize(None)
+
+
+def snapshot(value, ancestors=()):
+    """
+    :return: 模型实例（包括关联对象、聚合的列表和别名属性）的可比较表示
+    """
+    if isinstance(value, Model):
+        if any(value is ancestor for ancestor in ancestors):
+            # 聚合结果中子对象指回父对象
+            return ('ref', type(value).__name__, value._get_pk_value())
+        ancestors += (value,)
+        return (type(value).__name__, snapshot(vars(value), ancestors))
+    if isinstance(value, dict):
+        return dict((key, snapshot(item, ancestors)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [snapshot(item, ancestors) for item in value]
+    if isinstance(value, set):
+        return sorted(value)
+    return value
+
+
+@pytest.fixture
+def books(db, run):
+    async def go():
+        authors = [await Author.create(name='author %d' % i, nickname='n%d' % i if i % 2 else None)
+                   for i in range(4)]
+        pages = 0
+        for author in authors[:3]:
+            for j in range(authors.index(author) + 1):
+                pages += 10
+                await Book.create(title='Book %d-%d' % (author.id, j), author=author, pages=pages,
+                                  rating=None if pages % 20 else pages / 10.0)
+
+    run(go())
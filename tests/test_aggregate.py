@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+aggregate_rows()的结果与peewee原有的AggregateQueryResultWrapper的结果对比
+"""
+import pytest
+
+from rest_framework.lib.orm import JOIN
+from rest_framework.lib.orm.peewee import AggregateQueryResultWrapper
+
+from conftest import snapshot, Author, Book
+
+FETCH_SIZES = [None, 1, 2, 3, 100]
+
+
+def aggregate_query():
+    return (Author.select(Author, Book)
+            .join(Book, JOIN.LEFT_OUTER)
+            .order_by(Author.id, Book.id)
+            .aggregate_rows())
+
+
+def peewee_aggregate(db, query):
+    """
+    :return: peewee的AggregateQueryResultWrapper在同步的sqlite游标上得到的结果
+    """
+    sql, params = query.sql()
+    raw = db.pool._free[0].raw
+    cursor = raw.execute(sql.replace('%s', '?'), params)
+    return list(AggregateQueryResultWrapper(query.model_class, cursor, query.get_query_meta()))
+
+
+@pytest.mark.usefixtures('books')
+@pytest.mark.parametrize('fetch_size', FETCH_SIZES)
+def test_aggregate_wrapper_matches_peewee(db, run, fetch_size):
+    authors = run(aggregate_query().fetch_size(fetch_size))
+    expected = peewee_aggregate(db, aggregate_query())
+
+    assert [len(author.books) for author in authors] == [1, 2, 3, 0]
+    assert snapshot(authors) == snapshot(expected)
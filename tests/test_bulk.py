@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from rest_framework.lib.orm.identity import identity_map
+from rest_framework.lib.orm.query import AsyncQuery
+
+from conftest import Author
+
+
+class FakeCursor:
+
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+
+
+def stub_execute(monkeypatch):
+    """
+    写查询不再发送到数据库，_AsyncWriteQuery._execute的其余步骤照常执行
+    :return: 执行的语句
+    """
+    executed = []
+
+    async def execute(query):
+        executed.append(query.sql())
+        return FakeCursor(len(query._rows))
+
+    monkeypatch.setattr(AsyncQuery, '_execute', execute)
+    return executed
+
+
+@pytest.fixture
+def upserts(db, monkeypatch):
+    """
+    :return: 执行的插入语句；sqlite不支持ON DUPLICATE KEY UPDATE，只检查生成的SQL
+    """
+    return stub_execute(monkeypatch)
+
+
+def test_upsert_dicts_grouped_by_keys(upserts, run):
+    rows = [
+        {'id': 1, 'name': 'a'},
+        {'id': 2, 'nickname': 'b'},
+        {'id': 3, 'name': 'c'},
+    ]
+    assert run(Author.bulk_upsert(rows)) == 3
+
+    (first, first_params), (second, second_params) = upserts
+    assert first.startswith('INSERT INTO `author` (`id`, `name`) VALUES')
+    assert first.endswith('ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)')
+    assert first_params == [1, 'a', 3, 'c']
+    assert second.startswith('INSERT INTO `author` (`id`, `nickname`) VALUES')
+    assert second.endswith('ON DUPLICATE KEY UPDATE `nickname` = VALUES(`nickname`)')
+    assert second_params == [2, 'b']
+
+
+def test_upsert_instances_only_dirty_fields(upserts, run):
+    author = Author(id=1, name='a', nickname='n')
+    author._dirty.clear()
+    author.name = 'b'
+
+    run(Author.bulk_upsert([author]))
+
+    (sql, params), = upserts
+    # 没有修改的nickname不会被覆盖
+    assert sql.startswith('INSERT INTO `author` (`id`, `name`) VALUES')
+    assert sql.endswith('ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)')
+    assert params == [1, 'b']
+    assert not author._dirty
+
+
+def test_upsert_update_fields_must_be_provided(upserts, run):
+    rows = [{'id': 1, 'name': 'a'}, {'id': 2, 'nickname': 'b'}]
+    with pytest.raises(ValueError):
+        run(Author.bulk_upsert(rows, update_fields=['name']))
+    assert not upserts
+
+
+def test_upsert_evicts_identity_map(db, run, monkeypatch):
+    async def go():
+        author = await Author.create(name='a')
+        async with identity_map():
+            loaded = await Author.get(Author.id == author.id)
+            upserts = stub_execute(monkeypatch)
+            await Author.bulk_upsert([{'id': author.id, 'name': 'b'}])
+            monkeypatch.undo()
+            return len(upserts), loaded, await Author.get(Author.id == author.id)
+
+    count, loaded, reloaded = run(go())
+    assert count == 1
+    # 被覆盖的实例从identity map中移除，之后重新查询
+    assert reloaded is not loaded
+
+
+def test_bulk_update_stores_rows(db, run):
+    async def go():
+        authors = [await Author.create(name='a%d' % i) for i in range(4)]
+        authors[0].name = 'x'
+        authors[1].nickname = 'y'
+        authors[3].name = 'z'
+        authors[3].nickname = 'w'
+        count = await Author.bulk_update(authors, batch_size=2)
+        rows = await Author.select(Author.id, Author.name, Author.nickname).order_by(Author.id).tuples()
+        return count, authors, list(rows)
+
+    count, authors, rows = run(go())
+    assert count == 3
+    assert rows == [(1, 'x', None), (2, 'a1', 'y'), (3, 'a2', None), (4, 'z', 'w')]
+    assert not any(author._dirty for author in authors)
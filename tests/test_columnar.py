@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+列式结果与逐行读取的结果对比
+"""
+import math
+
+import pytest
+
+from rest_framework.lib.orm import fn
+
+from conftest import Author, Book
+
+FETCH_SIZES = [None, 1, 2, 3, 100]
+
+
+def same_value(value, expected):
+    if expected is None and isinstance(value, float):
+        # 数值列的NULL为NaN
+        return math.isnan(value)
+    return value == expected
+
+
+@pytest.mark.usefixtures('books')
+@pytest.mark.parametrize('fetch_size', FETCH_SIZES)
+def test_columns_match_rows(run, fetch_size):
+    queries = [
+        Book.select(Book.id, Book.title, Book.author, Book.pages, Book.rating).order_by(Book.id),
+        Book.select(Book.author, fn.COUNT(Book.id).alias('count')).group_by(Book.author).order_by(Book.author),
+        Book.select(Book.title, Author.name).join(Author).order_by(Book.id),
+    ]
+
+    async def go():
+        for query in queries:
+            columns = await query.columns().fetch_size(fetch_size)
+            rows = await query.tuples()
+            assert len(columns) == len(rows[0])
+            for i, values in enumerate(columns.values()):
+                values = list(values)
+                expected = [row[i] for row in rows]
+                assert len(values) == len(expected)
+                assert all(same_value(value, item) for value, item in zip(values, expected))
+
+    run(go())
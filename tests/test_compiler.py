@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+缓存SQL的编译器与peewee原有的QueryCompiler的结果对比
+"""
+from rest_framework.lib.orm import SQL, fn
+from rest_framework.lib.orm.peewee import QueryCompiler
+
+from conftest import database_proxy, Author, Book
+
+
+def compiler_queries(n):
+    """
+    :param n: 改变参数的值，不改变查询结构
+    """
+    subquery = Author.select(Author.id).where(Author.name != 'author %d' % n)
+    AuthorAlias = Author.alias()
+    return [
+        Book.select(),
+        Book.select().where(Book.pages > n * 10),
+        Book.select().where((Book.pages > n) & (Book.title.contains('b%d' % n)) | (Book.rating >> None)),
+        Book.select().where(Book.id << list(range(n + 1))),
+        Book.select().where(Book.pages.between(n, n + 20)),
+        Book.select().where(Book.author << subquery),
+        Book.select(Book, Author).join(Author).where(Author.name == 'author %d' % n).order_by(Book.id.desc()),
+        Book.select(Book.title, AuthorAlias.name).join(AuthorAlias, on=(Book.author == AuthorAlias.id)),
+        Book.select(Book.author, fn.COUNT(Book.id).alias('n')).group_by(Book.author)
+            .having(fn.COUNT(Book.id) > n).order_by(SQL('n')),
+        Book.select().where(fn.LOWER(Book.title) == 'book %d' % n).limit(n + 1).offset(n),
+        Book.select().where(SQL('`pages` > %s', n)).distinct(),
+        Book.select().paginate(n + 1, 2),
+    ]
+
+
+def test_caching_compiler_matches_query_compiler(db):
+    baseline = QueryCompiler(db.quote_char, db.interpolation, db.field_overrides, db.op_overrides)
+    # 第一轮填充缓存，之后的轮次命中缓存，参数随之变化
+    for n in (1, 2, 3, 1):
+        for query in compiler_queries(n):
+            assert query.sql() == baseline.generate_select(query)
+    assert len(db.sql_cache)
+
+
+def test_caching_compiler_disabled(make_db):
+    db = make_db(sql_cache_size=0)
+    database_proxy.initialize(db)
+    try:
+        baseline = QueryCompiler(db.quote_char, db.interpolation, db.field_overrides, db.op_overrides)
+        for query in compiler_queries(1):
+            assert query.sql() == baseline.generate_select(query)
+    finally:
+        database_proxy.initialize(None)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+
+from rest_framework.lib.orm.instrument import QueryHook
+from rest_framework.lib.orm.utils import gather
+from rest_framework.views.generics import GenericAPIHandler
+
+from conftest import Author, Book
+from test_instrument import BookSerializer, create_books
+
+
+class BookListHandler(GenericAPIHandler):
+    serializer_class = BookSerializer
+    use_connection_context = True
+
+    def get_queryset(self, queryset=None):
+        return Book.select().order_by(Book.id)
+
+    async def get(self):
+        queryset = self.get_queryset()
+        count, books = await gather(queryset.count(), queryset.limit(3))
+        data = await self.get_serializer(books, many=True).data
+        return self.write_response({'count': count, 'results': data})
+
+
+class Recorder(QueryHook):
+
+    def __init__(self):
+        self.events = []
+
+    def after_execute(self, event):
+        self.events.append(event)
+
+
+def test_connection_context_decorator_per_call(db, run, loop):
+    @db.connection_context()
+    async def query():
+        conn = db.pinned_conn()
+        await Author.select()
+        # 让另一个调用同时执行
+        await asyncio.sleep(0)
+        assert db.pinned_conn() is conn
+        return conn
+
+    async def go():
+        return await asyncio.gather(loop.create_task(query()), loop.create_task(query()))
+
+    first, second = run(go())
+    assert first is not second
+    # 顺序调用同样可以重复使用
+    assert run(query()) is not first
+
+
+def test_atomic_decorator_per_call(db, run, loop):
+    @db.atomic()
+    async def query():
+        conn = db.pinned_conn()
+        await asyncio.sleep(0)
+        assert conn.transaction_depth() == 1
+        return conn
+
+    async def go():
+        return await asyncio.gather(loop.create_task(query()), loop.create_task(query()))
+
+    first, second = run(go())
+    assert first is not second
+    assert first.transaction_depth() == second.transaction_depth() == 0
+
+
+def test_atomic_acquires_connection_on_enter(db, run):
+    atomic = db.atomic()
+
+    async def go():
+        async with db.connection_context() as conn:
+            async with atomic:
+                # 进入时复用当前Task绑定的连接
+                assert db.pinned_conn() is conn
+                assert conn.transaction_depth() == 1
+                await Author.create(name='author')
+        return await Author.select().count()
+
+    assert run(go()) == 1
+
+
+def test_handler_connection_context(db, run):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+    app = Application([(r'/books', BookListHandler)])
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+
+    async def go():
+        await create_books(5)
+        recorder.events.clear()
+        return await AsyncHTTPClient().fetch('http://127.0.0.1:%d/books' % port)
+
+    try:
+        response = run(go())
+    finally:
+        server.stop()
+
+    data = json.loads(response.body.decode('utf-8'))
+    assert data['count'] == 5
+    assert len(data['results']) == 3
+    # 并发的总数、数据和外键查询都在同一个连接上依次执行
+    assert len(recorder.events) == 3
+    assert len({event.connection_id for event in recorder.events}) == 1
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+生成的行转换函数与peewee原有的ModelQueryResultWrapper的结果对比
+"""
+import pytest
+
+from rest_framework.lib.orm import JOIN, fn
+from rest_framework.lib.orm.result import AsyncModelQueryResultWrapper
+
+from conftest import snapshot, Author, Book
+
+
+def hydrator_queries():
+    AuthorAlias = Author.alias()
+    return [
+        Book.select(Book, Author).join(Author).order_by(Book.id),
+        Book.select(Book.id, Book.title, Author.name).join(Author).order_by(Book.id),
+        Book.select(Book, Author.name, fn.LOWER(Author.name).alias('lower')).join(Author).order_by(Book.id),
+        Book.select(Book.title, AuthorAlias.name).join(AuthorAlias, on=(Book.author == AuthorAlias.id))
+            .order_by(Book.id),
+        Author.select(Author, Book).join(Book, JOIN.LEFT_OUTER).order_by(Author.id, Book.id),
+    ]
+
+
+@pytest.mark.usefixtures('books')
+def test_hydrator_matches_model_wrapper(run, monkeypatch):
+    async def fetch():
+        return [snapshot(list(await query)) for query in hydrator_queries()]
+
+    hydrated = run(fetch())
+    monkeypatch.setattr(AsyncModelQueryResultWrapper, 'use_hydrator', False)
+    assert hydrated == run(fetch())
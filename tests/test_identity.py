@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from rest_framework.lib.orm.identity import identity_map, get_identity_map, activate_identity_map
+
+from conftest import Author
+
+
+def test_identity_map_decorator(db, run, loop):
+    @identity_map()
+    async def load(author_id):
+        first = await Author.get(Author.id == author_id)
+        await asyncio.sleep(0)
+        second = await Author.get(Author.id == author_id)
+        return first is second, get_identity_map()
+
+    async def go():
+        author = await Author.create(name='author')
+        # 并发的调用各自使用新的IdentityMap
+        return await asyncio.gather(loop.create_task(load(author.id)), loop.create_task(load(author.id)))
+
+    (same, first_map), (other_same, second_map) = run(go())
+    assert same and other_same
+    assert first_map is not second_map
+    assert run(load(1))[0]
+
+
+def test_nested_identity_map_restores_outer(db, run):
+    async def go():
+        author = await Author.create(name='author')
+        outer = activate_identity_map()
+        loaded = await Author.get(Author.id == author.id)
+        async with identity_map() as inner:
+            assert get_identity_map() is inner
+            assert await Author.get(Author.id == author.id) is not loaded
+        assert get_identity_map() is outer
+        assert len(outer) == 1
+        return await Author.get(Author.id == author.id) is loaded
+
+    assert run(go())
+
+
+def test_upsert_evicts_instances(db, run):
+    async def go():
+        author = await Author.create(name='author')
+        async with identity_map():
+            loaded = await Author.get(Author.id == author.id)
+            await Author.insert(id=author.id, name='replaced').upsert()
+            return loaded, await Author.get(Author.id == author.id)
+
+    loaded, reloaded = run(go())
+    assert reloaded is not loaded
+    assert reloaded.name == 'replaced'
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+
+from rest_framework.conf import settings
+from rest_framework.core.pagination import PageNumberPagination
+from rest_framework.lib.orm.instrument import QueryHook, activate_query_stats, get_query_stats
+from rest_framework.lib.orm.utils import gather
+from rest_framework.views.generics import ListAPIHandler
+from rest_framework import serializers
+
+from conftest import Author, Book
+
+
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Author
+        fields = ('id', 'name')
+
+
+class BookSerializer(serializers.ModelSerializer):
+    author = AuthorSerializer()
+
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'author')
+
+
+class ConcurrentPagination(PageNumberPagination):
+    page_size = 3
+    concurrent_count = True
+
+
+class BookListHandler(ListAPIHandler):
+    serializer_class = BookSerializer
+    pagination_class = 'test_instrument.ConcurrentPagination'
+    filter_backend_list = ()
+
+    def get_queryset(self, queryset=None):
+        return Book.select().order_by(Book.id)
+
+
+class Recorder(QueryHook):
+
+    def __init__(self):
+        self.events = []
+
+    def after_execute(self, event):
+        self.events.append(event)
+
+
+@pytest.fixture
+def stats_sink():
+    collected = []
+    settings.DEBUG = True
+    settings.QUERY_STATS_SINK = lambda handler, stats: collected.append(stats)
+    yield collected
+    settings.DEBUG = False
+    settings.QUERY_STATS_SINK = None
+
+
+async def create_books(count):
+    authors = [await Author.create(name='author %d' % i) for i in range(count)]
+    for author in authors:
+        await Book.create(title='book of %s' % author.name, author=author)
+
+
+def test_stats_shared_with_child_tasks(db, run):
+    async def go():
+        await create_books(2)
+        stats = activate_query_stats()
+        await gather(Book.select(), Author.select())
+        assert get_query_stats() is stats
+        return stats
+
+    assert run(go()).count == 2
+
+
+def test_paginated_list_reports_every_statement(db, run, stats_sink):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+    app = Application([(r'/books', BookListHandler)])
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+
+    async def go():
+        await create_books(5)
+        recorder.events.clear()
+        response = await AsyncHTTPClient().fetch('http://127.0.0.1:%d/books?page=2' % port)
+        return response
+
+    try:
+        response = run(go())
+    finally:
+        server.stop()
+
+    data = json.loads(response.body.decode('utf-8'))
+    assert data['count'] == 5
+    assert [book['author']['name'] for book in data['results']] == ['author 3', 'author 4']
+
+    # 总数、当前页和一次批量的外键查询，其中总数与当前页在两个子Task中并发执行
+    sqls = [event.sql for event in recorder.events]
+    assert len(sqls) == 3
+    assert any('COUNT' in sql.upper() for sql in sqls)
+    assert any('`author`' in sql and ' IN ' in sql for sql in sqls)
+    assert all(event.label == 'BookListHandler.get' for event in recorder.events)
+
+    stats, = stats_sink
+    assert stats.count == len(sqls)
+    assert 'desc="3 queries"' in response.headers['Server-Timing']
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from rest_framework.lib.orm.instrument import QueryHook
+from rest_framework.views.generics import ListAPIHandler  # noqa: F401 先于serializers导入，避免循环导入
+from rest_framework import serializers
+
+from conftest import Author, Book
+
+
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Author
+        fields = ('id', 'name')
+
+
+class BookSerializer(serializers.ModelSerializer):
+    author = AuthorSerializer()
+
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'author')
+
+
+class FailingBookSerializer(BookSerializer):
+
+    def __init__(self, *args, **kwargs):
+        super(FailingBookSerializer, self).__init__(*args, **kwargs)
+        self.cleaned = []
+
+    def clean_title(self, instance, value):
+        self.cleaned.append(instance.id)
+        if instance.id == 2:
+            raise ValueError(value)
+        return value
+
+
+class Recorder(QueryHook):
+
+    def __init__(self):
+        self.sqls = []
+
+    def after_execute(self, event):
+        self.sqls.append(event.sql)
+
+    def author_queries(self):
+        return [sql for sql in self.sqls if 'FROM `author`' in sql]
+
+
+async def create_books(count):
+    books = []
+    for i in range(count):
+        author = await Author.create(name='author %d' % i)
+        books.append(await Book.create(title='book %d' % i, author=author))
+    return books
+
+
+def test_load_inside_atomic(db, run):
+    async def go():
+        async with db.atomic():
+            book, = await create_books(1)
+            book = await Book.get(Book.id == book.id)
+            author = await book.author
+            # 事务中插入的数据只有绑定的连接可见
+            return author.name
+
+    assert run(go()) == 'author 0'
+
+
+def test_list_serializer_inside_atomic(db, run):
+    async def go():
+        async with db.atomic():
+            await create_books(3)
+            books = await Book.select().order_by(Book.id)
+            return await BookSerializer(books, many=True).data
+
+    data = run(go())
+    assert [book['author']['name'] for book in data] == ['author 0', 'author 1', 'author 2']
+
+
+def test_list_serializer_batches_related_objects(db, run):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+
+    async def go():
+        await create_books(4)
+        books = await Book.select().order_by(Book.id)
+        recorder.sqls.clear()
+        return await BookSerializer(books, many=True).data
+
+    data = run(go())
+    assert [book['author']['id'] for book in data] == [1, 2, 3, 4]
+    queries = recorder.author_queries()
+    assert len(queries) == 1
+    assert ' IN ' in queries[0]
+
+
+def test_list_serializer_stops_at_failure(db, run):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+
+    async def go():
+        await create_books(3)
+        books = await Book.select().order_by(Book.id)
+        recorder.sqls.clear()
+        serializer = FailingBookSerializer(books, many=True)
+        with pytest.raises(ValueError):
+            await serializer.data
+        return serializer.child.cleaned
+
+    # 出错之后的对象不会继续在后台序列化
+    assert run(go()) == [1, 2]
+    assert len(recorder.author_queries()) == 1
+
+
+def test_separate_tasks_not_batched_together(db, run, loop):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+
+    async def load(book_id):
+        book = await Book.get(Book.id == book_id)
+        return (await book.author).name
+
+    async def go():
+        await create_books(2)
+        recorder.sqls.clear()
+        # 两个独立的Task（如两个请求）各自执行查询
+        return await asyncio.gather(loop.create_task(load(1)), loop.create_task(load(2)))
+
+    assert run(go()) == ['author 0', 'author 1']
+    assert len(recorder.author_queries()) == 2
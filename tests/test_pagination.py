@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, create_signed_value
+
+from rest_framework.core.exceptions import SkipFilterError
+from rest_framework.core.pagination import CursorPagination, PageNumberPagination
+from rest_framework.lib.orm import fn
+from rest_framework.lib.orm.query import AsyncSelectQuery
+from rest_framework.views.generics import ListAPIHandler
+from rest_framework import serializers
+
+from conftest import Author, Book
+
+COOKIE_SECRET = 'secret'
+
+
+class BookSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ('id', 'title')
+
+
+class BookCursorPagination(CursorPagination):
+    page_size = 2
+
+
+class EstimatedPagination(PageNumberPagination):
+    page_size = 2
+    count_strategy = 'estimated'
+    count_estimate_threshold = 1
+    concurrent_count = True
+
+
+class SkipFilter:
+
+    async def filter_queryset(self, request_handler, queryset):
+        raise SkipFilterError()
+
+
+class BookListHandler(ListAPIHandler):
+    serializer_class = BookSerializer
+    pagination_class = 'test_pagination.BookCursorPagination'
+    filter_backend_list = ()
+
+    def get_queryset(self, queryset=None):
+        return Book.select().order_by(Book.id)
+
+
+class EstimatedBookListHandler(BookListHandler):
+    pagination_class = 'test_pagination.EstimatedPagination'
+
+
+class SkippedCursorHandler(BookListHandler):
+    filter_backend_list = ('test_pagination.SkipFilter',)
+
+
+class SkippedLimitOffsetHandler(SkippedCursorHandler):
+    pagination_class = 'rest_framework.core.pagination.LimitOffsetPagination'
+
+
+class ExpressionOrderingHandler(BookListHandler):
+
+    def get_queryset(self, queryset=None):
+        return Book.select().order_by(fn.LOWER(Book.title))
+
+
+@pytest.fixture
+def fetch(db, run):
+    app = Application([
+        (r'/books', BookListHandler),
+        (r'/expression', ExpressionOrderingHandler),
+        (r'/estimated', EstimatedBookListHandler),
+        (r'/skipped/cursor', SkippedCursorHandler),
+        (r'/skipped/limit', SkippedLimitOffsetHandler),
+    ], cookie_secret=COOKIE_SECRET)
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+
+    def fetch(url):
+        if url.startswith('/'):
+            url = 'http://127.0.0.1:%d%s' % (port, url)
+        response = run(AsyncHTTPClient().fetch(url, raise_error=False))
+        return response.code, json.loads(response.body.decode('utf-8'))
+
+    yield fetch
+    server.stop()
+
+
+def create_books(run, count):
+    async def go():
+        author = await Author.create(name='author')
+        for i in range(count):
+            await Book.create(title='book %d' % i, author=author)
+    run(go())
+
+
+def page_ids(data):
+    return [book['id'] for book in data['results']]
+
+
+def test_cursor_pagination_boundaries(fetch, run):
+    create_books(run, 5)
+
+    code, first = fetch('/books')
+    assert code == 200
+    assert page_ids(first) == [1, 2]
+    assert first['previous'] is None and first['next'] is not None
+
+    _, second = fetch(first['next'])
+    assert page_ids(second) == [3, 4]
+    assert second['previous'] is not None and second['next'] is not None
+
+    _, last = fetch(second['next'])
+    assert page_ids(last) == [5]
+    assert last['previous'] is not None and last['next'] is None
+
+    # 从最后一页向前翻回第一页
+    _, back = fetch(last['previous'])
+    assert page_ids(back) == [3, 4]
+    assert back['previous'] is not None and back['next'] is not None
+
+    _, back_first = fetch(back['previous'])
+    assert page_ids(back_first) == [1, 2]
+    assert back_first['previous'] is None and back_first['next'] is not None
+
+
+def test_cursor_pagination_single_page(fetch, run):
+    create_books(run, 2)
+
+    _, data = fetch('/books')
+    assert page_ids(data) == [1, 2]
+    assert data['previous'] is None and data['next'] is None
+
+
+def test_cursor_pagination_expression_ordering(fetch, run):
+    create_books(run, 1)
+
+    code, _ = fetch('/expression')
+    assert code == 400
+
+
+@pytest.mark.parametrize('position', [['abc'], [None], [[1]]])
+def test_cursor_pagination_invalid_position(fetch, run, position):
+    create_books(run, 3)
+    payload = json.dumps({'o': ['book.id'], 'p': position, 'r': False})
+    cursor = create_signed_value(COOKIE_SECRET, 'cursor', payload).decode('ascii')
+
+    code, _ = fetch('/books?cursor=%s' % cursor)
+    assert code == 400
+
+
+def test_estimated_count_with_concurrent_count(fetch, run, monkeypatch):
+    create_books(run, 5)
+
+    async def estimate_count(query):
+        return 5
+
+    monkeypatch.setattr(AsyncSelectQuery, 'estimate_count', estimate_count)
+
+    # 估计值不精确，通过多取一条数据判断是否有下一页
+    _, data = fetch('/estimated?page=2')
+    assert page_ids(data) == [3, 4]
+    assert 'page=3' in data['next']
+
+    _, data = fetch('/estimated?page=3')
+    assert page_ids(data) == [5]
+    assert data['next'] is None
+
+
+def test_skipped_filter_returns_empty_page(fetch, run):
+    create_books(run, 3)
+
+    code, data = fetch('/skipped/limit?offset=1')
+    assert code == 200
+    assert data['count'] == 0 and data['results'] == []
+
+    code, data = fetch('/skipped/cursor')
+    assert code == 200
+    assert data['results'] == []
+    assert data['next'] is None and data['previous'] is None
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from rest_framework.core.cache import caches
+from rest_framework.lib.orm.instrument import QueryHook
+
+from conftest import database_proxy, Author
+
+
+class Recorder(QueryHook):
+
+    def __init__(self):
+        self.sqls = []
+
+    def after_execute(self, event):
+        self.sqls.append(event.sql)
+
+
+@pytest.fixture
+def cached_db(make_db, run):
+    run(caches['default'].clear())
+    db = make_db(query_cache='default')
+    database_proxy.initialize(db)
+    yield db
+    database_proxy.initialize(None)
+    run(caches['default'].clear())
+
+
+def names():
+    return Author.select(Author.name).order_by(Author.id).cache()
+
+
+async def cached_names():
+    return [author.name for author in await names()]
+
+
+def test_query_cache_disabled_by_default(db):
+    assert db.query_cache is None
+    with pytest.raises(ValueError):
+        Author.select().cache()
+
+
+def test_cached_query_not_executed_again(cached_db, run):
+    recorder = Recorder()
+    cached_db.add_query_hook(recorder)
+
+    async def go():
+        await Author.create(name='a')
+        recorder.sqls.clear()
+        return await cached_names(), await cached_names()
+
+    assert run(go()) == (['a'], ['a'])
+    assert len(recorder.sqls) == 1
+
+
+def test_write_queries_invalidate(cached_db, run):
+    async def go():
+        results = [await cached_names()]
+        author = await Author.create(name='a')
+        results.append(await cached_names())
+        await Author.update(name='b').where(Author.id == author.id)
+        results.append(await cached_names())
+        author = await Author.get(Author.id == author.id)
+        author.name = 'c'
+        await author.save()
+        results.append(await cached_names())
+        await author.delete_instance()
+        results.append(await cached_names())
+        return results
+
+    assert run(go()) == [[], ['a'], ['b'], ['c'], []]
+
+
+def test_transaction_invalidates_after_commit(cached_db, run):
+    async def go():
+        await cached_names()
+        async with cached_db.atomic():
+            await Author.create(name='a')
+            # 事务中不读写缓存
+            inside = await cached_names()
+        return inside, await cached_names()
+
+    assert run(go()) == (['a'], ['a'])
+
+
+def test_raw_writes_need_manual_invalidation(cached_db, run):
+    async def go():
+        await cached_names()
+        await Author.raw("INSERT INTO author (name) VALUES ('a')").execute()
+        await cached_db.execute_sql("INSERT INTO author (name) VALUES ('b')")
+        stale = await cached_names()
+        await cached_db.invalidate_tables([Author._meta.db_table])
+        return stale, await cached_names()
+
+    assert run(go()) == ([], ['a', 'b'])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from rest_framework.lib.orm.instrument import QueryHook
+
+from conftest import Author
+
+
+class Recorder(QueryHook):
+
+    def __init__(self):
+        self.events = []
+
+    def after_execute(self, event):
+        self.events.append(event)
+
+    def databases(self):
+        return [event.database for event in self.events]
+
+
+@pytest.fixture
+def replica(db, make_db):
+    replica = make_db()
+    db.set_replicas([replica], read_after_write=60)
+    return replica
+
+
+def test_select_uses_replica(db, replica, run):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+
+    async def go():
+        await Author.select()
+        await Author.create(name='author')
+        await Author.select()
+
+    run(go())
+    # 写操作之后的读查询使用主库
+    assert recorder.databases() == [replica, db, db]
+
+
+def test_raw_select_not_marked_as_write(db, replica, run):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+
+    async def go():
+        await Author.raw('SELECT * FROM author')
+        await Author.select().limit(1).count()
+        await db.execute_sql('SELECT 1')
+        await Author.select()
+
+    run(go())
+    assert recorder.databases() == [replica, replica, db, replica]
+
+
+def test_raw_write_marked_as_write(db, replica, run):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+
+    async def go():
+        await Author.raw("INSERT INTO author (name) VALUES ('author')").execute()
+        await Author.select()
+
+    run(go())
+    assert recorder.databases() == [db, db]
+
+
+def test_execute_sql_write_marked_as_write(db, replica, run):
+    recorder = Recorder()
+    db.add_query_hook(recorder)
+
+    async def go():
+        await db.execute_sql("INSERT INTO author (name) VALUES ('author')")
+        await Author.select()
+
+    run(go())
+    assert recorder.databases() == [db, db]
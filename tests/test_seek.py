@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from conftest import Author, Book
+
+RATINGS = [None, 1.0, None, 2.0, 1.0, None]
+
+
+@pytest.fixture
+def books(db, run):
+    async def go():
+        author = await Author.create(name='author')
+        for i, rating in enumerate(RATINGS):
+            await Book.create(title='book %d' % i, author=author, rating=rating)
+        return [book.id for book in await Book.select().order_by(Book.id)]
+
+    return run(go())
+
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+@pytest.mark.parametrize('mixed', [False, True])
+def test_seek_nullable_ordering(books, run, order, mixed):
+    ordering = [getattr(Book.rating, order)()]
+    if mixed:
+        # 排序方向不一致
+        ordering.append(Book.id.desc() if order == 'asc' else Book.id.asc())
+    query = Book.select().order_by(*ordering)
+
+    async def go():
+        rows = await query.seek()
+        ids = [row.id for row in rows]
+        for i, row in enumerate(rows):
+            after = [book.id for book in await query.seek(after=query.cursor_for(row))]
+            before = [book.id for book in await query.seek(before=query.cursor_for(row))]
+            assert after == ids[i + 1:]
+            assert before == ids[:i]
+        return ids
+
+    ids = run(go())
+    # MySQL的排序规则：NULL最小，升序时排在最前
+    ratings = dict(zip(books, RATINGS))
+    nulls = [book_id for book_id in ids if ratings[book_id] is None]
+    if order == 'asc':
+        assert ids[:len(nulls)] == nulls
+    else:
+        assert ids[-len(nulls):] == nulls
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from conftest import database_proxy, Author
+
+
+@pytest.fixture
+def timeouts(make_db, monkeypatch):
+    """
+    :return: 执行的语句使用的超时时间
+    """
+    db = make_db(statement_timeout=5)
+    database_proxy.initialize(db)
+    timeouts = []
+    add_timeout_hint = db.add_timeout_hint
+
+    def record(sql, timeout):
+        timeouts.append(timeout)
+        return add_timeout_hint(sql, timeout)
+
+    monkeypatch.setattr(db, 'add_timeout_hint', record)
+    yield timeouts
+    database_proxy.initialize(None)
+
+
+def test_select_uses_default_timeout(timeouts, run):
+    run(Author.select())
+    run(Author.select().timeout(2))
+    run(Author.select().timeout(0))
+    assert timeouts == [5, 2]
+
+
+def test_stream_ignores_default_timeout(timeouts, run):
+    async def go():
+        await Author.create(name='author')
+        del timeouts[:]
+        rows = [row async for row in Author.select().iterator(stream=True)]
+        rows += [row async for row in Author.select().timeout(2).iterator(stream=True)]
+        return rows
+
+    assert len(run(go())) == 2
+    assert timeouts == [2]
+
+
+def test_estimate_count_uses_timeout(timeouts, run):
+    run(Author.select().where(Author.name == 'author').estimate_count())
+    run(Author.select().where(Author.name == 'author').timeout(2).estimate_count())
+    assert timeouts == [5, 2]